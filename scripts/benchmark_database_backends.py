@@ -0,0 +1,63 @@
+"""
+Compares query throughput and latency of the executor and aiomysql database backends under
+concurrent load.
+
+Usage:
+    python scripts/benchmark_database_backends.py [--queries N] [--concurrency N] [--sql SQL]
+
+Connects to the database configured by the DB_* environment variables and runs the same
+read-only query --queries times on each backend with --concurrency queries in flight.
+Pool sizes and timeouts come from DB_POOL_* and DB_EXECUTOR_WORKERS, so both backends get the
+same number of connections.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from torrent_agent.database.async_database_connector import AsyncDatabaseConnector
+from torrent_agent.database.database_connector import DatabaseConnector
+
+async def run_load(connector, sql, queries, concurrency):
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def timed_query():
+        async with semaphore:
+            started_at = time.perf_counter()
+            await connector.query(sql)
+            latencies.append(time.perf_counter() - started_at)
+
+    # One query first, so opening the pool isn't counted.
+    await connector.query(sql)
+    started_at = time.perf_counter()
+    await asyncio.gather(*(timed_query() for _ in range(queries)))
+    return time.perf_counter() - started_at, latencies
+
+def report(label, elapsed, latencies):
+    latencies = sorted(latencies)
+    p50 = statistics.median(latencies) * 1000
+    p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000
+    print(f"{label}: {len(latencies)} queries in {elapsed:.2f}s ({len(latencies) / elapsed:.0f} queries/s), p50 {p50:.1f}ms, p95 {p95:.1f}ms")
+
+async def benchmark(args):
+    executor_connector = DatabaseConnector()
+    print(f"executor backend: {executor_connector.pool_size} connections, {executor_connector.executor._max_workers} threads")
+    report("executor", *await run_load(executor_connector, args.sql, args.queries, args.concurrency))
+
+    async_connector = AsyncDatabaseConnector()
+    print(f"aiomysql backend: {async_connector.min_size}-{async_connector.max_size} connections")
+    try:
+        report("aiomysql", *await run_load(async_connector, args.sql, args.queries, args.concurrency))
+    finally:
+        await async_connector.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--sql", default="SELECT id, filename FROM videos LIMIT 10")
+    asyncio.run(benchmark(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Compares the wall time of a single-process transcode with a segmented transcode.
+
+Usage:
+    python scripts/benchmark_segmented_transcode.py [input_file] [--duration SECONDS] [--segments N] [--local-workers N] [--hosts HOST,HOST]
+
+Without an input file a test clip (testsrc2 video and a sine tone) of --duration seconds is
+generated. Remote hosts default to none, so only local workers are measured unless --hosts is given.
+Both outputs are checked with the same duration and stream count check the agent uses.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from torrent_agent.video.ffmpeg_runner import run_ffmpeg
+from torrent_agent.video.segmented_transcoder import SegmentedTranscoder
+from torrent_agent.video.video_converter import VideoConverter
+from torrent_agent.video.video_probe import CONVERSION_FULL_TRANSCODE, probe_video
+
+async def generate_sample(path, duration):
+    await run_ffmpeg([
+        "ffmpeg", "-y",
+        "-f", "lavfi", "-i", f"testsrc2=size=1280x720:rate=25:duration={duration}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:duration={duration}",
+        "-c:v", "mpeg4", "-q:v", "5", "-g", "50", "-c:a", "mp3", path,
+    ], duration=duration)
+
+async def benchmark(args):
+    work_dir = tempfile.mkdtemp(prefix="segmented_benchmark_")
+    input_file = args.input_file
+    if input_file is None:
+        input_file = os.path.join(work_dir, "sample.avi")
+        print(f"Generating a {args.duration}s sample clip...")
+        await generate_sample(input_file, args.duration)
+
+    probe = await probe_video(input_file)
+    print(f"Source: {probe.duration:.1f}s, {probe.width}x{probe.height} {probe.video_codec}/{probe.audio_codec}")
+
+    hosts = [host for host in args.hosts.split(",") if host] if args.hosts else []
+    transcoder = SegmentedTranscoder(local_workers=args.local_workers, segment_count=args.segments, hosts=hosts)
+    converter = VideoConverter(threads=args.threads, segmented_transcoder=transcoder)
+
+    single_output = os.path.join(work_dir, "single.mp4")
+    started_at = time.monotonic()
+    await run_ffmpeg(["ffmpeg", "-y", "-i", input_file] + converter.build_output_args(CONVERSION_FULL_TRANSCODE) + [single_output], duration=probe.duration)
+    single_time = time.monotonic() - started_at
+    await transcoder.verify(probe, single_output)
+
+    segmented_output = os.path.join(work_dir, "segmented.mp4")
+    started_at = time.monotonic()
+    await transcoder.transcode(input_file, segmented_output, probe, converter.video_encode_args(), converter.audio_encode_args())
+    segmented_time = time.monotonic() - started_at
+
+    print(f"Single process: {single_time:.1f}s")
+    print(f"Segmented ({transcoder.segment_count} segments, {transcoder.local_workers} local workers, {len(hosts)} remote hosts): {segmented_time:.1f}s")
+    print(f"Speedup: {single_time / segmented_time:.2f}x")
+    print(f"Outputs are in {work_dir}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input_file", nargs="?")
+    parser.add_argument("--duration", type=int, default=120, help="Length of the generated sample clip in seconds")
+    parser.add_argument("--segments", type=int, default=None)
+    parser.add_argument("--local-workers", type=int, default=max(1, (os.cpu_count() or 1) // 2))
+    parser.add_argument("--threads", type=int, default=2, help="ffmpeg threads per encode")
+    parser.add_argument("--hosts", default="", help="Comma separated remote hosts to encode segments on")
+    asyncio.run(benchmark(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""
+Measures files dispatched per minute by RemoteProcessor with the pooled SSH connection
+against the previous behaviour of opening a new connection for each probe and the copy,
+and with the whole batch planned from one probe of the host.
+
+Usage:
+    python scripts/benchmark_ssh_pool.py [--files N] [--size-kb N] [--auth-delay SECONDS]
+
+The remote host is an in-process paramiko SSH server on localhost. SCP uploads from the
+previous flow are discarded; other commands run in a shell, with their stdin, and SFTP is
+served with remote paths mapped into a temporary directory, so RemoteProcessor's checksum-verified uploads
+complete for real. --auth-delay adds a delay to every authentication to stand in for a
+slow handshake on a Pi.
+"""
+import argparse
+import logging
+import os
+import shlex
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+
+os.environ.setdefault("IS_REMOTE_AGENT_HOST", "0")
+os.environ.setdefault("REMOTE_AGENT_HOSTS", "127.0.0.1")
+
+import paramiko
+from scp import SCPClient
+
+from torrent_agent.remote.chunked_upload import ChunkedUploader
+from torrent_agent.remote.remote_processor import RemoteProcessor
+from torrent_agent.remote.ssh_pool import SSHConnectionPool
+
+PASSWORD = "benchmark"
+CONNECT_KWARGS = {"password": PASSWORD, "look_for_keys": False, "allow_agent": False}
+REMOTE_ROOT = tempfile.mkdtemp(prefix="ssh_pool_benchmark_remote_")
+
+def remote_to_local(path):
+    return REMOTE_ROOT + path if path.startswith("/") else os.path.join(REMOTE_ROOT, path)
+
+class StubSFTPHandle(paramiko.SFTPHandle):
+    def stat(self):
+        return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+
+    def chattr(self, attr):
+        if attr.st_size is not None:
+            self.readfile.truncate(attr.st_size)
+        return paramiko.SFTP_OK
+
+class StubSFTPServer(paramiko.SFTPServerInterface):
+    def open(self, path, flags, attr):
+        try:
+            descriptor = os.open(remote_to_local(path), flags, 0o644)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        handle = StubSFTPHandle(flags)
+        handle.readfile = handle.writefile = os.fdopen(descriptor, "r+b" if flags & (os.O_WRONLY | os.O_RDWR) else "rb")
+        return handle
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(remote_to_local(path)))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def posix_rename(self, old_path, new_path):
+        os.replace(remote_to_local(old_path), remote_to_local(new_path))
+        return paramiko.SFTP_OK
+
+class StubServer(paramiko.ServerInterface):
+    def __init__(self, auth_delay):
+        self.auth_delay = auth_delay
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_auth_password(self, username, password):
+        time.sleep(self.auth_delay)
+        return paramiko.AUTH_SUCCESSFUL if password == PASSWORD else paramiko.AUTH_FAILED
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=handle_command, args=(channel, command.decode()), daemon=True).start()
+        return True
+
+def handle_command(channel, command):
+    exit_status = 0
+    try:
+        if command.startswith("scp ") and " -t " in f" {command} ":
+            receive_scp(channel)
+        elif command.startswith("df "):
+            channel.sendall(b"100\n")
+        else:
+            exit_status = run_command(channel, command)
+    finally:
+        # Signal EOF and leave closing the channel to the client. Closing it here could beat
+        # the server's reply to the exec request.
+        channel.send_exit_status(exit_status)
+        channel.shutdown_write()
+
+def run_command(channel, command):
+    """
+    Run a command in a shell with remote paths mapped into REMOTE_ROOT, passing on what the
+    client writes to its stdin, and send back its output.
+    """
+    remote_home, local_home = b"/home/", f"{REMOTE_ROOT}/home/".encode()
+    with tempfile.TemporaryFile() as output:
+        process = subprocess.Popen(["sh", "-c", command.replace("/home/", f"{REMOTE_ROOT}/home/")], stdin=subprocess.PIPE, stdout=output, stderr=subprocess.DEVNULL)
+        while process.poll() is None:
+            try:
+                if channel.recv_ready():
+                    process.stdin.write(channel.recv(32768).replace(remote_home, local_home))
+                    process.stdin.flush()
+                    continue
+                if channel.eof_received and not process.stdin.closed:
+                    process.stdin.close()
+            except BrokenPipeError:
+                pass
+            time.sleep(0.001)
+        output.seek(0)
+        channel.sendall(output.read().replace(local_home, remote_home))
+        return process.returncode
+
+def receive_scp(channel):
+    channel.sendall(b"\0")
+    while True:
+        line = read_line(channel)
+        if not line:
+            return
+        if line.startswith(b"C"):
+            size = int(line.split()[1])
+            channel.sendall(b"\0")
+            remaining = size + 1  # the data is followed by a \0
+            while remaining:
+                chunk = channel.recv(min(remaining, 32768))
+                if not chunk:
+                    return
+                remaining -= len(chunk)
+        channel.sendall(b"\0")
+
+def read_line(channel):
+    line = b""
+    while not line.endswith(b"\n"):
+        byte = channel.recv(1)
+        if not byte:
+            return line
+        line += byte
+    return line
+
+def serve(listener, host_key, auth_delay):
+    while True:
+        client, _ = listener.accept()
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        transport = paramiko.Transport(client)
+        transport.add_server_key(host_key)
+        transport.set_subsystem_handler("sftp", paramiko.SFTPServer, StubSFTPServer)
+        transport.start_server(server=StubServer(auth_delay))
+
+def legacy_dispatch(port, local_path, remote_path):
+    """
+    The previous RemoteProcessor flow: a fresh connection for each of the three steps.
+    """
+    def connect():
+        ssh = paramiko.SSHClient()
+        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        ssh.connect("127.0.0.1", port=port, username="pi", **CONNECT_KWARGS)
+        return ssh
+
+    ssh = connect()
+    stdin, stdout, stderr = ssh.exec_command(f"df -BG --output=avail \"$(dirname '{remote_path}')\" | tail -1 | tr -dc '0-9'")
+    stdout.read()
+    ssh.close()
+
+    ssh = connect()
+    stdin, stdout, stderr = ssh.exec_command(f"test -f {remote_path} && echo exists || echo missing")
+    stdout.read()
+    ssh.close()
+
+    ssh = connect()
+    stdin, stdout, stderr = ssh.exec_command(f"mkdir -p {shlex.quote(os.path.dirname(remote_path))}")
+    stdout.channel.recv_exit_status()
+    with SCPClient(ssh.get_transport()) as scp:
+        scp.put(local_path, remote_path)
+    ssh.close()
+    os.remove(local_path)
+
+def make_files(directory, count, size_kb):
+    paths = []
+    for index in range(count):
+        path = os.path.join(directory, f"file_{index}.mkv")
+        with open(path, "wb") as file:
+            file.write(os.urandom(size_kb * 1024))
+        paths.append(path)
+    return paths
+
+def report(label, count, elapsed):
+    print(f"{label}: {count} files in {elapsed:.2f}s ({count / elapsed * 60:.0f} files/min)")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=50)
+    parser.add_argument("--size-kb", type=int, default=256)
+    parser.add_argument("--auth-delay", type=float, default=0.0)
+    args = parser.parse_args()
+    # The stub server's transports log every client disconnect.
+    logging.getLogger("paramiko").setLevel(logging.CRITICAL)
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(100)
+    port = listener.getsockname()[1]
+    threading.Thread(target=serve, args=(listener, paramiko.RSAKey.generate(2048), args.auth_delay), daemon=True).start()
+
+    work_dir = tempfile.mkdtemp(prefix="ssh_pool_benchmark_")
+
+    paths = make_files(work_dir, args.files, args.size_kb)
+    started_at = time.monotonic()
+    for path in paths:
+        legacy_dispatch(port, path, f"/home/pi/conversions/{os.path.basename(path)}")
+    report("Connection per step", len(paths), time.monotonic() - started_at)
+
+    processor = RemoteProcessor()
+    processor.hosts = ["127.0.0.1"]
+    processor.ssh_pool = SSHConnectionPool(processor.get_username, port=port, connect_kwargs=CONNECT_KWARGS)
+    processor.uploader = ChunkedUploader(processor.ssh_pool, processor._exec)
+    paths = make_files(work_dir, args.files, args.size_kb)
+    started_at = time.monotonic()
+    for path in paths:
+        processor.process_file(path)
+    report("Pooled connection", len(paths), time.monotonic() - started_at)
+    leftover = [path for path in paths if os.path.exists(path)]
+    if leftover:
+        print(f"{len(leftover)} files were not dispatched by the pooled run")
+
+    # A directory of its own, so the files don't land on the copies from the previous run.
+    paths = make_files(tempfile.mkdtemp(prefix="ssh_pool_benchmark_"), args.files, args.size_kb)
+    started_at = time.monotonic()
+    plan = processor.plan_dispatch("127.0.0.1", paths)
+    for path in paths:
+        processor.process_file(path, "127.0.0.1", planned=plan[path])
+    report("Pooled connection, batch planned", len(paths), time.monotonic() - started_at)
+    leftover = [path for path in paths if os.path.exists(path)]
+    if leftover:
+        print(f"{len(leftover)} files were not dispatched by the batch planned run")
+    processor.ssh_pool.close_all()
+
+if __name__ == "__main__":
+    main()
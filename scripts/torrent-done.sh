@@ -0,0 +1,23 @@
+#!/bin/bash
+
+# Transmission torrent-done hook for the torrent agent.
+# Posts the completed torrent's path to the agent's ingest endpoint so it is
+# processed straight away instead of on the next scan.
+#
+# Enable it in Transmission's settings.json (with the daemon stopped):
+#   "script-torrent-done-enabled": true,
+#   "script-torrent-done-filename": "/opt/torrent_agent/scripts/torrent-done.sh"
+# and start the agent with INGEST_SERVER_ENABLED=1.
+
+INGEST_URL="${INGEST_URL:-http://127.0.0.1:${INGEST_SERVER_PORT:-8003}/ingest}"
+
+if [ -z "$TR_TORRENT_DIR" ] || [ -z "$TR_TORRENT_NAME" ]; then
+    echo "TR_TORRENT_DIR and TR_TORRENT_NAME must be set by Transmission." >&2
+    exit 1
+fi
+
+# A failed post isn't fatal: the agent's next scan picks the torrent up anyway.
+curl --silent --show-error --max-time 10 \
+    --data-urlencode "path=$TR_TORRENT_DIR/$TR_TORRENT_NAME" \
+    "$INGEST_URL" || echo "Could not reach the torrent agent at $INGEST_URL." >&2
+exit 0
@@ -9,6 +9,7 @@ setup(
     packages=find_packages(),
     install_requires=[
         'mysql-connector-python',
+        'aiomysql',
         'prometheus-client',
         'asyncio',      
         'python-dotenv', 
@@ -0,0 +1,76 @@
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+
+import pytest
+import redis
+
+from torrent_agent.database.cache.redis_connector import RedisConnector
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+@pytest.fixture(scope="session")
+def redis_server():
+    """
+    (host, port) of a Redis server for the tests: REDIS_TEST_URL if set, otherwise a
+    redis-server started from PATH for the session.
+    """
+    url = os.getenv("REDIS_TEST_URL")
+    if url:
+        client = redis.Redis.from_url(url)
+        kwargs = client.connection_pool.connection_kwargs
+        client.close()
+        yield kwargs["host"], kwargs["port"]
+        return
+
+    executable = shutil.which("redis-server")
+    if executable is None:
+        pytest.skip("redis-server is not installed and REDIS_TEST_URL is not set")
+    port = _free_port()
+    work_dir = tempfile.mkdtemp(prefix="redis-test-")
+    process = subprocess.Popen(
+        [executable, "--port", str(port), "--bind", "127.0.0.1", "--save", "", "--appendonly", "no", "--dir", work_dir],
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        client = redis.Redis(port=port)
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                client.ping()
+                break
+            except redis.ConnectionError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+        client.close()
+        yield "127.0.0.1", port
+    finally:
+        process.terminate()
+        process.wait()
+        shutil.rmtree(work_dir, True)
+
+@pytest.fixture
+def redis_connector(redis_server):
+    """
+    A fresh RedisConnector pointed at an empty test database.
+    """
+    host, port = redis_server
+    client = redis.Redis(host=host, port=port)
+    client.flushdb()
+    client.close()
+
+    RedisConnector._instance = None
+    connector = RedisConnector()
+    connector.host = host
+    connector.port = port
+    connector.password = None
+    connector.db = 0
+    yield connector
+    RedisConnector._instance = None
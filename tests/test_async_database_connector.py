@@ -0,0 +1,160 @@
+import asyncio
+
+import pytest
+
+aiomysql = pytest.importorskip("aiomysql")
+
+from torrent_agent.database.async_database_connector import AsyncDatabaseConnector
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.lastrowid = None
+        self.rowcount = 0
+        self.rows = []
+
+    async def execute(self, sql, params=None):
+        await self.connection.pool.run(sql, params)
+        self.lastrowid = len(self.connection.pool.statements)
+        self.rowcount = 1
+        self.rows = [(self.lastrowid,)]
+
+    async def executemany(self, sql, rows):
+        for params in rows:
+            await self.connection.pool.run(sql, params)
+        self.rowcount = len(rows)
+
+    async def fetchall(self):
+        return self.rows
+
+    async def fetchone(self):
+        return self.rows[0]
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+class FakeConnection:
+    def __init__(self, pool):
+        self.pool = pool
+        self.closed = False
+        self.calls = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    async def begin(self):
+        self.calls.append("begin")
+
+    async def commit(self):
+        self.calls.append("commit")
+
+    async def rollback(self):
+        self.calls.append("rollback")
+
+    def close(self):
+        self.closed = True
+
+class FakePool:
+    """
+    Stands in for an aiomysql pool. Statements fail with the queued errors, in order, and
+    acquire() fails with the queued acquire errors.
+    """
+
+    def __init__(self):
+        self.statements = []
+        self.errors = []
+        self.acquire_errors = []
+        self.connections = []
+        self.released = []
+        self.delay = 0
+
+    async def acquire(self):
+        if self.acquire_errors:
+            raise self.acquire_errors.pop(0)
+        connection = FakeConnection(self)
+        self.connections.append(connection)
+        return connection
+
+    def release(self, connection):
+        self.released.append(connection)
+
+    async def run(self, sql, params):
+        self.statements.append((sql, params))
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.errors:
+            raise self.errors.pop(0)
+
+    def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
+
+def lost_connection():
+    return aiomysql.OperationalError(2013, "Lost connection to MySQL server during query")
+
+@pytest.fixture
+def pool(monkeypatch):
+    pool = FakePool()
+
+    async def create_pool(**kwargs):
+        return pool
+
+    monkeypatch.setattr(aiomysql, "create_pool", create_pool)
+    monkeypatch.setattr(AsyncDatabaseConnector, "_instance", None)
+    return pool
+
+@pytest.fixture
+def connector(pool):
+    connector = AsyncDatabaseConnector()
+    connector.query_timeout = 1
+    return connector
+
+def test_query_is_retried_after_a_lost_connection(pool, connector):
+    pool.errors = [lost_connection()]
+    assert asyncio.run(connector.query("SELECT 1")) == [(2,)]
+    assert len(pool.statements) == 2
+    # The connection that failed isn't handed to the next caller.
+    assert pool.connections[0].closed
+    assert not pool.connections[1].closed
+
+def test_insert_is_not_retried_once_it_was_sent(pool, connector):
+    pool.errors = [lost_connection()]
+    with pytest.raises(aiomysql.OperationalError):
+        asyncio.run(connector.insert("INSERT INTO videos (name) VALUES (%s)", ("a",)))
+    assert len(pool.statements) == 1
+
+def test_update_is_not_retried_once_it_was_sent(pool, connector):
+    pool.errors = [lost_connection()]
+    with pytest.raises(aiomysql.OperationalError):
+        asyncio.run(connector.execute("UPDATE video_conversions SET conversion_status = 'converting' WHERE id = %s", (1,)))
+    assert len(pool.statements) == 1
+
+def test_insert_is_retried_when_no_connection_could_be_made(pool, connector):
+    pool.acquire_errors = [aiomysql.OperationalError(2003, "Can't connect to MySQL server")]
+    assert asyncio.run(connector.insert("INSERT INTO videos (name) VALUES (%s)", ("a",))) == 1
+    assert len(pool.statements) == 1
+
+def test_failed_insert_many_is_rolled_back_once(pool, connector):
+    pool.errors = [lost_connection()]
+    with pytest.raises(aiomysql.OperationalError):
+        asyncio.run(connector.insert_many("INSERT INTO episodes (video_id) VALUES (%s)", [(1,), (2,)]))
+    assert len(pool.connections) == 1
+    assert pool.connections[0].calls == ["begin", "rollback"]
+
+def test_insert_many_commits_once(pool, connector):
+    assert asyncio.run(connector.insert_many("INSERT INTO episodes (video_id) VALUES (%s)", [(1,), (2,)])) == 2
+    assert pool.connections[0].calls == ["begin", "commit"]
+    assert asyncio.run(connector.insert_many("INSERT INTO episodes (video_id) VALUES (%s)", [])) == 0
+
+def test_slow_query_is_abandoned_and_its_connection_closed(pool, connector):
+    connector.query_timeout = 0.05
+    pool.delay = 1
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(connector.query("SELECT SLEEP(1)"))
+    assert pool.connections[0].closed
+    assert pool.released == pool.connections
@@ -0,0 +1,167 @@
+import os
+import subprocess
+from contextlib import contextmanager
+
+import paramiko
+import pytest
+
+from torrent_agent.remote.chunked_upload import PART_SUFFIX, WRITE_SLICE_SIZE, ChunkedUploader
+from torrent_agent.remote.transfer_manager import TokenBucket, TransferProgress
+
+CHUNK_SIZE = 64 * 1024
+
+class LocalSFTPFile:
+    """
+    A file on the "remote host", which is the local file system, that can drop the connection
+    after a number of bytes.
+    """
+
+    def __init__(self, sftp, path, mode):
+        self.sftp = sftp
+        self.file = open(path, mode)
+
+    def set_pipelined(self, pipelined):
+        pass
+
+    def truncate(self, size):
+        self.file.truncate(size)
+
+    def seek(self, offset):
+        self.file.seek(offset)
+
+    def write(self, data):
+        if self.sftp.fail_after is not None:
+            if self.sftp.fail_after <= 0:
+                self.sftp.fail_after = None
+                raise paramiko.SSHException("Connection dropped")
+            self.sftp.fail_after -= len(data)
+        self.sftp.writes.append(len(data))
+        self.file.write(data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.file.close()
+
+class LocalSFTP:
+    def __init__(self):
+        self.fail_after = None
+        self.writes = []
+
+    def open(self, path, mode):
+        return LocalSFTPFile(self, path, mode)
+
+    def posix_rename(self, source, destination):
+        os.replace(source, destination)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+class LocalSSH:
+    def __init__(self):
+        self.sftp = LocalSFTP()
+
+    def open_sftp(self):
+        return self.sftp
+
+class LocalSSHPool:
+    def __init__(self):
+        self.ssh = LocalSSH()
+
+    @contextmanager
+    def session(self, host):
+        yield self.ssh
+
+def run_locally(ssh, command):
+    result = subprocess.run(["sh", "-c", command], capture_output=True, text=True)
+    return result.returncode, result.stdout, result.stderr
+
+@pytest.fixture
+def uploader():
+    return ChunkedUploader(LocalSSHPool(), run_locally, chunk_size=CHUNK_SIZE, max_attempts=3)
+
+@pytest.fixture
+def local_file(tmp_path):
+    path = tmp_path / "local" / "video.mkv"
+    path.parent.mkdir()
+    path.write_bytes(os.urandom(CHUNK_SIZE * 5 + 123))
+    return path
+
+def test_upload_writes_the_file_and_removes_the_part(uploader, local_file, tmp_path):
+    remote_path = tmp_path / "remote" / "video.mkv"
+    progress = []
+
+    assert uploader.upload("host", str(local_file), str(remote_path), lambda *update: progress.append(update))
+    assert remote_path.read_bytes() == local_file.read_bytes()
+    assert not os.path.exists(str(remote_path) + PART_SUFFIX)
+    assert progress[0] == (0, local_file.stat().st_size, False)
+    assert progress[-1] == (local_file.stat().st_size, local_file.stat().st_size, True)
+
+def test_upload_resumes_after_the_connection_drops(uploader, local_file, tmp_path):
+    remote_path = tmp_path / "remote" / "video.mkv"
+    sftp = uploader.ssh_pool.ssh.sftp
+    sftp.fail_after = CHUNK_SIZE * 3
+    progress = []
+
+    assert uploader.upload("host", str(local_file), str(remote_path), lambda *update: progress.append(update))
+    assert remote_path.read_bytes() == local_file.read_bytes()
+    # The second attempt starts from the three chunks that made it across.
+    assert (CHUNK_SIZE * 3, local_file.stat().st_size, False) in progress
+    assert sum(sftp.writes) == local_file.stat().st_size
+
+def test_upload_resends_from_the_first_chunk_that_differs(uploader, local_file, tmp_path):
+    remote_path = tmp_path / "remote" / "video.mkv"
+    remote_path.parent.mkdir()
+    contents = bytearray(local_file.read_bytes())
+    contents[CHUNK_SIZE * 2 + 10] ^= 0xFF
+    (tmp_path / "remote" / ("video.mkv" + PART_SUFFIX)).write_bytes(bytes(contents[:CHUNK_SIZE * 4]))
+    sftp = uploader.ssh_pool.ssh.sftp
+
+    assert uploader.upload("host", str(local_file), str(remote_path))
+    assert remote_path.read_bytes() == local_file.read_bytes()
+    assert sum(sftp.writes) == local_file.stat().st_size - CHUNK_SIZE * 2
+
+def test_upload_fails_when_the_remote_copy_does_not_match(uploader, local_file, tmp_path, monkeypatch):
+    remote_path = tmp_path / "remote" / "video.mkv"
+    original_write = LocalSFTPFile.write
+    monkeypatch.setattr(LocalSFTPFile, "write", lambda self, data: original_write(self, bytes(len(data))))
+
+    assert not uploader.upload("host", str(local_file), str(remote_path))
+    assert not remote_path.exists()
+
+def test_matches_remote(uploader, local_file, tmp_path):
+    remote_path = tmp_path / "remote.mkv"
+    ssh = uploader.ssh_pool.ssh
+    assert not uploader.matches_remote(ssh, str(local_file), str(remote_path))
+
+    remote_path.write_bytes(local_file.read_bytes())
+    assert uploader.matches_remote(ssh, str(local_file), str(remote_path))
+
+    remote_path.write_bytes(local_file.read_bytes()[:-1])
+    assert not uploader.matches_remote(ssh, str(local_file), str(remote_path))
+
+def test_bandwidth_limit_is_taken_before_every_slice(local_file, tmp_path):
+    uploader = ChunkedUploader(LocalSSHPool(), run_locally, chunk_size=WRITE_SLICE_SIZE * 4, max_attempts=1)
+    local_file.write_bytes(os.urandom(WRITE_SLICE_SIZE * 6))
+    sftp = uploader.ssh_pool.ssh.sftp
+    bucket = TokenBucket(rate=1)
+    consumed = []
+
+    def consume(amount):
+        # Each slice has to be paid for before it is written.
+        assert sum(sftp.writes) == sum(consumed)
+        consumed.append(amount)
+        return 0.0
+
+    bucket.consume = consume
+    progress = TransferProgress("host", "host:1", bucket)
+    try:
+        assert uploader.upload("host", str(local_file), str(tmp_path / "remote.mkv"), progress.update)
+    finally:
+        progress.clear()
+    assert consumed == [WRITE_SLICE_SIZE] * 6
+    assert sftp.writes == [WRITE_SLICE_SIZE] * 6
@@ -0,0 +1,80 @@
+import asyncio
+import time
+
+from torrent_agent.video.conversion_job_queue import ConversionJobQueue
+
+class Entry:
+    def __init__(self, input_file, video_id=None):
+        self.input_file = input_file
+        self.video_id = video_id
+        self.enqueued_at = 0.0
+        self.heap_item = None
+        self.is_converted = False
+        self.is_failed = False
+
+def run_job(queue):
+    """
+    Takes the next job off the queue and finishes it the way a conversion worker does.
+    """
+    entry = asyncio.run(queue.get())
+    entry.is_converted = True
+    queue.task_done(entry)
+    return entry
+
+def test_finished_entries_can_still_be_looked_up():
+    queue = ConversionJobQueue()
+    entry = Entry("/a.mkv", video_id=1)
+    queue.put_nowait(entry)
+    run_job(queue)
+
+    assert queue.get_entry("/a.mkv") is entry
+    assert queue.get_entry_by_video_id(1) is entry
+    assert "/a.mkv" not in queue._by_input_file
+
+def test_least_recently_used_finished_entries_are_evicted():
+    queue = ConversionJobQueue(finished_limit=2)
+    for number in range(3):
+        queue.put_nowait(Entry(f"/{number}.mkv", video_id=number))
+    run_job(queue)
+    run_job(queue)
+    # Looking /0.mkv up keeps it over /1.mkv when the third job finishes.
+    assert queue.get_entry("/0.mkv") is not None
+    run_job(queue)
+
+    assert queue.get_entry("/0.mkv") is not None
+    assert queue.get_entry("/1.mkv") is None
+    assert queue.get_entry_by_video_id(1) is None
+    assert queue.get_entry("/2.mkv") is not None
+    assert len(queue._finished) == len(queue._finished_by_video_id) == 2
+
+def test_finished_job_can_be_queued_again():
+    queue = ConversionJobQueue()
+    queue.put_nowait(Entry("/a.mkv", video_id=1))
+    run_job(queue)
+
+    again = Entry("/a.mkv", video_id=1)
+    assert queue.put_nowait(again)
+    assert queue.get_entry("/a.mkv") is again
+    assert not queue._finished
+
+def test_removed_job_is_not_remembered_when_it_finishes():
+    queue = ConversionJobQueue()
+    queue.put_nowait(Entry("/a.mkv"))
+    entry = asyncio.run(queue.get())
+    queue.remove("/a.mkv")
+    queue.task_done(entry)
+    assert queue.get_entry("/a.mkv") is None
+
+def test_oldest_age_is_the_first_pending_entry():
+    queue = ConversionJobQueue()
+    assert queue.oldest_age() == 0
+    queue.put_nowait(Entry("/a.mkv"))
+    queue.put_nowait(Entry("/b.mkv"))
+    queue._pending["/a.mkv"].enqueued_at = time.monotonic() - 60
+    assert 60 <= queue.oldest_age() < 61
+
+    assert queue.reprioritize("/b.mkv")
+    assert run_job(queue).input_file == "/b.mkv"
+    assert 60 <= queue.oldest_age() < 61
+    run_job(queue)
+    assert queue.oldest_age() == 0
@@ -0,0 +1,94 @@
+import asyncio
+
+from torrent_agent.common.utils import file_name_to_cdn_path
+from torrent_agent.video.conversion_stream import STATUS_COMPLETED, STATUS_FAILED, ConversionStream
+from torrent_agent.video.video_conversion_queue import VideoConversionQueue
+
+class RecordingVideosDAO:
+    def __init__(self):
+        self.updates = []
+
+    async def update_video_details(self, video_id, file_name, cdn_path, is_browser_friendly=False):
+        self.updates.append((video_id, file_name, cdn_path, is_browser_friendly))
+
+class RecordingConversionsDAO:
+    def __init__(self):
+        self.statuses = []
+
+    async def update_conversion_status(self, conversion_id, status, error_message=None):
+        self.statuses.append((conversion_id, status, error_message))
+
+def make_queue(redis_connector):
+    queue = VideoConversionQueue(RecordingVideosDAO(), RecordingConversionsDAO(), worker_count=1, threads_per_encode=1)
+    queue.stream = ConversionStream(redis_connector, consumer="control", lease_seconds=30, max_deliveries=3, block_seconds=0.1)
+    return queue
+
+async def record_results(queue):
+    """
+    One pass of the control agent's results consumer.
+    """
+    for result_id, fields in await queue.stream.read_results():
+        await queue._record_result(fields)
+        await queue.stream.ack_result(result_id)
+
+def run(redis_connector, coroutine):
+    async def run_and_close():
+        try:
+            return await coroutine
+        finally:
+            if redis_connector.redis is not None:
+                await redis_connector.close()
+                redis_connector.redis = None
+
+    return asyncio.run(run_and_close())
+
+def test_completed_job_from_another_agent_is_recorded(redis_connector, tmp_path):
+    input_file = tmp_path / "episode.mkv"
+    input_file.write_bytes(b"original")
+    output_file = str(tmp_path / "episode.mp4")
+
+    async def scenario():
+        queue = make_queue(redis_connector)
+        remote_agent = ConversionStream(redis_connector, consumer="remote", lease_seconds=30, max_deliveries=3, block_seconds=0.1)
+        await queue.stream.publish({"conversion_id": 7, "video_id": 3, "input_file": str(input_file), "output_file": output_file})
+        job_id, fields = await remote_agent.next_job()
+        await remote_agent.finish(job_id, fields, STATUS_COMPLETED, output_format="mp4")
+
+        await record_results(queue)
+        assert queue.conversion_dao.statuses == [(7, "completed", None)]
+        assert queue.video_repository.updates == [(3, output_file, file_name_to_cdn_path(output_file), True)]
+        assert not input_file.exists()
+        assert await queue.stream.read_results() == []
+
+    run(redis_connector, scenario())
+
+def test_failed_job_from_another_agent_is_recorded(redis_connector, tmp_path):
+    input_file = tmp_path / "movie.mkv"
+    input_file.write_bytes(b"original")
+
+    async def scenario():
+        queue = make_queue(redis_connector)
+        remote_agent = ConversionStream(redis_connector, consumer="remote", lease_seconds=30, max_deliveries=3, block_seconds=0.1)
+        await queue.stream.publish({"conversion_id": 8, "video_id": 4, "input_file": str(input_file), "output_file": str(tmp_path / "movie.mp4")})
+        job_id, fields = await remote_agent.next_job()
+        await remote_agent.finish(job_id, fields, STATUS_FAILED, error_message="ffmpeg exited with 1")
+
+        await record_results(queue)
+        assert queue.conversion_dao.statuses == [(8, "failed", "ffmpeg exited with 1")]
+        assert queue.video_repository.updates == []
+        assert input_file.exists()
+
+    run(redis_connector, scenario())
+
+def test_results_recorded_by_their_worker_are_only_acked(redis_connector, tmp_path):
+    async def scenario():
+        queue = make_queue(redis_connector)
+        await queue.stream.publish({"conversion_id": 9, "video_id": 5, "input_file": str(tmp_path / "a.mkv"), "output_file": str(tmp_path / "a.mp4")})
+        job_id, fields = await queue.stream.next_job()
+        await queue.stream.finish(job_id, fields, STATUS_COMPLETED, recorded=1)
+
+        await record_results(queue)
+        assert queue.conversion_dao.statuses == []
+        assert queue.video_repository.updates == []
+
+    run(redis_connector, scenario())
@@ -0,0 +1,120 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+from torrent_agent.video.conversion_job_queue import ConversionJobQueue
+from torrent_agent.video.conversion_scheduler import (
+    FALLBACK_BYTES_PER_SECOND,
+    POLICY_ENTERTAINMENT_TYPE,
+    POLICY_NEWEST_FIRST,
+    POLICY_SHORTEST_JOB_FIRST,
+    TYPE_TIER_SECONDS,
+    ConversionScheduler,
+    entertainment_type_of,
+)
+from torrent_agent.video.video_probe import VideoProbe
+
+class Entry:
+    def __init__(self, input_file, probe=None, video_id=None):
+        self.input_file = input_file
+        self.probe = probe
+        self.video_id = video_id
+        self.enqueued_at = 0.0
+        self.heap_item = None
+        self.is_converted = False
+        self.is_failed = False
+
+def probe(duration, video_codec="hevc", audio_codec="aac", width=1920, height=1080):
+    return VideoProbe(video_codec=video_codec, pix_fmt="yuv420p", audio_codec=audio_codec, width=width, height=height, duration=duration, video_streams=1, audio_streams=1)
+
+def drain(queue):
+    async def get_all():
+        return [(await queue.get()).input_file for _ in range(queue.qsize())]
+
+    return asyncio.run(get_all())
+
+def test_cost_scales_with_duration_resolution_and_conversion_mode():
+    scheduler = ConversionScheduler(policy=POLICY_SHORTEST_JOB_FIRST, aging_factor=0)
+    full_hd = scheduler.estimate_cost(Entry("/a.mkv", probe(3600)))
+    assert full_hd == pytest.approx(3600)
+    assert scheduler.estimate_cost(Entry("/a.mkv", probe(3600, width=3840, height=2160))) == pytest.approx(4 * full_hd)
+    assert scheduler.estimate_cost(Entry("/a.mkv", probe(3600, video_codec="h264", audio_codec="dts"))) < full_hd / 10
+    assert scheduler.estimate_cost(Entry("/a.mkv", probe(3600, video_codec="h264"))) < scheduler.estimate_cost(Entry("/a.mkv", probe(3600, video_codec="h264", audio_codec="dts")))
+
+def test_cost_of_an_unprobed_file_comes_from_its_size(tmp_path):
+    scheduler = ConversionScheduler(policy=POLICY_SHORTEST_JOB_FIRST, aging_factor=0)
+    video = tmp_path / "video.avi"
+    video.write_bytes(bytes(FALLBACK_BYTES_PER_SECOND * 3))
+    assert scheduler.estimate_cost(Entry(str(video))) == pytest.approx(3)
+    assert scheduler.estimate_cost(Entry(str(tmp_path / "missing.avi"))) == 0.0
+
+def test_shortest_job_runs_first():
+    queue = ConversionJobQueue(ConversionScheduler(policy=POLICY_SHORTEST_JOB_FIRST, aging_factor=0))
+    queue.put_nowait(Entry("/long.mkv", probe(7200)))
+    queue.put_nowait(Entry("/remux.mkv", probe(7200, video_codec="h264")))
+    queue.put_nowait(Entry("/short.mkv", probe(600)))
+    assert drain(queue) == ["/remux.mkv", "/short.mkv", "/long.mkv"]
+
+def test_newest_download_runs_first(tmp_path):
+    queue = ConversionJobQueue(ConversionScheduler(policy=POLICY_NEWEST_FIRST, aging_factor=0))
+    now = time.time()
+    for name, age in [("old.mkv", 3 * 86400), ("new.mkv", 60), ("older.mkv", 30 * 86400)]:
+        video = tmp_path / name
+        video.write_bytes(b"video")
+        os.utime(video, (now - age, now - age))
+        queue.put_nowait(Entry(str(video), probe(600)))
+    assert [os.path.basename(path) for path in drain(queue)] == ["new.mkv", "old.mkv", "older.mkv"]
+
+def test_type_policy_orders_by_type_then_cost():
+    scheduler = ConversionScheduler(policy=POLICY_ENTERTAINMENT_TYPE, aging_factor=0, type_priority=["tv", "movies"])
+    queue = ConversionJobQueue(scheduler)
+    queue.put_nowait(Entry("/mnt/ext1/torrents/movies/film.mkv", probe(600)))
+    queue.put_nowait(Entry("/mnt/ext1/torrents/other/clip.mkv", probe(60)))
+    queue.put_nowait(Entry("/mnt/ext1/torrents/tv/show/long.mkv", probe(3000)))
+    queue.put_nowait(Entry("/mnt/ext1/torrents/tv/show/short.mkv", probe(1500)))
+    assert drain(queue) == [
+        "/mnt/ext1/torrents/tv/show/short.mkv",
+        "/mnt/ext1/torrents/tv/show/long.mkv",
+        "/mnt/ext1/torrents/movies/film.mkv",
+        "/mnt/ext1/torrents/other/clip.mkv",
+    ]
+    assert scheduler.score(Entry("/mnt/ext1/torrents/movies/film.mkv", probe(0.0))) >= TYPE_TIER_SECONDS
+
+def test_waiting_jobs_age_ahead_of_cheaper_new_ones():
+    scheduler = ConversionScheduler(policy=POLICY_SHORTEST_JOB_FIRST, aging_factor=1.0)
+    waiting = Entry("/waiting.mkv", probe(3600))
+    waiting.enqueued_at = 1000.0
+    cheaper = Entry("/cheaper.mkv", probe(600))
+    cheaper.enqueued_at = 1000.0 + 3600
+    # After waiting an hour, an hour-long encode counts for less than a new ten-minute one.
+    assert scheduler.sort_key(waiting) < scheduler.sort_key(cheaper)
+
+    cheaper.enqueued_at = 1000.0 + 60
+    assert scheduler.sort_key(cheaper) < scheduler.sort_key(waiting)
+
+def test_reprioritized_job_runs_first():
+    queue = ConversionJobQueue(ConversionScheduler(policy=POLICY_SHORTEST_JOB_FIRST, aging_factor=0))
+    queue.put_nowait(Entry("/short.mkv", probe(60)))
+    queue.put_nowait(Entry("/long.mkv", probe(7200)))
+    assert queue.reprioritize("/long.mkv")
+    assert drain(queue) == ["/long.mkv", "/short.mkv"]
+
+def test_unknown_policy_falls_back_to_shortest_job_first():
+    assert ConversionScheduler(policy="fastest", aging_factor=0).policy == POLICY_SHORTEST_JOB_FIRST
+
+def test_mean_time_to_playable():
+    scheduler = ConversionScheduler(policy=POLICY_SHORTEST_JOB_FIRST, aging_factor=0)
+    assert scheduler.mean_time_to_playable() == 0.0
+    for waited in (10, 30):
+        entry = Entry("/a.mkv")
+        entry.enqueued_at = time.monotonic() - waited
+        scheduler.record_playable(entry)
+    assert scheduler.mean_time_to_playable() == pytest.approx(20, abs=1)
+
+def test_entertainment_type_of():
+    assert entertainment_type_of("/mnt/ext1/torrents/tv/show/episode.mkv") == "tv"
+    assert entertainment_type_of("/mnt/ext1/torrents/movies/film.mkv") == "movies"
+    assert entertainment_type_of("/mnt/ext1/torrents/film.mkv") is None
+    assert entertainment_type_of("/mnt/ext1/film.mkv") is None
@@ -0,0 +1,164 @@
+import asyncio
+
+from torrent_agent.video.conversion_stream import JOBS_STREAM, RESULTS_STREAM, STATUS_COMPLETED, STATUS_FAILED, WORKERS_GROUP, ConversionStream
+
+def job_fields(number):
+    return {"conversion_id": number, "video_id": number, "input_file": f"/media/video_{number}.mkv", "output_file": f"/media/video_{number}.mp4"}
+
+def make_stream(redis_connector, consumer, **kwargs):
+    kwargs.setdefault("lease_seconds", 30)
+    kwargs.setdefault("max_deliveries", 3)
+    kwargs.setdefault("block_seconds", 0.1)
+    return ConversionStream(redis_connector, consumer=consumer, **kwargs)
+
+def run(redis_connector, coroutine):
+    async def run_and_close():
+        try:
+            return await coroutine
+        finally:
+            if redis_connector.redis is not None:
+                await redis_connector.close()
+                redis_connector.redis = None
+
+    return asyncio.run(run_and_close())
+
+def test_publish_read_and_finish(redis_connector):
+    async def scenario():
+        stream = make_stream(redis_connector, "agent-a")
+        job_id = await stream.publish(job_fields(1))
+
+        read_id, fields = await stream.next_job()
+        assert read_id == job_id
+        assert fields["input_file"] == "/media/video_1.mkv"
+        assert await stream.pending_count() == 1
+        assert await stream.queued_input_files() == {"/media/video_1.mkv"}
+
+        await stream.finish(job_id, fields, STATUS_COMPLETED)
+        assert await stream.pending_count() == 0
+        assert await stream.queued_input_files() == set()
+        assert await stream.next_job() is None
+
+        results = await stream.read_results()
+        assert len(results) == 1
+        result_id, result = results[0]
+        assert result["job_id"] == job_id
+        assert result["status"] == STATUS_COMPLETED
+        assert result["worker"] == "agent-a"
+        await stream.ack_result(result_id)
+        assert await stream.read_results() == []
+
+    run(redis_connector, scenario())
+
+def test_each_job_goes_to_one_worker(redis_connector):
+    async def scenario():
+        stream = make_stream(redis_connector, "agent-a")
+        published = {await stream.publish(job_fields(number)) for number in range(5)}
+
+        jobs = await asyncio.gather(*(stream.next_job() for _ in range(5)))
+        assert {job_id for job_id, _ in jobs} == published
+
+    run(redis_connector, scenario())
+
+def test_restart_resumes_own_jobs_once_each_across_workers(redis_connector):
+    async def scenario():
+        before_restart = make_stream(redis_connector, "agent-a")
+        published = [await before_restart.publish(job_fields(number)) for number in range(4)]
+        for _ in published:
+            await before_restart.next_job()
+
+        # After a restart every worker of the agent asks the new stream for a job at once.
+        after_restart = make_stream(redis_connector, "agent-a")
+        jobs = await asyncio.gather(*(after_restart.next_job() for _ in range(6)))
+        resumed = [job[0] for job in jobs if job is not None]
+        assert sorted(resumed) == sorted(published)
+        assert jobs.count(None) == 2
+
+    run(redis_connector, scenario())
+
+def test_resumed_job_taken_over_meanwhile_is_skipped(redis_connector):
+    async def scenario():
+        before_restart = make_stream(redis_connector, "agent-a", lease_seconds=0.2)
+        job_id = await before_restart.publish(job_fields(1))
+        await before_restart.next_job()
+
+        after_restart = make_stream(redis_connector, "agent-a", lease_seconds=0.2)
+        after_restart._own_pending.extend(await after_restart._read_own_pending())
+        after_restart._own_pending_read = True
+
+        await asyncio.sleep(0.3)
+        other_agent = make_stream(redis_connector, "agent-b", lease_seconds=0.2)
+        assert (await other_agent.next_job())[0] == job_id
+
+        assert await after_restart.next_job() is None
+
+    run(redis_connector, scenario())
+
+def test_abandoned_job_is_taken_over_after_the_lease(redis_connector):
+    async def scenario():
+        dead_agent = make_stream(redis_connector, "agent-a", lease_seconds=0.2)
+        job_id = await dead_agent.publish(job_fields(1))
+        await dead_agent.next_job()
+
+        other_agent = make_stream(redis_connector, "agent-b", lease_seconds=0.2)
+        assert await other_agent.next_job() is None
+
+        await asyncio.sleep(0.3)
+        other_agent._last_stale_claim = 0.0
+        taken_id, fields = await other_agent.next_job()
+        assert taken_id == job_id
+        assert fields["input_file"] == "/media/video_1.mkv"
+
+        pending = await redis_connector.xpending_range(JOBS_STREAM, WORKERS_GROUP, job_id, job_id, 1)
+        assert pending[0]["consumer"] == "agent-b"
+
+    run(redis_connector, scenario())
+
+def test_renewed_job_is_not_taken_over(redis_connector):
+    async def scenario():
+        busy_agent = make_stream(redis_connector, "agent-a", lease_seconds=0.3)
+        job_id = await busy_agent.publish(job_fields(1))
+        await busy_agent.next_job()
+
+        other_agent = make_stream(redis_connector, "agent-b", lease_seconds=0.3)
+        for _ in range(3):
+            await asyncio.sleep(0.15)
+            await busy_agent.renew(job_id)
+            other_agent._last_stale_claim = 0.0
+            assert await other_agent.next_job() is None
+
+    run(redis_connector, scenario())
+
+def test_job_abandoned_too_often_is_given_up_on(redis_connector):
+    async def scenario():
+        dead_agent = make_stream(redis_connector, "agent-a", lease_seconds=0.2, max_deliveries=1)
+        job_id = await dead_agent.publish(job_fields(1))
+        await dead_agent.next_job()
+
+        await asyncio.sleep(0.3)
+        other_agent = make_stream(redis_connector, "agent-b", lease_seconds=0.2, max_deliveries=1)
+        assert await other_agent.next_job() is None
+        assert await other_agent.pending_count() == 0
+        assert await other_agent.queued_input_files() == set()
+
+        results = await redis_connector.xrange(RESULTS_STREAM)
+        assert len(results) == 1
+        _, result = results[0]
+        assert result["job_id"] == job_id
+        assert result["status"] == STATUS_FAILED
+        assert result["error_message"] == "Abandoned by 1 workers"
+
+    run(redis_connector, scenario())
+
+def test_failed_job_is_reported_with_its_error(redis_connector):
+    async def scenario():
+        stream = make_stream(redis_connector, "agent-a")
+        job_id = await stream.publish(job_fields(1))
+        _, fields = await stream.next_job()
+        assert await stream.next_job() is None
+        assert await stream.pending_count() == 1
+
+        await stream.finish(job_id, fields, STATUS_FAILED, error_message="ffmpeg exited with 1")
+        _, result = (await stream.read_results())[0]
+        assert result["error_message"] == "ffmpeg exited with 1"
+
+    run(redis_connector, scenario())
@@ -0,0 +1,122 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+from torrent_agent.scan import ingest_server
+from torrent_agent.scan.ingest_server import MAX_BODY_BYTES, IngestServer
+
+@pytest.fixture
+def media(tmp_path):
+    media = tmp_path / "media"
+    (media / "torrents" / "Film").mkdir(parents=True)
+    (media / "torrents" / "Film" / "film.mkv").write_bytes(b"video")
+    (tmp_path / "outside").mkdir()
+    (tmp_path / "outside" / "secret.mkv").write_bytes(b"video")
+    return media
+
+def send(media, *requests, settle=0.0, close_after_sending=False):
+    """
+    Sends each raw request on its own connection to an ingest server for media, optionally
+    closing the sending side so the server sees the end of the stream.
+    Returns the (status, message) answers and the paths handed to the handler.
+    """
+    ingested = []
+
+    async def handler(path):
+        ingested.append(path)
+
+    async def scenario():
+        server = IngestServer(handler, str(media), port=0)
+        await server.start()
+        port = server._server.sockets[0].getsockname()[1]
+        answers = []
+        try:
+            for request in requests:
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                writer.write(request)
+                await writer.drain()
+                if close_after_sending:
+                    writer.write_eof()
+                response = await asyncio.wait_for(reader.read(), 5)
+                writer.close()
+                head, body = response.split(b"\r\n\r\n", 1)
+                answers.append((int(head.split(b" ")[1]), json.loads(body)["message"]))
+            await asyncio.sleep(settle)
+        finally:
+            await server.stop()
+        return answers
+
+    return asyncio.run(scenario()), ingested
+
+def post(body, content_type="application/json", target="/ingest", content_length=None):
+    body = body.encode() if isinstance(body, str) else body
+    length = len(body) if content_length is None else content_length
+    return f"POST {target} HTTP/1.1\r\nHost: localhost\r\nContent-Type: {content_type}\r\nContent-Length: {length}\r\n\r\n".encode() + body
+
+def post_path(path):
+    return post(json.dumps({"path": str(path)}))
+
+def test_path_in_the_media_directory_is_ingested(media):
+    film = media / "torrents" / "Film"
+    answers, ingested = send(media, post_path(film), post(f"path={film}/film.mkv", "application/x-www-form-urlencoded"), settle=0.05)
+    assert [status for status, _ in answers] == [202, 202]
+    assert ingested == [str(film), str(film / "film.mkv")]
+
+def test_dot_dot_out_of_the_media_directory_is_forbidden(media):
+    answers, ingested = send(media, post_path(f"{media}/torrents/../../outside/secret.mkv"))
+    assert answers[0][0] == 403
+    assert ingested == []
+
+def test_symlink_out_of_the_media_directory_is_forbidden(media):
+    os.symlink(media.parent / "outside", media / "torrents" / "link")
+    answers, ingested = send(media, post_path(media / "torrents" / "link" / "secret.mkv"), post_path(media / "torrents" / "link"))
+    assert [status for status, _ in answers] == [403, 403]
+    assert ingested == []
+
+def test_sibling_directory_with_the_same_prefix_is_forbidden(media):
+    sibling = media.parent / "media-other"
+    sibling.mkdir()
+    answers, _ = send(media, post_path(sibling))
+    assert answers[0][0] == 403
+
+def test_missing_path_is_not_found(media):
+    answers, _ = send(media, post_path(media / "torrents" / "Missing"), post(json.dumps({})))
+    assert [status for status, _ in answers] == [404, 400]
+
+def test_oversized_body_is_rejected_before_it_is_read(media):
+    answers, ingested = send(media, post(b"", content_length=MAX_BODY_BYTES + 1))
+    assert answers[0][0] == 413
+    assert ingested == []
+
+def test_unknown_route_and_wrong_method(media):
+    answers, _ = send(
+        media,
+        post(json.dumps({"path": str(media)}), target="/upload"),
+        b"GET /ingest HTTP/1.1\r\n\r\n",
+        b"GET /health HTTP/1.1\r\n\r\n",
+    )
+    assert [status for status, _ in answers] == [404, 405, 200]
+
+@pytest.mark.parametrize("request_bytes", [
+    b"GARBAGE\r\n\r\n",
+    b"\r\n",
+    b"POST /ingest HTTP/1.1\r\nNo colon here\r\n\r\n",
+    b"POST /ingest HTTP/1.1\r\nContent-Length: twelve\r\n\r\n",
+    b"POST /ingest HTTP/1.1\r\nContent-Type: application/json\r\nContent-Length: 8\r\n\r\n{\"path\":",
+])
+def test_malformed_request_is_a_bad_request(media, request_bytes):
+    answers, ingested = send(media, request_bytes)
+    assert answers[0][0] == 400
+    assert ingested == []
+
+def test_body_cut_short_is_a_bad_request(media):
+    answers, _ = send(media, post(b'{"path": "/m', content_length=100), close_after_sending=True)
+    assert answers[0][0] == 400
+
+def test_stalled_request_times_out(media, monkeypatch):
+    monkeypatch.setattr(ingest_server, "REQUEST_TIMEOUT_SECONDS", 0.1)
+    answers, ingested = send(media, post(b'{"path": "/m', content_length=100))
+    assert answers[0][0] == 408
+    assert ingested == []
@@ -0,0 +1,90 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+from torrent_agent.scan.media_watcher import IN_Q_OVERFLOW, MediaWatcher
+
+pytestmark = pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify is Linux only")
+
+DEBOUNCE_SECONDS = 0.1
+
+def watch(root, scenario, ignored_paths=None):
+    """
+    Runs scenario(watcher) with a watcher on root and returns the batches handed to the handler.
+    """
+    batches = []
+
+    async def handler(paths):
+        batches.append(sorted(paths))
+
+    async def run():
+        watcher = MediaWatcher(str(root), handler, debounce_seconds=DEBOUNCE_SECONDS, ignored_paths=ignored_paths)
+        watcher.start()
+        try:
+            await scenario(watcher)
+            await asyncio.sleep(DEBOUNCE_SECONDS * 4)
+        finally:
+            watcher.stop()
+
+    asyncio.run(run())
+    return batches
+
+def test_written_file_is_reported_once_it_is_quiet(tmp_path):
+    video = tmp_path / "video.mkv"
+
+    async def scenario(watcher):
+        for _ in range(3):
+            with open(video, "ab") as f:
+                f.write(b"data")
+            await asyncio.sleep(DEBOUNCE_SECONDS / 4)
+
+    assert watch(tmp_path, scenario) == [[str(video)]]
+
+def test_file_moved_in_is_reported(tmp_path):
+    root = tmp_path / "media"
+    root.mkdir()
+    outside = tmp_path / "incoming.mkv"
+    outside.write_bytes(b"data")
+
+    async def scenario(watcher):
+        os.rename(outside, root / "video.mkv")
+
+    assert watch(root, scenario) == [[str(root / "video.mkv")]]
+
+def test_new_directories_are_watched_and_their_files_reported(tmp_path):
+    root = tmp_path / "media"
+    (root / "tv").mkdir(parents=True)
+    downloaded = tmp_path / "Show S01"
+    downloaded.mkdir()
+    (downloaded / "e01.mkv").write_bytes(b"data")
+
+    async def scenario(watcher):
+        # A directory moved in complete, then a file written into it once it is watched.
+        os.rename(downloaded, root / "tv" / "Show S01")
+        await asyncio.sleep(0.05)
+        (root / "tv" / "Show S01" / "e02.mkv").write_bytes(b"data")
+
+    batches = watch(root, scenario)
+    assert [path for batch in batches for path in batch] == [
+        str(root / "tv" / "Show S01"),
+        str(root / "tv" / "Show S01" / "e01.mkv"),
+        str(root / "tv" / "Show S01" / "e02.mkv"),
+    ]
+
+def test_ignored_paths_are_not_reported(tmp_path):
+    (tmp_path / ".segments_1").mkdir()
+
+    async def scenario(watcher):
+        (tmp_path / ".segments_1" / "part.mkv").write_bytes(b"data")
+        (tmp_path / "video.mkv").write_bytes(b"data")
+
+    assert watch(tmp_path, scenario, ignored_paths=["/.segments_"]) == [[str(tmp_path / "video.mkv")]]
+
+def test_queue_overflow_requests_a_full_scan(tmp_path):
+    async def scenario(watcher):
+        watcher._handle_event(-1, IN_Q_OVERFLOW, "")
+        assert watcher.rescan_requested.is_set()
+
+    assert watch(tmp_path, scenario) == []
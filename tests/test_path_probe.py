@@ -0,0 +1,162 @@
+import os
+import shlex
+import subprocess
+import time
+from contextlib import contextmanager
+
+import pytest
+
+from torrent_agent.remote.path_probe import (
+    ACTION_MISSING,
+    ACTION_NO_SPACE,
+    ACTION_SEND,
+    ACTION_VERIFY,
+    REMOTE_PROBE_SCRIPT,
+    FreeSpaceCache,
+    parse_probe_output,
+)
+from torrent_agent.remote.remote_processor import RemoteProcessor
+
+GB = 1024 ** 3
+
+class ScriptedHost:
+    """
+    Stands in for a remote host: answers each probe from the paths it was asked about,
+    and records the requests.
+    """
+
+    def __init__(self, files=None, free_bytes=None, devices=None):
+        self.files = files or {}
+        self.free_bytes = free_bytes or {}
+        self.devices = devices or {}
+        self.requests = []
+
+    @contextmanager
+    def session(self, host):
+        yield self
+
+    def run(self, ssh, command, input=None):
+        self.requests.append([line.split("\t", 1) for line in input.splitlines()])
+        lines = []
+        for want_free, path in self.requests[-1]:
+            device = self.devices.get(os.path.dirname(path), "2049")
+            free = str(self.free_bytes.get(device, 100 * GB)) if want_free == "1" else "-"
+            exists = path in self.files
+            lines.append(f"{1 if exists else 0}\t{self.files.get(path, 0)}\t{device}\t{free}\t{path}")
+        return 0, "".join(line + "\n" for line in lines), ""
+
+@pytest.fixture
+def processor(monkeypatch):
+    processor = RemoteProcessor()
+    monkeypatch.setattr(processor, "free_space", FreeSpaceCache(ttl_seconds=60))
+    monkeypatch.setattr(processor, "min_free_gb", 4)
+    return processor
+
+def use_host(monkeypatch, processor, host):
+    monkeypatch.setattr(processor, "ssh_pool", host)
+    monkeypatch.setattr(processor, "_exec", host.run)
+
+def local_file(tmp_path, name, size):
+    path = tmp_path / name
+    with open(path, "wb") as f:
+        f.truncate(size)
+    return str(path)
+
+def test_parse_probe_output():
+    output = "1\t1024\t2049\t5000\t/data/a b.mkv\n0\t0\t2049\t-\t/data/new/c.mkv\n\n"
+    assert parse_probe_output(output) == {
+        "/data/a b.mkv": (True, 1024, "2049", 5000),
+        "/data/new/c.mkv": (False, 0, "2049", None),
+    }
+
+def test_parse_probe_output_rejects_garbage():
+    with pytest.raises(ValueError):
+        parse_probe_output("sh: stat: not found\n")
+
+def test_probe_script_runs_in_sh(tmp_path):
+    existing = tmp_path / "existing.mkv"
+    existing.write_bytes(b"12345")
+    missing = tmp_path / "new" / "dir" / "missing.mkv"
+    request = f"1\t{existing}\n0\t{missing}\n"
+
+    result = subprocess.run(["sh", "-c", f"sh -c {shlex.quote(REMOTE_PROBE_SCRIPT)}"], input=request, capture_output=True, text=True, check=True)
+    answers = parse_probe_output(result.stdout)
+
+    assert answers[str(existing)][:2] == (True, 5)
+    assert answers[str(existing)][3] > 0
+    assert answers[str(missing)][:2] == (False, 0)
+    assert answers[str(missing)][2] == answers[str(existing)][2]
+    assert answers[str(missing)][3] is None
+
+def test_free_space_cache():
+    cache = FreeSpaceCache(ttl_seconds=60)
+    assert cache.lookup("host", "/data/a.mkv") is None
+    cache.store("host", "/data/a.mkv", "2049", 10 * GB)
+    assert cache.lookup("host", "/data/b.mkv") == ("2049", 10 * GB)
+    cache.reserve("host", "2049", GB)
+    assert cache.lookup("host", "/data/b.mkv") == ("2049", 9 * GB)
+    assert cache.lookup("other-host", "/data/b.mkv") is None
+    cache.invalidate("host")
+    assert cache.lookup("host", "/data/b.mkv") is None
+
+def test_free_space_cache_expires():
+    cache = FreeSpaceCache(ttl_seconds=0.01)
+    cache.store("host", "/data/a.mkv", "2049", 10 * GB)
+    time.sleep(0.02)
+    assert cache.lookup("host", "/data/a.mkv") is None
+
+def test_plan_dispatch_probes_the_batch_once(monkeypatch, processor, tmp_path):
+    host = ScriptedHost(files={"/remote/same.mkv": 1000, "/remote/different.mkv": 10})
+    use_host(monkeypatch, processor, host)
+    same = local_file(tmp_path, "same.mkv", 1000)
+    different = local_file(tmp_path, "different.mkv", 1000)
+    new = local_file(tmp_path, "new.mkv", 1000)
+    missing = str(tmp_path / "missing.mkv")
+
+    plan = processor.plan_dispatch("host", [same, different, new, missing], ["/remote/same.mkv", "/remote/different.mkv", "/remote/new.mkv", "/remote/missing.mkv"])
+
+    assert {path: planned.action for path, planned in plan.items()} == {
+        same: ACTION_VERIFY,
+        different: ACTION_SEND,
+        new: ACTION_SEND,
+        missing: ACTION_MISSING,
+    }
+    assert plan[new].remote_path == "/remote/new.mkv"
+    assert len(host.requests) == 1
+
+def test_plan_dispatch_reserves_space_across_the_batch(monkeypatch, processor, tmp_path):
+    host = ScriptedHost(free_bytes={"2049": 7 * GB})
+    use_host(monkeypatch, processor, host)
+    first = local_file(tmp_path, "first.mkv", 2 * GB)
+    second = local_file(tmp_path, "second.mkv", 2 * GB)
+
+    # 7GB free with 4GB kept free: only one of the two fits.
+    plan = processor.plan_dispatch("host", [first, second], ["/remote/first.mkv", "/remote/second.mkv"])
+    assert plan[first].action == ACTION_SEND
+    assert plan[second].action == ACTION_NO_SPACE
+
+    # The next batch doesn't ask for the free space again and still counts the reserved file.
+    plan = processor.plan_dispatch("host", [second], ["/remote/second.mkv"])
+    assert plan[second].action == ACTION_NO_SPACE
+    assert [want_free for want_free, _ in host.requests[-1]] == ["0"]
+
+def test_plan_dispatch_reserves_per_partition(monkeypatch, processor, tmp_path):
+    host = ScriptedHost(free_bytes={"2049": 7 * GB, "2050": 7 * GB}, devices={"/remote/a": "2049", "/remote/b": "2050"})
+    use_host(monkeypatch, processor, host)
+    first = local_file(tmp_path, "first.mkv", 2 * GB)
+    second = local_file(tmp_path, "second.mkv", 2 * GB)
+
+    plan = processor.plan_dispatch("host", [first, second], ["/remote/a/first.mkv", "/remote/b/second.mkv"])
+    assert plan[first].action == ACTION_SEND
+    assert plan[second].action == ACTION_SEND
+
+def test_probe_paths_rejects_unexpected_output(monkeypatch, processor):
+    host = ScriptedHost()
+    use_host(monkeypatch, processor, host)
+    monkeypatch.setattr(processor, "_exec", lambda ssh, command, input=None: (127, "sh: df: not found\n", ""))
+    with pytest.raises(RuntimeError):
+        processor.probe_paths("host", ["/remote/a.mkv"])
+
+    monkeypatch.setattr(processor, "_exec", lambda ssh, command, input=None: (0, "", "stat: permission denied"))
+    with pytest.raises(RuntimeError):
+        processor.probe_paths("host", ["/remote/a.mkv"])
@@ -0,0 +1,71 @@
+import asyncio
+import threading
+
+from torrent_agent.common.utils import file_name_to_cdn_path
+from torrent_agent.torrent.torrent_manager import TorrentManager
+
+class RecordingShows:
+    """
+    Shows repository with one show and no seasons, recording what is added.
+    """
+
+    def __init__(self, video_ids):
+        self.video_ids = video_ids
+        self.added = []
+
+    async def get_show_by_folder(self, show_folder):
+        return type("Show", (), {"id": 7})()
+
+    async def get_show_tree(self, show_id):
+        return {}
+
+    async def get_video_ids_in_folder(self, folder):
+        return self.video_ids
+
+    async def add_seasons_and_episodes(self, show_id, new_seasons, new_episodes):
+        self.added.append((new_seasons, {season: [episode.episode_number for episode in episodes] for season, episodes in new_episodes.items()}))
+
+class Fingerprints:
+    def __init__(self):
+        self.fingerprints = {}
+
+    def get_fingerprint(self, key):
+        return self.fingerprints.get(key)
+
+    def set_fingerprint(self, key, fingerprint):
+        self.fingerprints[key] = fingerprint
+
+def show_folder(tmp_path):
+    show = tmp_path / "torrents" / "tv" / "Show"
+    (show / "Season 1").mkdir(parents=True)
+    episode = show / "Season 1" / "Show.S01E02.mp4"
+    episode.write_bytes(b"video")
+    return show, episode
+
+def test_show_tree_is_read_off_the_event_loop(tmp_path, monkeypatch):
+    show, episode = show_folder(tmp_path)
+    shows = RecordingShows({file_name_to_cdn_path(str(episode)): 11})
+    torrent_manager = TorrentManager(shows, transmission_client=object(), scan_manifest=Fingerprints())
+    threads = []
+    for name in ("_fingerprint_show_tree", "_read_season_folders"):
+        method = getattr(torrent_manager, name)
+        monkeypatch.setattr(torrent_manager, name, lambda path, method=method: threads.append(threading.current_thread()) or method(path))
+
+    asyncio.run(torrent_manager.add_show_to_database(str(show)))
+
+    assert len(threads) == 2
+    assert threading.main_thread() not in threads
+    assert shows.added == [([1], {1: [2]})]
+
+def test_unchanged_show_is_skipped(tmp_path):
+    show, episode = show_folder(tmp_path)
+    shows = RecordingShows({file_name_to_cdn_path(str(episode)): 11})
+    torrent_manager = TorrentManager(shows, transmission_client=object(), scan_manifest=Fingerprints())
+
+    asyncio.run(torrent_manager.add_show_to_database(str(show)))
+    asyncio.run(torrent_manager.add_show_to_database(str(show)))
+    assert len(shows.added) == 1
+
+    (show / "Season 1" / "Show.S01E03.mp4").write_bytes(b"video")
+    asyncio.run(torrent_manager.add_show_to_database(str(show)))
+    assert len(shows.added) == 2
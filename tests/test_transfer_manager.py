@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+from torrent_agent.remote import transfer_manager as transfer_manager_module
+from torrent_agent.remote.transfer_manager import TokenBucket, TransferManager
+
+SEGMENT_SIZE = 1000
+ENCODED_SIZE = 400
+
+class RecordingHost:
+    """
+    Stands in for RemoteProcessor's segment steps and records them in order.
+    """
+
+    def __init__(self, ffmpeg_error=None):
+        self.steps = []
+        self.ffmpeg_error = ffmpeg_error
+
+    def segment_dir(self, host):
+        return "/remote/.segments/1"
+
+    def put_file(self, host, local_path, remote_path, on_progress=None):
+        self.steps.append(("put", local_path, remote_path))
+        on_progress(SEGMENT_SIZE, SEGMENT_SIZE, True)
+        return True
+
+    def run_remote_ffmpeg(self, host, remote_input, remote_output, ffmpeg_args, timeout=None):
+        self.steps.append(("ffmpeg", remote_input, remote_output))
+        if self.ffmpeg_error:
+            raise self.ffmpeg_error
+
+    def get_file(self, host, remote_path, local_path, on_progress=None):
+        self.steps.append(("get", remote_path, local_path))
+        on_progress(ENCODED_SIZE, ENCODED_SIZE, True)
+        return True
+
+    def remove_remote_dir(self, host, remote_dir):
+        self.steps.append(("remove", remote_dir))
+
+@pytest.fixture
+def manager(monkeypatch):
+    manager = TransferManager()
+    bucket = TokenBucket(rate=1)
+    bucket.consumed = []
+    monkeypatch.setattr(bucket, "consume", lambda amount: bucket.consumed.append(amount) or 0.0)
+    monkeypatch.setattr(manager, "bucket", bucket)
+    monkeypatch.setattr(manager, "streams_per_host", 1)
+    monkeypatch.setattr(manager, "_semaphores", {})
+    return manager
+
+def use_host(monkeypatch, host):
+    monkeypatch.setattr(transfer_manager_module, "remote_processor", host)
+
+def test_segment_copies_draw_from_the_bandwidth_limit(manager, monkeypatch):
+    host = RecordingHost()
+    use_host(monkeypatch, host)
+
+    asyncio.run(manager.encode_remote("host", "/local/a.part000.mkv", "/local/a.part000.x264.mp4", ["-an"]))
+
+    assert host.steps == [
+        ("put", "/local/a.part000.mkv", "/remote/.segments/1/a.part000.mkv"),
+        ("ffmpeg", "/remote/.segments/1/a.part000.mkv", "/remote/.segments/1/a.part000.x264.mp4"),
+        ("get", "/remote/.segments/1/a.part000.x264.mp4", "/local/a.part000.x264.mp4"),
+        ("remove", "/remote/.segments/1"),
+    ]
+    assert manager.bucket.consumed == [SEGMENT_SIZE, ENCODED_SIZE]
+
+def test_segment_copies_wait_for_a_free_stream_to_the_host(manager, monkeypatch):
+    host = RecordingHost()
+    use_host(monkeypatch, host)
+
+    async def scenario():
+        semaphore = manager._semaphores.setdefault("host", asyncio.Semaphore(1))
+        async with semaphore:
+            encode = asyncio.create_task(manager.encode_remote("host", "/local/a.mkv", "/local/a.mp4", []))
+            await asyncio.sleep(0.05)
+            assert host.steps == []
+        await asyncio.wait_for(encode, 5)
+
+    asyncio.run(scenario())
+    assert [step[0] for step in host.steps] == ["put", "ffmpeg", "get", "remove"]
+
+def test_failed_remote_encode_cleans_up(manager, monkeypatch):
+    host = RecordingHost(ffmpeg_error=RuntimeError("Remote ffmpeg on host exited with status 1"))
+    use_host(monkeypatch, host)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(manager.encode_remote("host", "/local/a.mkv", "/local/a.mp4", []))
+    assert [step[0] for step in host.steps] == ["put", "ffmpeg", "remove"]
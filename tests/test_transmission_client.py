@@ -0,0 +1,149 @@
+import asyncio
+import base64
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from torrent_agent.torrent.torrent_manager import TorrentManager
+from torrent_agent.torrent.transmission_client import SESSION_ID_HEADER, TransmissionClient, TransmissionError
+
+RPC_PATH = "/transmission/rpc"
+
+class TransmissionStandIn(ThreadingHTTPServer):
+    """
+    Local HTTP stand-in for the Transmission RPC endpoint. Like Transmission, it answers 409
+    with a new session id until the request carries the current one.
+    """
+
+    def __init__(self, torrents=None, credentials=("pi", "raspberry")):
+        super().__init__(("127.0.0.1", 0), TransmissionHandler)
+        self.torrents = torrents or []
+        self.credentials = credentials
+        self.session_id = "session-1"
+        self.result = "success"
+        self.requests = []
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+class TransmissionHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        server.requests.append((self.headers.get(SESSION_ID_HEADER), body))
+
+        expected = "Basic " + base64.b64encode(":".join(server.credentials).encode()).decode()
+        if self.headers.get("Authorization") != expected:
+            self.send_response(401)
+            self.end_headers()
+            return
+        if self.headers.get(SESSION_ID_HEADER) != server.session_id:
+            self.send_response(409)
+            self.send_header(SESSION_ID_HEADER, server.session_id)
+            self.end_headers()
+            return
+
+        fields = body["arguments"].get("fields", [])
+        torrents = [{field: torrent[field] for field in fields if field in torrent} for torrent in server.torrents]
+        response = json.dumps({"result": server.result, "arguments": {"torrents": torrents}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def transmission():
+    server = TransmissionStandIn()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def client_for(server, **kwargs):
+    kwargs.setdefault("username", "pi")
+    kwargs.setdefault("password", "raspberry")
+    return TransmissionClient(host="127.0.0.1", port=server.port, rpc_path=RPC_PATH, timeout=5, **kwargs)
+
+def test_session_id_is_negotiated_once(transmission):
+    transmission.torrents = [{"id": 1, "name": "Film", "downloadDir": "/media/movies", "percentDone": 1.0, "status": 6}]
+    client = client_for(transmission)
+
+    async def scenario():
+        first = await client.torrent_get(["name", "percentDone"])
+        second = await client.torrent_get(["name", "percentDone"])
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first == second == [{"name": "Film", "percentDone": 1.0}]
+    # One rejected request to learn the session id, then it is reused.
+    assert [session_id for session_id, _ in transmission.requests] == [None, "session-1", "session-1"]
+    assert transmission.requests[-1][1] == {"method": "torrent-get", "arguments": {"fields": ["name", "percentDone"]}}
+
+def test_expired_session_id_is_renegotiated(transmission):
+    client = client_for(transmission)
+    asyncio.run(client.torrent_get(["name"]))
+
+    transmission.session_id = "session-2"
+    assert asyncio.run(client.torrent_get(["name"])) == []
+    assert client.session_id == "session-2"
+
+def rotating_session(do_post, ids):
+    def handler(self):
+        self.server.session_id = next(ids)
+        do_post(self)
+
+    return handler
+
+def test_session_id_rejected_twice_is_an_error(transmission, monkeypatch):
+    client = client_for(transmission)
+    # A server handing out a different id every time never accepts a request.
+    ids = iter(f"session-{number}" for number in range(10, 20))
+    monkeypatch.setattr(TransmissionHandler, "do_POST", rotating_session(TransmissionHandler.do_POST, ids))
+
+    with pytest.raises(TransmissionError, match="HTTP 409"):
+        asyncio.run(client.torrent_get(["name"]))
+    assert len(transmission.requests) == 2
+
+def test_wrong_credentials_are_an_error(transmission):
+    client = client_for(transmission, password="wrong")
+    with pytest.raises(TransmissionError, match="credentials"):
+        asyncio.run(client.torrent_get(["name"]))
+
+def test_failed_rpc_result_is_an_error(transmission):
+    transmission.result = "invalid argument"
+    client = client_for(transmission)
+    with pytest.raises(TransmissionError, match="invalid argument"):
+        asyncio.run(client.torrent_get(["name"]))
+
+def test_torrent_index_is_built_from_one_call(transmission):
+    transmission.torrents = [
+        {"id": 1, "name": "Show S01", "downloadDir": "/media/torrents/tv", "percentDone": 0.4, "status": 4},
+        {"id": 2, "name": "Film (2020)", "downloadDir": "/media/torrents/movies", "percentDone": 1.0, "status": 6},
+    ]
+    torrent_manager = TorrentManager(None, transmission_client=client_for(transmission))
+    asyncio.run(torrent_manager.refresh_torrent_index())
+
+    assert torrent_manager.get_download_status("/media/torrents/tv/Show S01/e01.mkv") is False
+    assert torrent_manager.is_tv_show_downloading("/media/torrents/tv/Show S01/e01.mkv")
+    assert torrent_manager.get_download_status("/media/torrents/movies/Film (2020)/film.mkv") is True
+    assert torrent_manager.get_download_status("/media/other/home video.mkv") is None
+    # The handshake and one torrent-get; the lookups don't call Transmission.
+    assert len(transmission.requests) == 2
+
+def test_torrent_index_is_cleared_when_transmission_is_unreachable(transmission):
+    transmission.torrents = [{"id": 1, "name": "Film", "downloadDir": "/media/torrents/movies", "percentDone": 1.0, "status": 6}]
+    torrent_manager = TorrentManager(None, transmission_client=client_for(transmission))
+    asyncio.run(torrent_manager.refresh_torrent_index())
+    assert torrent_manager.get_download_status("/media/torrents/movies/Film/film.mkv") is True
+
+    transmission.credentials = ("pi", "changed")
+    asyncio.run(torrent_manager.refresh_torrent_index())
+    assert torrent_manager.get_download_status("/media/torrents/movies/Film/film.mkv") is None
@@ -0,0 +1,161 @@
+import asyncio
+
+import pytest
+
+from torrent_agent.database.write_behind_batcher import WriteBehindBatcher
+
+class BulkWrite:
+    """
+    Bulk write that records its batches and returns an id for every item.
+    """
+
+    def __init__(self, error=None, bad_item=None):
+        self.batches = []
+        self.error = error
+        self.bad_item = bad_item
+
+    async def __call__(self, items):
+        self.batches.append(list(items))
+        await asyncio.sleep(0)
+        if self.error and (self.bad_item is None or self.bad_item in items):
+            raise self.error
+        return [f"id-{item}" for item in items]
+
+def test_concurrent_writes_share_a_batch_and_get_their_own_results():
+    write_many = BulkWrite()
+    batcher = WriteBehindBatcher("test", write_many, max_batch=100, max_delay=0.01)
+
+    async def scenario():
+        return await asyncio.gather(*(batcher.submit(number) for number in range(10)))
+
+    assert asyncio.run(scenario()) == [f"id-{number}" for number in range(10)]
+    assert write_many.batches == [list(range(10))]
+
+def test_a_full_batch_is_written_without_waiting_for_the_delay():
+    write_many = BulkWrite()
+    batcher = WriteBehindBatcher("test", write_many, max_batch=4, max_delay=60)
+
+    async def scenario():
+        return await asyncio.wait_for(asyncio.gather(*(batcher.submit(number) for number in range(8))), 5)
+
+    assert asyncio.run(scenario()) == [f"id-{number}" for number in range(8)]
+    assert write_many.batches == [[0, 1, 2, 3], [4, 5, 6, 7]]
+
+def test_a_partial_batch_is_written_after_the_delay():
+    write_many = BulkWrite()
+    batcher = WriteBehindBatcher("test", write_many, max_batch=100, max_delay=0.05)
+
+    async def scenario():
+        first = asyncio.create_task(batcher.submit("a"))
+        await asyncio.sleep(0.01)
+        assert not first.done()
+        second = asyncio.create_task(batcher.submit("b"))
+        return await asyncio.gather(first, second)
+
+    assert asyncio.run(scenario()) == ["id-a", "id-b"]
+    assert write_many.batches == [["a", "b"]]
+
+def test_writes_after_a_flush_start_a_new_batch():
+    write_many = BulkWrite()
+    batcher = WriteBehindBatcher("test", write_many, max_batch=100, max_delay=0.01)
+
+    async def scenario():
+        assert await batcher.submit("a") == "id-a"
+        assert await batcher.submit("b") == "id-b"
+
+    asyncio.run(scenario())
+    assert write_many.batches == [["a"], ["b"]]
+
+def test_every_caller_in_a_failed_batch_gets_the_error():
+    error = RuntimeError("Deadlock found")
+    batcher = WriteBehindBatcher("test", BulkWrite(error), max_batch=100, max_delay=0.01)
+
+    async def scenario():
+        return await asyncio.gather(*(batcher.submit(number) for number in range(3)), return_exceptions=True)
+
+    assert asyncio.run(scenario()) == [error, error, error]
+
+def test_batch_size_of_one_writes_straight_away():
+    write_many = BulkWrite()
+    batcher = WriteBehindBatcher("test", write_many, max_batch=1, max_delay=60)
+
+    async def scenario():
+        return await asyncio.gather(batcher.submit("a"), batcher.submit("b"))
+
+    assert asyncio.run(scenario()) == ["id-a", "id-b"]
+    assert write_many.batches == [["a"], ["b"]]
+
+    failing = WriteBehindBatcher("test", BulkWrite(ValueError("bad row")), max_batch=1)
+    with pytest.raises(ValueError):
+        asyncio.run(failing.submit("a"))
+
+def test_flush_writes_pending_items_straight_away():
+    write_many = BulkWrite()
+    batcher = WriteBehindBatcher("test", write_many, max_batch=100, max_delay=60)
+
+    async def scenario():
+        pending = [asyncio.create_task(batcher.submit(number)) for number in range(3)]
+        await asyncio.sleep(0)
+        await asyncio.wait_for(batcher.flush(), 5)
+        assert all(task.done() for task in pending)
+        return [task.result() for task in pending]
+
+    assert asyncio.run(scenario()) == ["id-0", "id-1", "id-2"]
+    assert write_many.batches == [[0, 1, 2]]
+
+def test_a_caller_that_stops_waiting_does_not_affect_the_others():
+    write_many = BulkWrite()
+    batcher = WriteBehindBatcher("test", write_many, max_batch=100, max_delay=0.02)
+
+    async def scenario():
+        cancelled = asyncio.create_task(batcher.submit("a"))
+        kept = asyncio.create_task(batcher.submit("b"))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        return await kept
+
+    assert asyncio.run(scenario()) == "id-b"
+    # The cancelled caller's row is still written with the rest.
+    assert write_many.batches == [["a", "b"]]
+
+def test_a_bad_row_only_fails_its_own_caller():
+    error = ValueError("Data too long for column 'title'")
+    write_many = BulkWrite(error, bad_item=1)
+    batcher = WriteBehindBatcher("test", write_many, max_batch=100, max_delay=0.01)
+
+    async def scenario():
+        return await asyncio.gather(*(batcher.submit(number) for number in range(3)), return_exceptions=True)
+
+    assert asyncio.run(scenario()) == ["id-0", error, "id-2"]
+    # The failed batch, then each row on its own.
+    assert write_many.batches == [[0, 1, 2], [0], [1], [2]]
+
+def test_missing_results_are_an_error():
+    async def short_write(items):
+        return [f"id-{item}" for item in items[:1]]
+
+    batcher = WriteBehindBatcher("test", short_write, max_batch=100, max_delay=0.01)
+
+    async def scenario():
+        return await asyncio.gather(*(batcher.submit(number) for number in range(2)), return_exceptions=True)
+
+    first, second = asyncio.run(scenario())
+    assert first == "id-0"
+    assert isinstance(second, RuntimeError)
+
+def test_cancelled_write_resolves_every_caller():
+    async def scenario():
+        writing = asyncio.Event()
+
+        async def hanging_write(items):
+            writing.set()
+            await asyncio.sleep(60)
+
+        batcher = WriteBehindBatcher("test", hanging_write, max_batch=2, max_delay=60)
+        callers = [asyncio.create_task(batcher.submit(number)) for number in range(2)]
+        await asyncio.wait_for(writing.wait(), 5)
+        for task in batcher._tasks:
+            task.cancel()
+        return await asyncio.wait_for(asyncio.gather(*callers, return_exceptions=True), 5)
+
+    assert [type(result) for result in asyncio.run(scenario())] == [RuntimeError, RuntimeError]
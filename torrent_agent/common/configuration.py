@@ -1,4 +1,5 @@
 import os
+import socket
 from dotenv import load_dotenv
 
 class Configuration:
@@ -8,6 +9,45 @@ class Configuration:
 
         # File system configuration
         self.media_directory = os.getenv("MEDIA_DIRECTORY", "/mnt/ext1")
+        self.scan_manifest_path = os.getenv("SCAN_MANIFEST_PATH", "/var/lib/home-media-torrent-util/scan_manifest.json")
+
+        # Scan scheduling configuration
+        self.watch_mode = os.getenv("WATCH_MODE", "0")
+        self.watch_debounce_seconds = os.getenv("WATCH_DEBOUNCE_SECONDS", "5")
+        self.download_quiet_period_seconds = os.getenv("DOWNLOAD_QUIET_PERIOD_SECONDS", "60")
+        self.full_scan_interval_seconds = os.getenv("FULL_SCAN_INTERVAL_SECONDS")
+
+        # Video conversion configuration
+        self.conversion_workers = os.getenv("CONVERSION_WORKERS")
+        self.conversion_threads_per_encode = os.getenv("CONVERSION_THREADS_PER_ENCODE")
+        self.conversion_lease_seconds = os.getenv("CONVERSION_LEASE_SECONDS", "300")
+        self.conversion_queue_backend = os.getenv("CONVERSION_QUEUE_BACKEND", "local")
+        self.conversion_stream_max_deliveries = os.getenv("CONVERSION_STREAM_MAX_DELIVERIES", "3")
+        self.conversion_stream_block_seconds = os.getenv("CONVERSION_STREAM_BLOCK_SECONDS", "5")
+        self.agent_name = os.getenv("AGENT_NAME", socket.gethostname())
+        self.conversion_stall_timeout_seconds = os.getenv("CONVERSION_STALL_TIMEOUT_SECONDS", "300")
+        self.conversion_time_budget_factor = os.getenv("CONVERSION_TIME_BUDGET_FACTOR", "6.0")
+        self.conversion_min_time_budget_seconds = os.getenv("CONVERSION_MIN_TIME_BUDGET_SECONDS", "900")
+        self.conversion_segmented = os.getenv("CONVERSION_SEGMENTED", "0")
+        self.conversion_segmented_min_duration_seconds = os.getenv("CONVERSION_SEGMENTED_MIN_DURATION_SECONDS", "1800")
+        self.conversion_segment_local_workers = os.getenv("CONVERSION_SEGMENT_LOCAL_WORKERS", "1")
+        self.conversion_segments = os.getenv("CONVERSION_SEGMENTS", "0")
+        self.conversion_output_format = os.getenv("CONVERSION_OUTPUT_FORMAT", "mp4")
+        self.hls_segment_seconds = os.getenv("HLS_SEGMENT_SECONDS", "6")
+        self.conversion_preview_strip = os.getenv("CONVERSION_PREVIEW_STRIP", "0")
+        self.conversion_scheduling_policy = os.getenv("CONVERSION_SCHEDULING_POLICY", "sjf")
+        self.conversion_aging_factor = os.getenv("CONVERSION_AGING_FACTOR", "1.0")
+        self.conversion_type_priority = os.getenv("CONVERSION_TYPE_PRIORITY", "tv,movies")
+
+        # Ingest endpoint configuration
+        self.ingest_server_enabled = os.getenv("INGEST_SERVER_ENABLED", "0")
+        self.ingest_server_host = os.getenv("INGEST_SERVER_HOST", "127.0.0.1")
+        self.ingest_server_port = os.getenv("INGEST_SERVER_PORT", "8003")
+
+        # File pipeline concurrency configuration
+        self.pipeline_lookup_concurrency = os.getenv("PIPELINE_LOOKUP_CONCURRENCY", "16")
+        self.pipeline_ingest_concurrency = os.getenv("PIPELINE_INGEST_CONCURRENCY", "4")
+        self.pipeline_thumbnail_concurrency = os.getenv("PIPELINE_THUMBNAIL_CONCURRENCY", "2")
 
         # Database configuration
         self.db_host = os.getenv("DB_HOST")
@@ -15,6 +55,15 @@ class Configuration:
         self.db_name = os.getenv("DB_NAME")
         self.db_user = os.getenv("DB_USER")
         self.db_password = os.getenv("DB_PASSWORD")
+        self.db_backend = os.getenv("DB_BACKEND", "executor")
+        self.db_pool_min_size = os.getenv("DB_POOL_MIN_SIZE", "1")
+        self.db_pool_max_size = os.getenv("DB_POOL_MAX_SIZE", "5")
+        self.db_pool_recycle_seconds = os.getenv("DB_POOL_RECYCLE_SECONDS", "3600")
+        self.db_connect_timeout_seconds = os.getenv("DB_CONNECT_TIMEOUT_SECONDS", "10")
+        self.db_query_timeout_seconds = os.getenv("DB_QUERY_TIMEOUT_SECONDS", "30")
+        self.db_executor_workers = os.getenv("DB_EXECUTOR_WORKERS")
+        self.db_write_batch_size = os.getenv("DB_WRITE_BATCH_SIZE", "100")
+        self.db_write_batch_delay_seconds = os.getenv("DB_WRITE_BATCH_DELAY_SECONDS", "0.05")
 
         # Redis configuration
         self.redis_host = os.getenv("REDIS_HOST", "192.168.0.26")
@@ -22,8 +71,35 @@ class Configuration:
         self.redis_password = os.getenv("REDIS_PASSWORD", None)
         self.redis_db = os.getenv("REDIS_DB", "0")
 
+        # Transmission RPC configuration
+        self.transmission_host = os.getenv("TRANSMISSION_HOST", "localhost")
+        self.transmission_port = os.getenv("TRANSMISSION_PORT", "9091")
+        self.transmission_rpc_path = os.getenv("TRANSMISSION_RPC_PATH", "/transmission/rpc")
+        self.transmission_username = os.getenv("TRANSMISSION_USERNAME", "pi")
+        self.transmission_password = os.getenv("TRANSMISSION_PASSWORD", "raspberry")
+
         self.control_agent_host = os.getenv("CONTROL_AGENT_HOST")
 
+        # SSH configuration for remote hosts
+        self.ssh_port = os.getenv("SSH_PORT", "22")
+        self.ssh_keepalive_seconds = os.getenv("SSH_KEEPALIVE_SECONDS", "30")
+        self.ssh_health_check_seconds = os.getenv("SSH_HEALTH_CHECK_SECONDS", "60")
+        self.ssh_connect_timeout = os.getenv("SSH_CONNECT_TIMEOUT_SECONDS", "10")
+
+        # Transfer configuration
+        self.transfer_streams_per_host = os.getenv("TRANSFER_STREAMS_PER_HOST", "2")
+        self.transfer_bandwidth_limit_mbps = os.getenv("TRANSFER_BANDWIDTH_LIMIT_MBPS", "0")
+        self.transfer_chunk_mb = os.getenv("TRANSFER_CHUNK_MB", "8")
+        self.transfer_max_attempts = os.getenv("TRANSFER_MAX_ATTEMPTS", "5")
+        self.transfer_free_space_ttl_seconds = os.getenv("TRANSFER_FREE_SPACE_TTL_SECONDS", "10")
+        self.transfer_plan_window_seconds = os.getenv("TRANSFER_PLAN_WINDOW_SECONDS", "0.5")
+        self.transfer_plan_max_batch = os.getenv("TRANSFER_PLAN_MAX_BATCH", "64")
+
+        # Host scheduling configuration
+        self.host_probe_interval_seconds = os.getenv("HOST_PROBE_INTERVAL_SECONDS", "30")
+        self.host_default_encode_rate = os.getenv("HOST_DEFAULT_ENCODE_RATE", "1.0")
+        self.host_min_free_gb = os.getenv("HOST_MIN_FREE_GB", "4")
+
         # Remote agent configuration
         self.is_remote_agent_host = os.getenv("IS_REMOTE_AGENT_HOST")
         self.remote_agent_hosts = os.getenv("REMOTE_AGENT_HOSTS", "").split(",") if os.getenv("REMOTE_AGENT_HOSTS") else []
@@ -36,6 +112,40 @@ class Configuration:
             "user": self.db_user,
             "password": self.db_password,
         }
+
+    def get_database_backend(self):
+        """
+        Returns "executor" to run mysql-connector calls on a thread pool, or "aiomysql" to use
+        a native asyncio connection pool.
+        """
+        return self.db_backend.strip().lower()
+
+    def get_database_pool_config(self):
+        """
+        Returns the database connection pool settings.
+        Connections older than recycle seconds are replaced, and a query running for longer than
+        query_timeout seconds is abandoned (aiomysql backend only). The executor backend runs its
+        calls on executor_workers threads, by default one per pooled connection.
+        """
+        max_size = max(1, int(self.db_pool_max_size))
+        return {
+            "min_size": min(max(0, int(self.db_pool_min_size)), max_size),
+            "max_size": max_size,
+            "recycle": int(self.db_pool_recycle_seconds),
+            "connect_timeout": float(self.db_connect_timeout_seconds),
+            "query_timeout": float(self.db_query_timeout_seconds) or None,
+            "executor_workers": max(1, int(self.db_executor_workers)) if self.db_executor_workers else max_size,
+        }
+
+    def get_database_write_batch_config(self):
+        """
+        Returns the settings for batching inserts: a batch is written once max_batch rows are
+        waiting or max_delay seconds after its first row. A max_batch of 1 turns batching off.
+        """
+        return {
+            "max_batch": max(1, int(self.db_write_batch_size)),
+            "max_delay": float(self.db_write_batch_delay_seconds),
+        }
     
     def get_redis_config(self):
         return {
@@ -45,12 +155,207 @@ class Configuration:
             "db": self.redis_db,
         }
     
+    def get_transmission_config(self):
+        return {
+            "host": self.transmission_host,
+            "port": self.transmission_port,
+            "rpc_path": self.transmission_rpc_path,
+            "username": self.transmission_username,
+            "password": self.transmission_password,
+        }
+
     def is_remote_agent(self):
         return  bool(int(self.is_remote_agent_host))
 
     def get_media_directory(self):
         return self.media_directory
+
+    def get_scan_manifest_path(self):
+        """
+        Returns the path of the local scan manifest used to skip unchanged files between cycles.
+        """
+        return self.scan_manifest_path
+
+    def is_watch_mode_enabled(self):
+        """
+        Returns True if new media should be picked up from inotify events instead of waiting for the next full scan.
+        """
+        return bool(int(self.watch_mode))
+
+    def get_watch_debounce_seconds(self):
+        return float(self.watch_debounce_seconds)
+
+    def get_download_quiet_period_seconds(self):
+        """
+        Returns how long a file must stay unchanged before it is treated as fully downloaded.
+        """
+        return float(self.download_quiet_period_seconds)
+
+    def get_full_scan_interval_seconds(self):
+        """
+        Returns the number of seconds between full scans of the media directory.
+        In watch mode full scans are only a safety net, so they default to once an hour.
+        """
+        if self.full_scan_interval_seconds:
+            return int(self.full_scan_interval_seconds)
+        return 3600 if self.is_watch_mode_enabled() else 300
+
+    def is_ingest_server_enabled(self):
+        """
+        Returns True if the local endpoint for Transmission's torrent-done script should be started.
+        """
+        return bool(int(self.ingest_server_enabled))
+
+    def get_ingest_server_address(self):
+        return self.ingest_server_host, int(self.ingest_server_port)
+
+    def get_conversion_workers(self):
+        """
+        Returns the number of concurrent local encodes. Defaults to one per four CPU cores.
+        """
+        if self.conversion_workers:
+            return int(self.conversion_workers)
+        return max(1, (os.cpu_count() or 1) // 4)
+
+    def get_conversion_threads_per_encode(self):
+        """
+        Returns the number of ffmpeg threads each encode may use. Defaults to sharing the
+        CPU cores evenly between the conversion workers.
+        """
+        if self.conversion_threads_per_encode:
+            return int(self.conversion_threads_per_encode)
+        return max(1, (os.cpu_count() or 1) // self.get_conversion_workers())
+
+    def get_conversion_lease_seconds(self):
+        """
+        Returns how long a conversion may go without a heartbeat before another agent
+        is allowed to take it over.
+        """
+        return int(self.conversion_lease_seconds)
+
+    def get_conversion_queue_backend(self):
+        """
+        Returns "local" to convert on this agent and push files to remote hosts, or "redis"
+        to share a Redis Streams work queue that every agent pulls conversions from.
+        """
+        return self.conversion_queue_backend.strip().lower()
+
+    def get_conversion_stream_config(self):
+        return {
+            "consumer": self.agent_name,
+            "max_deliveries": int(self.conversion_stream_max_deliveries),
+            "block_seconds": float(self.conversion_stream_block_seconds),
+        }
+
+    def get_conversion_stall_timeout_seconds(self):
+        """
+        Returns how long ffmpeg may go without making progress before it is killed.
+        """
+        return float(self.conversion_stall_timeout_seconds)
+
+    def get_conversion_time_budget(self, duration: float):
+        """
+        Returns the wall-clock seconds a conversion of a video of the given duration may take,
+        or None if the duration is unknown.
+        """
+        if not duration:
+            return None
+        return max(float(self.conversion_min_time_budget_seconds), duration * float(self.conversion_time_budget_factor))
+
+    def get_segmented_conversion_config(self):
+        """
+        Returns the settings for splitting long transcodes into segments encoded in parallel.
+        A segment count of 0 lets the transcoder pick one from the number of workers.
+        """
+        return {
+            "enabled": bool(int(self.conversion_segmented)),
+            "min_duration": float(self.conversion_segmented_min_duration_seconds),
+            "local_workers": int(self.conversion_segment_local_workers),
+            "segments": int(self.conversion_segments),
+        }
+
+    def get_conversion_output_format(self):
+        """
+        Returns "mp4" to write a single file, or "hls" to write segments that can be played
+        while the conversion is still running.
+        """
+        return self.conversion_output_format.strip().lower()
+
+    def get_hls_segment_seconds(self):
+        return int(self.hls_segment_seconds)
+
+    def is_preview_strip_enabled(self):
+        """
+        Returns True if conversions should also save a strip of preview frames next to the thumbnail.
+        """
+        return bool(int(self.conversion_preview_strip))
+
+    def get_conversion_scheduling_policy(self):
+        """
+        Returns the order conversions run in: "sjf", "newest" or "type".
+        """
+        return self.conversion_scheduling_policy.strip().lower()
+
+    def get_conversion_aging_factor(self):
+        """
+        Returns how many seconds of priority a queued conversion gains per second it waits.
+        """
+        return float(self.conversion_aging_factor)
+
+    def get_conversion_type_priority(self):
+        """
+        Returns the entertainment types in the order the "type" scheduling policy converts them.
+        """
+        return [entertainment_type.strip() for entertainment_type in self.conversion_type_priority.split(",") if entertainment_type.strip()]
+
+    def get_pipeline_concurrency(self):
+        """
+        Returns the maximum number of files in each stage of the file pipeline at once.
+        """
+        return {
+            "lookup": int(self.pipeline_lookup_concurrency),
+            "ingest": int(self.pipeline_ingest_concurrency),
+            "thumbnail": int(self.pipeline_thumbnail_concurrency),
+        }
     
+    def get_ssh_config(self):
+        return {
+            "port": int(self.ssh_port),
+            "keepalive_seconds": int(self.ssh_keepalive_seconds),
+            "health_check_seconds": int(self.ssh_health_check_seconds),
+            "connect_timeout": int(self.ssh_connect_timeout),
+        }
+
+    def get_transfer_config(self):
+        """
+        Returns the settings for copying files to other hosts.
+        The bandwidth limit is in bytes per second across all transfers; 0 means unlimited.
+        Files are sent and verified in chunks of chunk_size bytes.
+        Files sent to a host within plan_window seconds of each other, up to plan_max_batch of them,
+        are checked with one probe, and a host's free space is reused for free_space_ttl seconds.
+        """
+        return {
+            "streams_per_host": max(1, int(self.transfer_streams_per_host)),
+            "bandwidth_limit": float(self.transfer_bandwidth_limit_mbps) * 1_000_000 / 8,
+            "chunk_size": int(float(self.transfer_chunk_mb) * 1024 * 1024),
+            "max_attempts": max(1, int(self.transfer_max_attempts)),
+            "free_space_ttl": float(self.transfer_free_space_ttl_seconds),
+            "plan_window": float(self.transfer_plan_window_seconds),
+            "plan_max_batch": max(1, int(self.transfer_plan_max_batch)),
+        }
+
+    def get_host_scheduling_config(self):
+        """
+        Returns the settings for choosing which host converts a file.
+        The encode rate is in seconds of 1080p transcoding per second and is used for hosts
+        that haven't finished a job yet.
+        """
+        return {
+            "probe_interval": float(self.host_probe_interval_seconds),
+            "default_encode_rate": float(self.host_default_encode_rate),
+            "min_free_gb": float(self.host_min_free_gb),
+        }
+
     def get_remote_hosts(self):
         """
         Returns a list of remote hosts configured in the environment variables.
@@ -1,4 +1,4 @@
-from prometheus_client import start_http_server, Counter, Histogram
+from prometheus_client import start_http_server, Counter, Gauge, Histogram
 
 class MetricEmitter:
     """
@@ -29,4 +29,46 @@ class MetricEmitter:
             self.agent_runs_cycles = Counter('agent_run_cycles', 'Total number of run cycles the agent performed')
             self.agent_runs_cycles_failed = Counter('agent_run_cycles_failed', 'Total number of run cycles the agent performed that failed')
             self.agent_runs_cycles_duration = Histogram('agent_run_cycles_duration_seconds', 'Duration of agent run cycles in seconds')
+            self.scan_files_skipped = Counter('scan_files_skipped_total', 'Total number of scanned files skipped as unchanged by the scan manifest')
+            self.conversion_queue_depth = Gauge('conversion_queue_depth', 'Number of conversion jobs waiting in the queue')
+            self.conversion_queue_oldest_age = Gauge('conversion_queue_oldest_age_seconds', 'Seconds the oldest pending conversion job has been waiting')
+            self.conversion_modes = Counter('conversion_modes_total', 'Total number of conversions by the path chosen after probing', ['mode'])
+            self.conversion_worker_jobs = Counter('conversion_worker_jobs_total', 'Total number of conversion jobs finished by each worker', ['worker', 'status'])
+            self.conversion_worker_busy = Gauge('conversion_worker_busy', 'Whether a conversion worker is currently converting a file', ['worker'])
+            self.conversion_worker_job_duration = Histogram('conversion_worker_job_duration_seconds', 'Duration of conversion jobs in seconds per worker', ['worker'])
+            self.conversion_time_to_playable = Histogram('conversion_time_to_playable_seconds', 'Seconds between queuing a video for conversion and it becoming playable', ['policy'], buckets=(60, 300, 900, 1800, 3600, 7200, 14400, 28800, 86400, float("inf")))
+            self.conversion_mean_time_to_playable = Gauge('conversion_mean_time_to_playable_seconds', 'Mean seconds between queuing a video for conversion and it becoming playable since the agent started')
+            self.conversion_progress_fps = Gauge('conversion_progress_fps', 'Frames per second ffmpeg is encoding at for each running conversion', ['job'])
+            self.conversion_progress_speed = Gauge('conversion_progress_speed', 'Encoding speed relative to real time for each running conversion', ['job'])
+            self.conversion_progress_eta = Gauge('conversion_progress_eta_seconds', 'Estimated seconds left for each running conversion', ['job'])
+            self.conversion_ffmpeg_killed = Counter('conversion_ffmpeg_killed_total', 'Total number of ffmpeg processes killed before finishing', ['reason'])
+            self.conversion_segments = Counter('conversion_segments_total', 'Total number of video segments encoded by segmented transcodes', ['host'])
+            self.conversion_segments_failed = Counter('conversion_segments_failed_total', 'Total number of video segments a remote host failed to encode', ['host'])
+            self.ssh_connections_opened = Counter('ssh_connections_opened_total', 'Total number of SSH connections opened to each remote host', ['host'])
+            self.ssh_connections_reused = Counter('ssh_connections_reused_total', 'Total number of times a pooled SSH connection was reused', ['host'])
+            self.ssh_connect_duration = Histogram('ssh_connect_duration_seconds', 'Time taken to open and authenticate an SSH connection')
+            self.host_free_gb = Gauge('host_free_gb', 'Free space in GB on each conversion host when it was last probed', ['host'])
+            self.host_load_average = Gauge('host_load_average', 'One minute load average of each conversion host when it was last probed', ['host'])
+            self.host_in_flight = Gauge('host_in_flight_jobs', 'Number of conversion jobs assigned to each host that have not finished', ['host'])
+            self.host_encode_rate = Gauge('host_encode_rate', 'Estimated seconds of 1080p video each host transcodes per second', ['host'])
+            self.host_predicted_completion = Gauge('host_predicted_completion_seconds', 'Predicted seconds until the last job offered to each host would finish there', ['host'])
+            self.conversion_jobs_dispatched = Counter('conversion_jobs_dispatched_total', 'Total number of conversion jobs assigned to each host', ['host'])
+            self.transfer_bytes = Counter('transfer_bytes_total', 'Total number of bytes transferred to or from each remote host', ['host'])
+            self.transfer_active = Gauge('transfer_active', 'Number of transfers to each remote host in progress', ['host'])
+            self.transfer_progress = Gauge('transfer_progress_ratio', 'Fraction of the file sent for each running transfer', ['job'])
+            self.transfer_throughput = Gauge('transfer_throughput_bytes_per_second', 'Average bytes per second for each running transfer', ['job'])
+            self.transfer_duration = Histogram('transfer_duration_seconds', 'Time taken to transfer a file to or from a remote host', buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1200, 3600))
+            self.transfer_throttled = Counter('transfer_throttled_seconds_total', 'Total seconds transfers spent waiting on the bandwidth limit')
+            self.transfer_retries = Counter('transfer_retries_total', 'Total number of failed upload attempts that were retried or given up on', ['host'])
+            self.transfer_resumed_bytes = Counter('transfer_resumed_bytes_total', 'Total number of bytes already verified on a remote host that resumed uploads skipped', ['host'])
+            self.transfer_verification_failures = Counter('transfer_verification_failures_total', 'Total number of uploads whose remote sha256 did not match the local file', ['host'])
+            self.remote_path_probes = Counter('remote_path_probes_total', 'Total number of batch path probes run on each remote host', ['host'])
+            self.remote_path_probe_batch_size = Histogram('remote_path_probe_batch_size', 'Number of paths checked by each batch path probe', buckets=[1, 2, 4, 8, 16, 32, 64, 128])
+            self.remote_free_space_cache_hits = Counter('remote_free_space_cache_hits_total', 'Total number of probed paths whose free space came from the cache', ['host'])
+            self.database_statements_prepared = Counter('database_statements_prepared_total', 'Total number of times each registered statement was prepared on a database connection', ['statement'])
+            self.database_write_batch_size = Histogram('database_write_batch_size', 'Number of rows in each batched database write', ['batcher'], buckets=[1, 2, 5, 10, 25, 50, 100, 250, 500])
+            self.database_write_batch_duration = Histogram('database_write_batch_duration_seconds', 'Time taken by each batched database write', ['batcher'])
+            self.conversion_stream_jobs = Counter('conversion_stream_jobs_total', 'Total number of Redis Streams conversion job events on this agent', ['event'])
+            self.conversion_stream_pending = Gauge('conversion_stream_pending', 'Number of conversion jobs read by a worker and not yet finished')
+            self.scan_files_processed = Counter('scan_files_processed_total', 'Total number of scanned files sent down the processing pipeline')
             start_http_server(8002)  # Start the Prometheus HTTP server on port 8002
\ No newline at end of file
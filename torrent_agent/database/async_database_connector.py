@@ -0,0 +1,202 @@
+import asyncio
+from threading import Lock
+
+import aiomysql
+
+from torrent_agent.common import logger
+from torrent_agent.common.configuration import Configuration
+from torrent_agent.database.statements import statement_sql
+
+log = logger.get_logger()
+
+class AsyncDatabaseConnector:
+    """
+    DatabaseConnector on a native asyncio connection pool, so queries wait on the event loop
+    instead of on executor threads.
+
+    Connections are opened on first use, between min_size and max_size of them are kept,
+    and connections older than the recycle time are replaced. Every call is abandoned after
+    the query timeout; its connection is closed rather than returned to the pool.
+    Connections autocommit, except inside execute_transaction. aiomysql has no server-side
+    prepared statements, so registered statements are sent as text with their parameters
+    escaped by the client.
+
+    Failed calls are tried up to three times. Writes are only tried again if they failed
+    before reaching the server: once a statement may have run, a lost connection doesn't say
+    whether it committed, and running an INSERT or a conditional UPDATE twice isn't safe.
+    """
+    _instance = None
+    _lock = Lock()
+
+    def __new__(cls, *args, **kwargs):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = super(AsyncDatabaseConnector, cls).__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        if not hasattr(self, "_initialized"):
+            config = Configuration()
+            db_config = config.get_database_config()
+            pool_config = config.get_database_pool_config()
+
+            self.host = db_config["host"]
+            self.port = int(db_config["port"] or 3306)
+            self.user = db_config["user"]
+            self.password = db_config["password"]
+            self.database = db_config["name"]
+            self.min_size = pool_config["min_size"]
+            self.max_size = pool_config["max_size"]
+            self.recycle = pool_config["recycle"]
+            self.connect_timeout = pool_config["connect_timeout"]
+            self.query_timeout = pool_config["query_timeout"]
+            self.pool = None
+            self._pool_lock = None
+            self._initialized = True
+
+    async def _get_pool(self):
+        # The pool belongs to the loop it was created on, so it can't be made in __init__.
+        if self._pool_lock is None:
+            self._pool_lock = asyncio.Lock()
+        async with self._pool_lock:
+            if self.pool is None:
+                self.pool = await aiomysql.create_pool(
+                    minsize=self.min_size,
+                    maxsize=self.max_size,
+                    pool_recycle=self.recycle,
+                    host=self.host,
+                    port=self.port,
+                    user=self.user,
+                    password=self.password,
+                    db=self.database,
+                    connect_timeout=self.connect_timeout,
+                    autocommit=True,
+                )
+                log.info(f"Opened database connection pool to {self.host}:{self.port} with {self.min_size}-{self.max_size} connections.")
+        return self.pool
+
+    async def _run(self, work, idempotent=True, retry_count=0):
+        """
+        Runs work(connection) on a pooled connection within the query timeout, retrying on database errors.
+        :param idempotent: False if work must not run again once it may have reached the server.
+        """
+        pool = await self._get_pool()
+        sent = False
+        try:
+            conn = await pool.acquire()
+            sent = True
+            try:
+                return await asyncio.wait_for(work(conn), self.query_timeout)
+            except BaseException:
+                # A failed or cancelled call can leave the connection mid-result.
+                conn.close()
+                raise
+            finally:
+                pool.release(conn)
+        except aiomysql.Error as e:
+            retry_count += 1
+            if retry_count < 3 and (idempotent or not sent):
+                return await self._run(work, idempotent, retry_count)
+            raise e
+
+    async def query(self, sql, params=None):
+        async def execute_query(conn):
+            async with conn.cursor() as mycursor:
+                await mycursor.execute(statement_sql(sql), params)
+                return list(await mycursor.fetchall())
+
+        return await self._run(execute_query)
+
+    async def insert(self, sql, params=None):
+        async def execute_query(conn):
+            async with conn.cursor() as mycursor:
+                await mycursor.execute(statement_sql(sql), params)
+                return mycursor.lastrowid
+
+        return await self._run(execute_query, idempotent=False)
+
+    async def insert_many(self, sql, rows):
+        """
+        Inserts rows with one multi-row INSERT, committed once. sql is an INSERT ... VALUES with
+        one row of placeholders and may end in ON DUPLICATE KEY UPDATE. aiomysql only rewrites
+        VALUES made up of placeholders alone; with anything else, such as NOW(), the rows are
+        inserted one by one, still in one transaction.
+        Returns the number of affected rows, in which an updated duplicate counts twice.
+        """
+        if not rows:
+            return 0
+
+        async def execute_query(conn):
+            await conn.begin()
+            try:
+                async with conn.cursor() as mycursor:
+                    await mycursor.executemany(statement_sql(sql), rows)
+                await conn.commit()
+                return mycursor.rowcount
+            except BaseException:
+                if not conn.closed:
+                    await conn.rollback()
+                raise
+
+        return await self._run(execute_query, idempotent=False)
+
+    async def execute(self, sql, params=None):
+        """
+        Runs a single UPDATE/DELETE statement and returns the number of affected rows.
+        """
+        async def execute_query(conn):
+            async with conn.cursor() as mycursor:
+                await mycursor.execute(statement_sql(sql), params)
+                return mycursor.rowcount
+
+        return await self._run(execute_query, idempotent=False)
+
+    async def execute_transaction(self, work):
+        """
+        Runs work(cursor) on a single connection and commits everything it executed in one
+        transaction, rolling back if it raises.
+        :param work: Coroutine function taking an aiomysql cursor; its return value is returned.
+        """
+        async def execute_query(conn):
+            await conn.begin()
+            try:
+                async with conn.cursor() as mycursor:
+                    result = await work(mycursor)
+                await conn.commit()
+                return result
+            except BaseException:
+                if not conn.closed:
+                    await conn.rollback()
+                raise
+
+        return await self._run(execute_query, idempotent=False)
+
+    async def fetch_one(self, table, id):
+        async def execute_query(conn):
+            async with conn.cursor() as mycursor:
+                await mycursor.execute(f"SELECT * FROM {table} WHERE id = %s", (id,))
+                return await mycursor.fetchone()
+
+        return await self._run(execute_query)
+
+    async def delete(self, table, id):
+        async def execute_query(conn):
+            async with conn.cursor() as mycursor:
+                await mycursor.execute(f"DELETE FROM {table} WHERE id = %s", (id,))
+
+        await self._run(execute_query)
+
+    async def fetch_all(self, table, page, page_size=10):
+        async def execute_query(conn):
+            async with conn.cursor() as mycursor:
+                offset = (page - 1) * page_size
+                await mycursor.execute(f"SELECT * FROM {table} LIMIT %s OFFSET %s", (page_size, offset))
+                return list(await mycursor.fetchall())
+
+        return await self._run(execute_query)
+
+    async def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            await self.pool.wait_closed()
+            self.pool = None
@@ -33,6 +33,24 @@ class ImagesRepositoryCache(IImagesDAO):
             await self.redis_connector.set(image.cdn_path, json.dumps(image.to_dict()))
             return await self.repository.add_image(image)
 
+    async def add_images(self, images: list) -> list:
+        log.info(f"Adding {len(images)} images to cache")
+        await self.redis_connector.connect()
+        image_ids = [None] * len(images)
+        missing = []
+        for index, image in enumerate(images):
+            cached_image = await self.redis_connector.get(image.cdn_path)
+            if cached_image:
+                image_ids[index] = json.loads(cached_image)["id"]
+            else:
+                await self.redis_connector.set(image.cdn_path, json.dumps(image.to_dict()))
+                missing.append(index)
+        if missing:
+            new_ids = await self.repository.add_images([images[index] for index in missing])
+            for index, image_id in zip(missing, new_ids):
+                image_ids[index] = image_id
+        return image_ids
+
     async def get_image(self, image_id: str) -> 'Image':
         log.info(f"Retrieving image with ID: {image_id}")
         await self.redis_connector.connect()
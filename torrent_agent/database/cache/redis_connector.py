@@ -1,4 +1,5 @@
 import redis.asyncio as redis
+from redis.exceptions import ResponseError
 from threading import Lock
 
 from torrent_agent.common.configuration import Configuration  # Import the Configuration class
@@ -58,5 +59,62 @@ class RedisConnector:
             await self.connect()
         return await self.redis.keys(pattern)
 
+    async def xadd(self, stream, fields, maxlen=None):
+        if not self.redis:
+            await self.connect()
+        return await self.redis.xadd(stream, fields, maxlen=maxlen, approximate=True)
+
+    async def xdel(self, stream, *ids):
+        if not self.redis:
+            await self.connect()
+        return await self.redis.xdel(stream, *ids)
+
+    async def xrange(self, stream, min="-", max="+", count=None):
+        if not self.redis:
+            await self.connect()
+        return await self.redis.xrange(stream, min=min, max=max, count=count)
+
+    async def xgroup_create(self, stream, group, id="0"):
+        """
+        Create a consumer group, and the stream if it doesn't exist. Does nothing if the group exists.
+        """
+        if not self.redis:
+            await self.connect()
+        try:
+            await self.redis.xgroup_create(stream, group, id=id, mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def xreadgroup(self, group, consumer, streams, count=None, block=None):
+        if not self.redis:
+            await self.connect()
+        return await self.redis.xreadgroup(group, consumer, streams, count=count, block=block)
+
+    async def xack(self, stream, group, *ids):
+        if not self.redis:
+            await self.connect()
+        return await self.redis.xack(stream, group, *ids)
+
+    async def xautoclaim(self, stream, group, consumer, min_idle_time, start_id="0-0", count=None):
+        if not self.redis:
+            await self.connect()
+        return await self.redis.xautoclaim(stream, group, consumer, min_idle_time, start_id=start_id, count=count)
+
+    async def xclaim(self, stream, group, consumer, min_idle_time, ids, justid=False):
+        if not self.redis:
+            await self.connect()
+        return await self.redis.xclaim(stream, group, consumer, min_idle_time, ids, justid=justid)
+
+    async def xpending(self, stream, group):
+        if not self.redis:
+            await self.connect()
+        return await self.redis.xpending(stream, group)
+
+    async def xpending_range(self, stream, group, min, max, count, consumername=None):
+        if not self.redis:
+            await self.connect()
+        return await self.redis.xpending_range(stream, group, min, max, count, consumername=consumername)
+
     async def close(self):  
         await self.redis.close()
\ No newline at end of file
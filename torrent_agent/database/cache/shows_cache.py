@@ -33,6 +33,7 @@ class ShowsRepositoryCache(IShowsDAO):
             return json.loads(cached_show)["id"]
 
         show_id = await self.repository.add_show(show)
+        show.id = show_id
         await self.redis_connector.set(show.show_folder, json.dumps(show.to_dict()))
         return show_id
 
@@ -84,6 +85,24 @@ class ShowsRepositoryCache(IShowsDAO):
         await self.redis_connector.set(cache_key, json.dumps({"id": episode_id}))
         return episode_id
 
+    async def add_episodes(self, episodes: list) -> list:
+        log.info(f"Adding {len(episodes)} episodes")
+        episode_ids = [None] * len(episodes)
+        missing = []
+        for index, episode in enumerate(episodes):
+            cached_episode = await self.redis_connector.get(f"{episode.show_id}_season_{episode.season_id}_episode_{episode.episode_number}")
+            if cached_episode:
+                episode_ids[index] = json.loads(cached_episode)["id"]
+            else:
+                missing.append(index)
+        if missing:
+            new_ids = await self.repository.add_episodes([episodes[index] for index in missing])
+            for index, episode_id in zip(missing, new_ids):
+                episode = episodes[index]
+                episode_ids[index] = episode_id
+                await self.redis_connector.set(f"{episode.show_id}_season_{episode.season_id}_episode_{episode.episode_number}", json.dumps({"id": episode_id}))
+        return episode_ids
+
     async def get_season_by_show_and_number(self, show_id: str, season_number: int) -> dict:
         log.info(f"Retrieving season {season_number} for show with ID: {show_id}")
         cache_key = f"{show_id}_season_{season_number}"
@@ -96,3 +115,19 @@ class ShowsRepositoryCache(IShowsDAO):
         if season:
             await self.redis_connector.set(cache_key, json.dumps(season))
         return season
+
+    async def get_show_tree(self, show_id: str) -> dict:
+        log.info(f"Retrieving seasons and episodes for show with ID: {show_id}")
+        return await self.repository.get_show_tree(show_id)
+
+    async def get_video_ids_in_folder(self, cdn_folder: str) -> dict:
+        log.info(f"Retrieving video IDs below folder: {cdn_folder}")
+        return await self.repository.get_video_ids_in_folder(cdn_folder)
+
+    async def add_seasons_and_episodes(self, show_id: str, season_numbers: list, episodes_by_season: dict) -> dict:
+        log.info(f"Adding seasons {season_numbers} and their episodes to show with ID: {show_id}")
+        season_ids = await self.repository.add_seasons_and_episodes(show_id, season_numbers, episodes_by_season)
+        for season_number, season_id in season_ids.items():
+            cache_key = f"{show_id}_season_{season_number}"
+            await self.redis_connector.set(cache_key, json.dumps({"id": season_id, "show_id": show_id, "season_number": season_number}))
+        return season_ids
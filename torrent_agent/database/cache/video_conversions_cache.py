@@ -24,14 +24,18 @@ class VideoConversionsRepositoryCache(IVideoConversionsDAO):
 
     async def add_conversion(self, conversion: 'VideoConversion') -> int:
         log.info(f"Adding video conversion record to Redis cache: {conversion.original_filename}")
-        conversion_key = f"conversion:{conversion.id}"
-        existing_conversion = await self.redis_connector.get(conversion_key)
-        if existing_conversion:
-            log.info(f"Video conversion record '{conversion.original_filename}' already exists in Redis cache. Skipping addition.")
-            return json.loads(existing_conversion)["id"]
-        else:
-            await self.redis_connector.set(conversion_key, json.dumps(conversion.to_dict()))
-            return await self.repository.add_conversion(conversion)
+        # The id is assigned by the database, so the record can only be cached once it is inserted.
+        conversion.id = await self.repository.add_conversion(conversion)
+        await self.redis_connector.set(f"conversion:{conversion.id}", json.dumps(conversion.to_dict(), default=str))
+        return conversion.id
+
+    async def add_conversions(self, conversions: list) -> list:
+        log.info(f"Adding {len(conversions)} video conversion records to Redis cache")
+        conversion_ids = await self.repository.add_conversions(conversions)
+        for conversion, conversion_id in zip(conversions, conversion_ids):
+            conversion.id = conversion_id
+            await self.redis_connector.set(f"conversion:{conversion.id}", json.dumps(conversion.to_dict(), default=str))
+        return conversion_ids
 
     async def get_conversion(self, conversion_id: int) -> 'VideoConversion':
         log.info(f"Retrieving video conversion record with ID: {conversion_id}")
@@ -44,7 +48,7 @@ class VideoConversionsRepositoryCache(IVideoConversionsDAO):
             log.info(f"Video conversion record '{conversion_id}' not found in Redis cache. Fetching from repository.")
             conversion = await self.repository.get_conversion(conversion_id)
             if conversion:
-                await self.redis_connector.set(conversion_key, json.dumps(conversion.to_dict()))
+                await self.redis_connector.set(conversion_key, json.dumps(conversion.to_dict(), default=str))
                 return conversion
         return None
 
@@ -56,8 +60,32 @@ class VideoConversionsRepositoryCache(IVideoConversionsDAO):
             conversion = VideoConversion.from_dict(json.loads(cached_conversion))
             conversion.conversion_status = status
             conversion.error_message = error_message
-            await self.redis_connector.set(conversion_key, json.dumps(conversion.to_dict()))
+            await self.redis_connector.set(conversion_key, json.dumps(conversion.to_dict(), default=str))
             log.info(f"Updated video conversion record status in Redis cache for ID: {conversion_id}")
         else:
             log.info(f"Video conversion record '{conversion_id}' not found in Redis cache. Fetching from repository to update status.")
-        await self.repository.update_conversion_status(conversion_id, status, error_message)
\ No newline at end of file
+        await self.repository.update_conversion_status(conversion_id, status, error_message)
+
+    async def get_conversions_by_status(self, statuses: list) -> list:
+        # Status scans always go to the database, which is the source of truth for the queue.
+        return await self.repository.get_conversions_by_status(statuses)
+
+    async def claim_conversion(self, conversion_id: int) -> bool:
+        claimed = await self.repository.claim_conversion(conversion_id)
+        if claimed:
+            await self._set_cached_status(conversion_id, "converting")
+        return claimed
+
+    async def heartbeat_conversion(self, conversion_id: int):
+        await self.repository.heartbeat_conversion(conversion_id)
+
+    async def reclaim_stale_conversions(self, lease_seconds: int) -> int:
+        return await self.repository.reclaim_stale_conversions(lease_seconds)
+
+    async def _set_cached_status(self, conversion_id: int, status: str):
+        conversion_key = f"conversion:{conversion_id}"
+        cached_conversion = await self.redis_connector.get(conversion_key)
+        if cached_conversion:
+            conversion = VideoConversion.from_dict(json.loads(cached_conversion))
+            conversion.conversion_status = status
+            await self.redis_connector.set(conversion_key, json.dumps(conversion.to_dict(), default=str))
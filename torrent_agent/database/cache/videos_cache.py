@@ -35,10 +35,27 @@ class VideosRepositoryCache(IVideosDAO):
         new_video = await self.repository.add_video(video)
         
         # Update Redis cache with the new video ID
-        new_video_key = f"video:{new_video.id}"
-        await self.redis_connector.set(new_video_key, json.dumps(new_video.to_dict()))
+        await self._cache_video(new_video)
         return new_video
 
+    async def add_videos(self, videos: list) -> list:
+        log.info(f"Adding {len(videos)} videos to Redis cache")
+        stored = [None] * len(videos)
+        missing = []
+        for index, video in enumerate(videos):
+            existing_video = await self.redis_connector.get(f"video:file_name:{video.file_name}")
+            if existing_video:
+                stored[index] = Video.from_dict(json.loads(existing_video))
+            else:
+                missing.append(index)
+        if missing:
+            new_videos = await self.repository.add_videos([videos[index] for index in missing])
+            for index, new_video in zip(missing, new_videos):
+                stored[index] = new_video
+                if new_video:
+                    await self._cache_video(new_video)
+        return stored
+
     async def get_video(self, video_id: str) -> 'Video':
         log.info(f"Retrieving video with ID: {video_id}")
         video_key = f"video:{video_id}"
@@ -63,7 +80,7 @@ class VideosRepositoryCache(IVideosDAO):
         if video_data:
             video = Video.from_dict(json.loads(video_data))
             video.thumbnail_id = thumbnail_id
-            await self.redis_connector.set(video_key, json.dumps(video.to_dict()))
+            await self._cache_video(video)
             log.info(f"Updated thumbnail in Redis cache for video '{video_id}'.")
         else:
             log.info(f"Video '{video_id}' not found in Redis cache. Fetching from repository to update thumbnail.")
@@ -91,11 +108,19 @@ class VideosRepositoryCache(IVideosDAO):
         video_data = await self.redis_connector.get(video_key)
         if video_data:
             video = Video.from_dict(json.loads(video_data))
+            if video.file_name != file_name:
+                await self.redis_connector.delete(f"video:file_name:{video.file_name}")
             video.file_name = file_name
             video.cdn_path = cdn_path
-            await self.redis_connector.set(video_key, json.dumps(video.to_dict()))
+            await self._cache_video(video)
             log.info(f"Updated video details in Redis cache for video '{video_id}'.")
         else:
             log.info(f"Video '{video_id}' not found in Redis cache. Fetching from repository to update details.")
 
-        await self.repository.update_video_details(video_id, file_name, cdn_path, is_browser_friendly)
\ No newline at end of file
+        await self.repository.update_video_details(video_id, file_name, cdn_path, is_browser_friendly)
+
+    async def _cache_video(self, video: 'Video'):
+        # Videos are looked up both by id and by file name; keep both keys in step.
+        video_data = json.dumps(video.to_dict())
+        await self.redis_connector.set(f"video:{video.id}", video_data)
+        await self.redis_connector.set(f"video:file_name:{video.file_name}", video_data)
@@ -7,6 +7,11 @@ class IImagesDAO(ABC):
         """Add a image to the repository."""
         pass
 
+    @abstractmethod
+    async def add_images(self, images: list) -> list:
+        """Add or update many images at once and return their IDs in the same order."""
+        pass
+
     @abstractmethod
     async def get_image(self, image_id: str) -> 'Image':
         """Retrieve a image from the repository by its ID."""
@@ -27,7 +27,27 @@ class IShowsDAO(ABC):
         """Add an episode to a season in the repository."""
         pass
 
+    @abstractmethod
+    async def add_episodes(self, episodes: list) -> list:
+        """Add or update many episodes, each carrying its show and season IDs, and return their IDs in the same order."""
+        pass
+
     @abstractmethod
     async def get_season_by_show_and_number(self, show_id: str, season_number: int) -> dict:
         """Retrieve a season by show ID and season number."""
+        pass
+
+    @abstractmethod
+    async def get_show_tree(self, show_id: str) -> dict:
+        """Retrieve every season of a show with its episode numbers, keyed by season number."""
+        pass
+
+    @abstractmethod
+    async def get_video_ids_in_folder(self, cdn_folder: str) -> dict:
+        """Retrieve the IDs of all videos below a CDN folder, keyed by CDN path."""
+        pass
+
+    @abstractmethod
+    async def add_seasons_and_episodes(self, show_id: str, season_numbers: list, episodes_by_season: dict) -> dict:
+        """Add missing seasons and episodes of a show in one transaction and return the new season IDs by season number."""
         pass
\ No newline at end of file
@@ -11,6 +11,15 @@ class IVideoConversionsDAO(ABC):
         """
         pass
 
+    @abstractmethod
+    async def add_conversions(self, conversions: list) -> list:
+        """
+        Adds many video conversion records with one insert.
+        :param conversions: VideoConversion objects containing the conversion details.
+        :return: The IDs of the newly inserted records, in the same order.
+        """
+        pass
+
     @abstractmethod
     async def get_conversion(self, conversion_id: int) -> 'VideoConversion':
         """
@@ -28,4 +37,39 @@ class IVideoConversionsDAO(ABC):
         :param status: New status of the conversion.
         :param error_message: Error message if applicable.
         """
+        pass
+
+    @abstractmethod
+    async def get_conversions_by_status(self, statuses: list) -> list:
+        """
+        Retrieves every video conversion record in one of the given statuses, oldest first.
+        :param statuses: List of conversion statuses.
+        :return: List of VideoConversion objects.
+        """
+        pass
+
+    @abstractmethod
+    async def claim_conversion(self, conversion_id: int) -> bool:
+        """
+        Marks a pending video conversion as converting and starts its lease.
+        :param conversion_id: ID of the video conversion record.
+        :return: True if the conversion was claimed, False if it is no longer pending.
+        """
+        pass
+
+    @abstractmethod
+    async def heartbeat_conversion(self, conversion_id: int):
+        """
+        Renews the lease on a conversion that is being converted.
+        :param conversion_id: ID of the video conversion record.
+        """
+        pass
+
+    @abstractmethod
+    async def reclaim_stale_conversions(self, lease_seconds: int) -> int:
+        """
+        Returns conversions whose lease hasn't been renewed within lease_seconds to pending.
+        :param lease_seconds: Age after which a lease is considered abandoned.
+        :return: Number of reclaimed conversions.
+        """
         pass
\ No newline at end of file
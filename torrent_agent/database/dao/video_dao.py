@@ -7,6 +7,11 @@ class IVideosDAO(ABC):
         """Add a video to the repository and return the added video."""
         pass
 
+    @abstractmethod
+    async def add_videos(self, videos: list) -> list:
+        """Add or update many videos at once and return the stored videos in the same order."""
+        pass
+
     @abstractmethod
     async def get_video(self, video_id: str) -> 'Video':
         """Retrieve a video from the repository by its ID."""
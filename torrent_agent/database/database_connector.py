@@ -1,9 +1,56 @@
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from mysql.connector import pooling, Error
 from threading import Lock
 from torrent_agent.common.configuration import Configuration  # Import the Configuration class
+from torrent_agent.common.metrics import MetricEmitter
+from torrent_agent.database.statements import Statement, statement_sql
+
+metric_emitter = MetricEmitter()
+
+# mysql-connector refuses larger pools.
+MAX_POOL_SIZE = 32
+
+class ExecutorCursor:
+    """
+    Cursor for DatabaseConnector.execute_transaction work whose calls are awaited, so the same
+    work runs on either database backend.
+    """
+
+    def __init__(self, cursor, executor):
+        self.cursor = cursor
+        self.executor = executor
+
+    @property
+    def lastrowid(self):
+        return self.cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    async def execute(self, sql, params=None):
+        return await asyncio.get_event_loop().run_in_executor(self.executor, self.cursor.execute, sql, params)
+
+    async def executemany(self, sql, seq_params):
+        return await asyncio.get_event_loop().run_in_executor(self.executor, self.cursor.executemany, sql, seq_params)
+
+    async def fetchone(self):
+        return await asyncio.get_event_loop().run_in_executor(self.executor, self.cursor.fetchone)
+
+    async def fetchall(self):
+        return await asyncio.get_event_loop().run_in_executor(self.executor, self.cursor.fetchall)
 
 class DatabaseConnector:
+    """
+    Runs blocking mysql-connector calls on a thread pool of its own, sized to the connection pool.
+
+    Registered statements (see statements.py) are prepared once per connection and run with
+    bound parameters on a prepared cursor kept for that connection. Pooled sessions aren't reset
+    when a connection goes back to the pool, since that would drop its prepared statements, so
+    connections autocommit and execute_transaction starts its transaction explicitly.
+    """
     _instance = None
     _lock = Lock()
 
@@ -17,6 +64,7 @@ class DatabaseConnector:
         if not hasattr(self, "_initialized"):
             config = Configuration()
             db_config = config.get_database_config()
+            pool_config = config.get_database_pool_config()
 
             print("Database configuration:", db_config)
 
@@ -25,35 +73,87 @@ class DatabaseConnector:
             self.user = db_config["user"]
             self.password = db_config["password"]
             self.database = db_config["name"]
-            self.pool_size = 5
+            self.port = int(db_config["port"] or 3306)
+            self.pool_size = min(pool_config["max_size"], MAX_POOL_SIZE)
 
             self.connection_pool = pooling.MySQLConnectionPool(
                 pool_name="mypool",
                 pool_size=self.pool_size,
                 host=self.host,
+                port=self.port,
                 user=self.user,
                 password=self.password,
                 database=self.database,
+                connection_timeout=int(pool_config["connect_timeout"]),
+                pool_reset_session=False,
+                autocommit=True,
             )
+            self._prepared_cursors = {}
+            self._prepared_lock = Lock()
+            # Calls wait here for a thread rather than on the default executor, which other work shares.
+            self.executor = ThreadPoolExecutor(max_workers=pool_config["executor_workers"], thread_name_prefix="database")
             self._initialized = True
 
-    async def query(self, sql, retry_count=0):
+    def _prepared_cursors_for(self, conn) -> dict:
+        # Statements are prepared on the pooled connection's underlying connection, and are
+        # lost if the pool reconnects it, which gives it a new connection id.
+        connection = conn._cnx
+        with self._prepared_lock:
+            connection_id, cursors = self._prepared_cursors.get(connection, (None, None))
+            if cursors is None or connection_id != connection.connection_id:
+                cursors = {}
+                self._prepared_cursors[connection] = (connection.connection_id, cursors)
+            return cursors
+
+    @contextmanager
+    def _cursor(self, conn, sql):
+        """
+        Yields a cursor for sql and the SQL text to execute on it. A Statement gets the
+        connection's prepared cursor for it, which stays open for the next call; plain SQL gets
+        a cursor that is closed afterwards.
+        """
+        if not isinstance(sql, Statement):
+            with conn.cursor() as mycursor:
+                yield mycursor, sql
+            return
+
+        cursors = self._prepared_cursors_for(conn)
+        mycursor = cursors.get(sql.name)
+        if mycursor is None:
+            mycursor = conn.cursor(prepared=True)
+            cursors[sql.name] = mycursor
+            metric_emitter.database_statements_prepared.labels(statement=sql.name).inc()
+        try:
+            yield mycursor, sql.sql
+        except Error:
+            # The statement may no longer exist on the server; prepare it again next time.
+            cursors.pop(sql.name, None)
+            try:
+                mycursor.close()
+            except Error:
+                pass
+            raise
+
+    async def query(self, sql, params=None, retry_count=0):
         loop = asyncio.get_event_loop()
         try:
             def execute_query():
                 conn = self.connection_pool.get_connection()
                 try:
-                    with conn.cursor() as mycursor:
-                        mycursor.execute(sql)
+                    with self._cursor(conn, sql) as (mycursor, sql_text):
+                        if params:
+                            mycursor.execute(sql_text, params)
+                        else:
+                            mycursor.execute(sql_text)
                         return mycursor.fetchall()
                 finally:
                     conn.close()
 
-            return await loop.run_in_executor(None, execute_query)
+            return await loop.run_in_executor(self.executor, execute_query)
         except Error as e:
             retry_count += 1
             if retry_count < 3:
-                return await self.query(sql, retry_count)
+                return await self.query(sql, params, retry_count)
             raise e
 
     async def insert(self, sql, params=None, retry_count=0):
@@ -62,23 +162,101 @@ class DatabaseConnector:
             def execute_query():
                 conn = self.connection_pool.get_connection()
                 try:
-                    with conn.cursor() as mycursor:
+                    with self._cursor(conn, sql) as (mycursor, sql_text):
                         if params:
-                            mycursor.execute(sql, params)
+                            mycursor.execute(sql_text, params)
                         else:
-                            mycursor.execute(sql)
+                            mycursor.execute(sql_text)
                         conn.commit()
                         return mycursor.lastrowid
                 finally:
                     conn.close()
 
-            return await loop.run_in_executor(None, execute_query)
+            return await loop.run_in_executor(self.executor, execute_query)
         except Error as e:
             retry_count += 1
             if retry_count < 3:
                 return await self.insert(sql, params, retry_count)
             raise e
         
+    async def insert_many(self, sql, rows, retry_count=0):
+        """
+        Inserts rows with one multi-row INSERT, committed once. sql is an INSERT ... VALUES with
+        one row of placeholders and may end in ON DUPLICATE KEY UPDATE; mysql-connector rewrites
+        it to carry every row, so it runs on a plain cursor rather than a prepared one.
+        Returns the number of affected rows, in which an updated duplicate counts twice.
+        """
+        if not rows:
+            return 0
+        loop = asyncio.get_event_loop()
+        try:
+            def execute_query():
+                conn = self.connection_pool.get_connection()
+                try:
+                    with conn.cursor() as mycursor:
+                        mycursor.executemany(statement_sql(sql), rows)
+                        conn.commit()
+                        return mycursor.rowcount
+                finally:
+                    conn.close()
+
+            return await loop.run_in_executor(self.executor, execute_query)
+        except Error as e:
+            retry_count += 1
+            if retry_count < 3:
+                return await self.insert_many(sql, rows, retry_count)
+            raise e
+
+    async def execute(self, sql, params=None, retry_count=0):
+        """
+        Runs a single UPDATE/DELETE statement and returns the number of affected rows.
+        """
+        loop = asyncio.get_event_loop()
+        try:
+            def execute_query():
+                conn = self.connection_pool.get_connection()
+                try:
+                    with self._cursor(conn, sql) as (mycursor, sql_text):
+                        mycursor.execute(sql_text, params)
+                        conn.commit()
+                        return mycursor.rowcount
+                finally:
+                    conn.close()
+
+            return await loop.run_in_executor(self.executor, execute_query)
+        except Error as e:
+            retry_count += 1
+            if retry_count < 3:
+                return await self.execute(sql, params, retry_count)
+            raise e
+
+    async def execute_transaction(self, work, retry_count=0):
+        """
+        Runs work(cursor) on a single connection and commits everything it executed in one
+        transaction, rolling back if it raises.
+        :param work: Coroutine function taking an ExecutorCursor; its return value is returned.
+        """
+        loop = asyncio.get_event_loop()
+        try:
+            conn = await loop.run_in_executor(self.executor, self.connection_pool.get_connection)
+            try:
+                await loop.run_in_executor(self.executor, conn.start_transaction)
+                with conn.cursor() as mycursor:
+                    try:
+                        result = await work(ExecutorCursor(mycursor, self.executor))
+                        await loop.run_in_executor(self.executor, conn.commit)
+                        return result
+                    except Exception:
+                        await loop.run_in_executor(self.executor, conn.rollback)
+                        raise
+            finally:
+                await loop.run_in_executor(self.executor, conn.close)
+        except Error as e:
+            retry_count += 1
+            if retry_count < 3:
+                return await self.execute_transaction(work, retry_count)
+            raise e
+
     async def fetch_one(self, table, id, retry_count=0):
         loop = asyncio.get_event_loop()
         try:
@@ -92,7 +270,7 @@ class DatabaseConnector:
                 finally:
                     conn.close()
 
-            return await loop.run_in_executor(None, execute_query)
+            return await loop.run_in_executor(self.executor, execute_query)
         except Error as e:
             retry_count += 1
             if retry_count < 3:
@@ -112,7 +290,7 @@ class DatabaseConnector:
                 finally:
                     conn.close()
 
-            await loop.run_in_executor(None, execute_query)
+            await loop.run_in_executor(self.executor, execute_query)
         except Error as e:
             retry_count += 1
             if retry_count < 3:
@@ -133,9 +311,19 @@ class DatabaseConnector:
                 finally:
                     conn.close()
 
-            return await loop.run_in_executor(None, execute_query)
+            return await loop.run_in_executor(self.executor, execute_query)
         except Error as e:
             retry_count += 1
             if retry_count < 3:
                 return await self.fetch_all(table, page, page_size, retry_count)
-            raise e
\ No newline at end of file
+            raise e
+
+def create_database_connector():
+    """
+    Returns the connector for the configured database backend. aiomysql is only imported when
+    it is selected.
+    """
+    if Configuration().get_database_backend() == "aiomysql":
+        from torrent_agent.database.async_database_connector import AsyncDatabaseConnector
+        return AsyncDatabaseConnector()
+    return DatabaseConnector()
@@ -1,6 +1,8 @@
 from torrent_agent.common import logger
 from torrent_agent.database.dao.image_dao import IImagesDAO
+from torrent_agent.database import statements
 from torrent_agent.database.database_connector import DatabaseConnector
+from torrent_agent.database.write_behind_batcher import WriteBehindBatcher
 from torrent_agent.model.image import Image
 
 log = logger.get_logger()
@@ -8,10 +10,11 @@ log = logger.get_logger()
 class ImagesRepository(IImagesDAO):
     def __init__(self, db: 'DatabaseConnector'):
         self.db = db
+        self.batcher = WriteBehindBatcher("images", self.add_images)
 
     async def get_image(self, image_id) -> 'Image':
         log.info(f"Retrieving image with ID: {image_id}")
-        result = await self.db.query(f"SELECT * FROM images WHERE filename = '{image_id}'")
+        result = await self.db.query(statements.SELECT_IMAGE_BY_FILENAME, (image_id,))
         if result:
             video_data = result[0]
             return Image(
@@ -24,9 +27,17 @@ class ImagesRepository(IImagesDAO):
     async def add_image(self, image: 'Image') -> int:
         log.info(f"Inserting image {image.file_name} into the database.")
         try:
-            last_row_id = await self.db.insert(
-                f"INSERT INTO images (filename, cdn_path, uploaded) VALUES ('{image.file_name}', '{image.cdn_path}', NOW())")
-            return last_row_id
+            return await self.batcher.submit(image)
         except Exception as e:
             log.error(f'Failed to insert image to db, failed with error {e}', exc_info=True)
             raise e
+
+    async def add_images(self, images: list) -> list:
+        log.info(f"Inserting {len(images)} images into the database.")
+        await self.db.insert_many(statements.UPSERT_IMAGE, [(image.file_name, image.cdn_path) for image in images])
+        # Images are read back by CDN path, which unlike the file name is unique to each image.
+        cdn_paths = list(dict.fromkeys(image.cdn_path for image in images))
+        placeholders = ", ".join(["%s"] * len(cdn_paths))
+        result = await self.db.query(f"SELECT cdn_path, id FROM images WHERE cdn_path IN ({placeholders}) ORDER BY id", tuple(cdn_paths))
+        image_ids = {cdn_path: image_id for cdn_path, image_id in result or []}
+        return [image_ids.get(image.cdn_path) for image in images]
@@ -1,6 +1,10 @@
+from dataclasses import replace
+
 from torrent_agent.common import logger
 from torrent_agent.database.dao.show_dao import IShowsDAO
+from torrent_agent.database import statements
 from torrent_agent.database.database_connector import DatabaseConnector
+from torrent_agent.database.write_behind_batcher import WriteBehindBatcher
 from torrent_agent.model.show import Show, Episode
 
 log = logger.get_logger()
@@ -8,10 +12,11 @@ log = logger.get_logger()
 class ShowsRepository(IShowsDAO):
     def __init__(self, db: 'DatabaseConnector'):
         self.db = db
+        self.episode_batcher = WriteBehindBatcher("episodes", self.add_episodes)
 
     async def get_show(self, show_id) -> 'Show':
         log.info(f"Retrieving show with ID: {show_id}")
-        result = await self.db.query(f"SELECT * FROM shows WHERE id = {show_id}")
+        result = await self.db.query(statements.SELECT_SHOW_BY_ID, (show_id,))
         if result:
             show_data = result[0]
             return Show(
@@ -26,8 +31,7 @@ class ShowsRepository(IShowsDAO):
     async def add_show(self, show: 'Show') -> int:
         log.info(f"Inserting show {show.name} into the database.")
         try:
-            last_row_id = await self.db.insert(
-                f"INSERT INTO shows (name, description, thumbnail_id) VALUES ('{show.name}', '{show.description}', {show.thumbnail_id})")
+            last_row_id = await self.db.insert(statements.INSERT_SHOW, (show.name, show.description, show.thumbnail_id, show.show_folder))
             return last_row_id
         except Exception as e:
             log.error(f'Failed to insert show to db, failed with error {e}', exc_info=True)
@@ -35,7 +39,7 @@ class ShowsRepository(IShowsDAO):
         
     async def get_show_by_folder(self, show_folder: str) -> 'Show':
         log.info(f"Retrieving show with folder: {show_folder}")
-        result = await self.db.query(f"SELECT * FROM shows WHERE show_folder = '{show_folder}'")
+        result = await self.db.query(statements.SELECT_SHOW_BY_FOLDER, (show_folder,))
         if result:
             show_data = result[0]
             return Show(
@@ -50,9 +54,7 @@ class ShowsRepository(IShowsDAO):
     async def add_season(self, show_id: str, season_number: int) -> int:
         log.info(f"Adding season {season_number} to show with ID: {show_id}")
         try:
-            last_row_id = await self.db.insert(
-                f"INSERT INTO seasons (show_id, season_number) VALUES ({show_id}, {season_number})"
-            )
+            last_row_id = await self.db.insert(statements.INSERT_SEASON, (show_id, season_number))
             return last_row_id
         except Exception as e:
             log.error(f"Failed to add season to db, failed with error {e}", exc_info=True)
@@ -61,20 +63,29 @@ class ShowsRepository(IShowsDAO):
     async def add_episode(self, show_id: str, season_id: int, episode: 'Episode') -> int:
         log.info(f"Adding episode {episode.episode_number} to season {season_id} for show with ID: {show_id}")
         try:
-            last_row_id = await self.db.insert(
-                f"INSERT INTO episodes (video_id, episode_number, show_id, description, season_id) "
-                f"VALUES ({episode.video_id}, {episode.episode_number}, {show_id}, '{episode.description}', {season_id})"
-            )
-            return last_row_id
+            return await self.episode_batcher.submit(replace(episode, show_id=show_id, season_id=season_id))
         except Exception as e:
             log.error(f"Failed to add episode to db, failed with error {e}", exc_info=True)
             raise e
+
+    async def add_episodes(self, episodes: list) -> list:
+        log.info(f"Adding {len(episodes)} episodes.")
+        await self.db.insert_many(statements.UPSERT_EPISODE, [
+            (episode.video_id, episode.episode_number, episode.show_id, episode.description, episode.season_id)
+            for episode in episodes
+        ])
+        keys = list(dict.fromkeys((episode.season_id, episode.episode_number) for episode in episodes))
+        placeholders = ", ".join(["(%s, %s)"] * len(keys))
+        result = await self.db.query(
+            f"SELECT season_id, episode_number, id FROM episodes WHERE (season_id, episode_number) IN ({placeholders}) ORDER BY id",
+            tuple(value for key in keys for value in key)
+        )
+        episode_ids = {(season_id, episode_number): episode_id for season_id, episode_number, episode_id in result or []}
+        return [episode_ids.get((episode.season_id, episode.episode_number)) for episode in episodes]
         
     async def get_season_by_show_and_number(self, show_id: str, season_number: int) -> dict:
         log.info(f"Retrieving season {season_number} for show with ID: {show_id}")
-        result = await self.db.query(
-            f"SELECT * FROM seasons WHERE show_id = {show_id} AND season_number = {season_number}"
-        )
+        result = await self.db.query(statements.SELECT_SEASON_BY_SHOW_AND_NUMBER, (show_id, season_number))
         if result:
             return {
                 'id': result[0][0],
@@ -82,3 +93,44 @@ class ShowsRepository(IShowsDAO):
                 'season_number': result[0][2]
             }
         return None
+
+    async def get_show_tree(self, show_id: str) -> dict:
+        log.info(f"Retrieving seasons and episodes for show with ID: {show_id}")
+        result = await self.db.query(statements.SELECT_SHOW_TREE, (show_id,))
+        tree = {}
+        for season_id, season_number, episode_number in result or []:
+            season = tree.setdefault(season_number, {'id': season_id, 'episodes': set()})
+            if episode_number is not None:
+                season['episodes'].add(episode_number)
+        return tree
+
+    async def get_video_ids_in_folder(self, cdn_folder: str) -> dict:
+        log.info(f"Retrieving video IDs below folder: {cdn_folder}")
+        escaped_folder = cdn_folder.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        result = await self.db.query(statements.SELECT_VIDEO_IDS_BELOW_FOLDER, (escaped_folder.rstrip("/") + "/%",))
+        return {cdn_path: video_id for cdn_path, video_id in result or []}
+
+    async def add_seasons_and_episodes(self, show_id: str, season_numbers: list, episodes_by_season: dict) -> dict:
+        log.info(f"Adding {len(season_numbers)} seasons and {sum(len(episodes) for episodes in episodes_by_season.values())} episodes to show with ID: {show_id}")
+
+        async def reconcile(cursor):
+            season_ids = {}
+            for season_number in season_numbers:
+                await cursor.execute(statements.INSERT_SEASON.sql, (show_id, season_number))
+                season_ids[season_number] = cursor.lastrowid
+
+            episode_rows = [
+                (episode.video_id, episode.episode_number, show_id, episode.description,
+                 episode.season_id if episode.season_id is not None else season_ids[season_number])
+                for season_number, episodes in episodes_by_season.items()
+                for episode in episodes
+            ]
+            if episode_rows:
+                await cursor.executemany(statements.INSERT_EPISODE.sql, episode_rows)
+            return season_ids
+
+        try:
+            return await self.db.execute_transaction(reconcile)
+        except Exception as e:
+            log.error(f"Failed to add seasons and episodes to db, failed with error {e}", exc_info=True)
+            raise e
@@ -0,0 +1,77 @@
+from dataclasses import dataclass
+
+@dataclass(frozen=True)
+class Statement:
+    """
+    A named SQL statement with %s placeholders for its parameters.
+    DatabaseConnector prepares each one once per connection and runs it with bound parameters.
+    """
+    name: str
+    sql: str
+
+STATEMENTS = {}
+
+def register(name: str, sql: str) -> Statement:
+    """
+    Add a statement to the registry.
+    :raises ValueError: If a statement with the same name is already registered.
+    """
+    if name in STATEMENTS:
+        raise ValueError(f"Statement '{name}' is already registered")
+    statement = Statement(name, " ".join(sql.split()))
+    STATEMENTS[name] = statement
+    return statement
+
+def statement_sql(sql) -> str:
+    """
+    Returns the SQL text of a Statement, or sql itself if it is already text.
+    """
+    return sql.sql if isinstance(sql, Statement) else sql
+
+# Videos
+VIDEO_COLUMNS = "filename, cdn_path, title, uploaded, entertainment_type, id, thumbnail_id"
+
+UPSERT_VIDEO = register("upsert_video", """
+    INSERT INTO videos (filename, cdn_path, title, uploaded, entertainment_type) VALUES (%s, %s, %s, NOW(), %s)
+    ON DUPLICATE KEY UPDATE cdn_path = VALUES(cdn_path), title = VALUES(title), entertainment_type = VALUES(entertainment_type)
+""")
+UPSERT_MOVIE = register("upsert_movie", "INSERT INTO movies (name, video_id) VALUES (%s, %s) ON DUPLICATE KEY UPDATE name = VALUES(name)")
+SELECT_VIDEO_BY_TITLE_OR_FILENAME = register("select_video_by_title_or_filename", f"SELECT {VIDEO_COLUMNS} FROM videos WHERE title = %s OR filename = %s")
+SELECT_VIDEO_BY_FILENAME = register("select_video_by_filename", f"SELECT {VIDEO_COLUMNS} FROM videos WHERE filename = %s")
+UPDATE_VIDEO_THUMBNAIL = register("update_video_thumbnail", "UPDATE videos SET thumbnail_id = %s WHERE id = %s")
+UPDATE_VIDEO_DETAILS = register("update_video_details", "UPDATE videos SET filename = %s, cdn_path = %s, browser_friendly = %s WHERE id = %s")
+
+# Images
+SELECT_IMAGE_BY_FILENAME = register("select_image_by_filename", "SELECT * FROM images WHERE filename = %s")
+UPSERT_IMAGE = register("upsert_image", "INSERT INTO images (filename, cdn_path, uploaded) VALUES (%s, %s, NOW()) ON DUPLICATE KEY UPDATE filename = VALUES(filename)")
+
+# Shows, seasons and episodes
+SELECT_SHOW_BY_ID = register("select_show_by_id", "SELECT * FROM shows WHERE id = %s")
+SELECT_SHOW_BY_FOLDER = register("select_show_by_folder", "SELECT * FROM shows WHERE show_folder = %s")
+INSERT_SHOW = register("insert_show", "INSERT INTO shows (name, description, thumbnail_id, show_folder) VALUES (%s, %s, %s, %s)")
+INSERT_SEASON = register("insert_season", "INSERT INTO seasons (show_id, season_number) VALUES (%s, %s)")
+INSERT_EPISODE = register("insert_episode", "INSERT INTO episodes (video_id, episode_number, show_id, description, season_id) VALUES (%s, %s, %s, %s, %s)")
+UPSERT_EPISODE = register("upsert_episode", """
+    INSERT INTO episodes (video_id, episode_number, show_id, description, season_id) VALUES (%s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE video_id = VALUES(video_id), description = VALUES(description)
+""")
+SELECT_SEASON_BY_SHOW_AND_NUMBER = register("select_season_by_show_and_number", "SELECT * FROM seasons WHERE show_id = %s AND season_number = %s")
+SELECT_SHOW_TREE = register("select_show_tree", """
+    SELECT seasons.id, seasons.season_number, episodes.episode_number FROM seasons
+    LEFT JOIN episodes ON episodes.season_id = seasons.id WHERE seasons.show_id = %s
+""")
+SELECT_VIDEO_IDS_BELOW_FOLDER = register("select_video_ids_below_folder", "SELECT cdn_path, id FROM videos WHERE cdn_path LIKE %s")
+
+# Video conversions
+INSERT_CONVERSION = register("insert_conversion", """
+    INSERT INTO video_conversions (original_video_id, original_filename, converted_filename, conversion_status, error_message, created_at, updated_at)
+    VALUES (%s, %s, %s, %s, %s, NOW(), NOW())
+""")
+SELECT_CONVERSION_BY_ID = register("select_conversion_by_id", "SELECT * FROM video_conversions WHERE id = %s")
+UPDATE_CONVERSION_STATUS = register("update_conversion_status", "UPDATE video_conversions SET conversion_status = %s, error_message = %s, updated_at = NOW() WHERE id = %s")
+CLAIM_CONVERSION = register("claim_conversion", "UPDATE video_conversions SET conversion_status = 'converting', updated_at = NOW() WHERE id = %s AND conversion_status = 'pending'")
+HEARTBEAT_CONVERSION = register("heartbeat_conversion", "UPDATE video_conversions SET updated_at = NOW() WHERE id = %s AND conversion_status = 'converting'")
+RECLAIM_STALE_CONVERSIONS = register("reclaim_stale_conversions", """
+    UPDATE video_conversions SET conversion_status = 'pending', updated_at = NOW()
+    WHERE conversion_status = 'converting' AND updated_at < NOW() - INTERVAL %s SECOND
+""")
@@ -1,6 +1,8 @@
 from torrent_agent.common import logger
 from torrent_agent.database.dao.video_conversion_dao import IVideoConversionsDAO
+from torrent_agent.database import statements
 from torrent_agent.database.database_connector import DatabaseConnector
+from torrent_agent.database.write_behind_batcher import WriteBehindBatcher
 from torrent_agent.model.video_conversion import VideoConversion
 
 log = logger.get_logger()
@@ -9,43 +11,77 @@ class VideoConversionsRepository(IVideoConversionsDAO):
     def __init__(self, db: 'DatabaseConnector'):
         self.db = db
         self.table_name = 'video_conversions'
+        self.batcher = WriteBehindBatcher("conversions", self.add_conversions)
 
     async def add_conversion(self, conversion: 'VideoConversion') -> int:
-        sql = f"""
-        INSERT INTO {self.table_name} (original_video_id, original_filename, converted_filename, conversion_status, error_message, created_at, updated_at)
-        VALUES ({conversion.original_video_id}, '{conversion.original_filename}', '{conversion.converted_filename}', '{conversion.conversion_status}', '{conversion.error_message}', NOW(), NOW())
-        """
-        log.info(f"Inserting video conversion record into the database. [{sql}]")
+        log.info(f"Inserting video conversion record for '{conversion.original_filename}' into the database.")
         try:
-            last_row_id = await self.db.insert(sql)
-            return last_row_id
+            return await self.batcher.submit(conversion)
         except Exception as e:
             log.error(f"Failed to insert video conversion record to db, failed with error {e}", exc_info=True)
             raise e
 
+    async def add_conversions(self, conversions: list) -> list:
+        log.info(f"Inserting {len(conversions)} video conversion records into the database.")
+        await self.db.insert_many(statements.INSERT_CONVERSION, [
+            (conversion.original_video_id, conversion.original_filename, conversion.converted_filename,
+             conversion.conversion_status, conversion.error_message)
+            for conversion in conversions
+        ])
+        # A file can have older conversion records, so each one takes the newest record for its file.
+        filenames = list(dict.fromkeys(conversion.original_filename for conversion in conversions))
+        placeholders = ", ".join(["%s"] * len(filenames))
+        result = await self.db.query(
+            f"SELECT original_filename, MAX(id) FROM {self.table_name} WHERE original_filename IN ({placeholders}) GROUP BY original_filename",
+            tuple(filenames)
+        )
+        conversion_ids = {filename: conversion_id for filename, conversion_id in result or []}
+        return [conversion_ids.get(conversion.original_filename) for conversion in conversions]
+
     async def get_conversion(self, conversion_id: int) -> 'VideoConversion':
-        sql = f"SELECT * FROM {self.table_name} WHERE id = {conversion_id}"
-        log.info(f"Retrieving video conversion record with ID: {conversion_id}. [{sql}]")
-        result = await self.db.query(sql)
+        log.info(f"Retrieving video conversion record with ID: {conversion_id}.")
+        result = await self.db.query(statements.SELECT_CONVERSION_BY_ID, (conversion_id,))
         if result:
-            conversion_data = result[0]
-            return VideoConversion.from_dict({
-                "id": conversion_data[0],
-                "original_video_id": conversion_data[1],
-                "original_filename": conversion_data[2],
-                "converted_filename": conversion_data[3],
-                "conversion_status": conversion_data[4],
-                "error_message": conversion_data[5],
-                "created_at": conversion_data[6],
-                "updated_at": conversion_data[7],
-            })
+            return self._row_to_conversion(result[0])
         return None
 
     async def update_conversion_status(self, conversion_id: int, status: str, error_message: str = None):
-        sql = f"UPDATE {self.table_name} SET conversion_status = '{status}', error_message = '{error_message}', updated_at = NOW() WHERE id = {conversion_id}"
-        log.info(f"Updating video conversion record with ID: {conversion_id}. [{sql}]")
+        log.info(f"Updating video conversion record with ID: {conversion_id} to status '{status}'.")
         try:
-            await self.db.insert(sql)
+            await self.db.insert(statements.UPDATE_CONVERSION_STATUS, (status, error_message, conversion_id))
         except Exception as e:
             log.error(f"Failed to update video conversion record in db, failed with error {e}", exc_info=True)
-            raise e
\ No newline at end of file
+            raise e
+
+    async def get_conversions_by_status(self, statuses: list) -> list:
+        placeholders = ", ".join(["%s"] * len(statuses))
+        sql = f"SELECT * FROM {self.table_name} WHERE conversion_status IN ({placeholders}) ORDER BY created_at, id"
+        log.info(f"Retrieving video conversion records with status in {statuses}.")
+        result = await self.db.query(sql, tuple(statuses))
+        return [self._row_to_conversion(row) for row in result or []]
+
+    async def claim_conversion(self, conversion_id: int) -> bool:
+        log.info(f"Claiming video conversion record with ID: {conversion_id}.")
+        return await self.db.execute(statements.CLAIM_CONVERSION, (conversion_id,)) == 1
+
+    async def heartbeat_conversion(self, conversion_id: int):
+        await self.db.execute(statements.HEARTBEAT_CONVERSION, (conversion_id,))
+
+    async def reclaim_stale_conversions(self, lease_seconds: int) -> int:
+        reclaimed = await self.db.execute(statements.RECLAIM_STALE_CONVERSIONS, (int(lease_seconds),))
+        if reclaimed:
+            log.info(f"Reclaimed {reclaimed} video conversion(s) whose lease expired.")
+        return reclaimed
+
+    @staticmethod
+    def _row_to_conversion(conversion_data) -> 'VideoConversion':
+        return VideoConversion.from_dict({
+            "id": conversion_data[0],
+            "original_video_id": conversion_data[1],
+            "original_filename": conversion_data[2],
+            "converted_filename": conversion_data[3],
+            "conversion_status": conversion_data[4],
+            "error_message": conversion_data[5],
+            "created_at": conversion_data[6],
+            "updated_at": conversion_data[7],
+        })
\ No newline at end of file
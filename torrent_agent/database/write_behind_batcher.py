@@ -0,0 +1,105 @@
+import asyncio
+import time
+
+from torrent_agent.common.configuration import Configuration
+from torrent_agent.common.metrics import MetricEmitter
+
+metric_emitter = MetricEmitter()
+
+class WriteBehindBatcher:
+    """
+    Collects single writes and hands them to a bulk write in batches.
+
+    A batch is written once max_batch writes are waiting or max_delay seconds after its first
+    write, whichever comes first. Each caller gets back its own entry of the bulk write's
+    results, e.g. the id generated for its row. If the bulk write fails, its items are written
+    again one at a time, so only the callers whose own item fails get an error.
+    """
+
+    def __init__(self, name: str, write_many, max_batch: int = None, max_delay: float = None):
+        """
+        :param name: Name of the batcher in logs and metrics.
+        :param write_many: Coroutine function taking a list of items and returning a list of
+            results in the same order.
+        :param max_batch: Most writes in one batch. 1 writes every item on its own straight away.
+        :param max_delay: Seconds the first write of a batch waits for others to join it.
+        """
+        batch_config = Configuration().get_database_write_batch_config()
+        self.name = name
+        self.write_many = write_many
+        self.max_batch = max_batch or batch_config["max_batch"]
+        self.max_delay = max_delay if max_delay is not None else batch_config["max_delay"]
+        self._pending = []
+        self._timer = None
+        self._tasks = set()
+
+    async def submit(self, item):
+        """
+        Queue an item for the next batch and wait for it to be written.
+        :return: The bulk write's result for the item.
+        """
+        if self.max_batch <= 1:
+            return (await self._write_batch([item]))[0]
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush_pending()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._flush_pending)
+        return await future
+
+    async def flush(self):
+        """
+        Write everything submitted so far and wait for the writes to finish.
+        """
+        self._flush_pending()
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    def _flush_pending(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._write(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _write(self, batch: list):
+        results = {}
+        errors = {}
+        try:
+            try:
+                results = dict(enumerate(await self._write_batch([item for item, _ in batch])))
+            except Exception as e:
+                if len(batch) == 1:
+                    errors[0] = e
+                else:
+                    # One bad row fails the whole statement, so find it by writing the rows
+                    # on their own. The callers log the errors.
+                    for index, (item, _) in enumerate(batch):
+                        try:
+                            results[index] = (await self._write_batch([item]))[0]
+                        except Exception as item_error:
+                            errors[index] = item_error
+        finally:
+            # Every future is resolved, even if this task is cancelled or the bulk write
+            # returned too few results. A caller that gave up waiting still had its write done.
+            for index, (_, future) in enumerate(batch):
+                if future.done():
+                    continue
+                if index in errors:
+                    future.set_exception(errors[index])
+                elif index in results:
+                    future.set_result(results[index])
+                else:
+                    future.set_exception(RuntimeError(f"Write batch '{self.name}' returned no result for this item"))
+
+    async def _write_batch(self, items: list) -> list:
+        started = time.monotonic()
+        results = await self.write_many(items)
+        metric_emitter.database_write_batch_size.labels(batcher=self.name).observe(len(items))
+        metric_emitter.database_write_batch_duration.labels(batcher=self.name).observe(time.monotonic() - started)
+        return results
@@ -12,15 +12,26 @@ class ImageProcessor:
         self.repository = repository
 
     async def process_image(self, file_name, file_path):
-        if await self.repository.get_image(file_name) is None:
-            extension = "." + file_path.split(".")[-1].lower()
+        """
+        Ingests an image file. Returns True once the image is stored, False otherwise.
+        """
+        if not await self.is_stored(file_name):
+            return await self.ingest_image(file_name, file_path)
+        else:
+            log.info("File is already processed and stored: " + file_name)
+            return True
+
+    async def is_stored(self, file_name):
+        return await self.repository.get_image(file_name) is not None
+
+    async def ingest_image(self, file_name, file_path):
+        extension = "." + file_path.split(".")[-1].lower()
 
-            if extension in IMAGE_FILETYPES:
-                cdn_path = file_path.replace('/mnt/ext1', '')
-                image = Image(file_name=file_name, cdn_path=cdn_path, uploaded=None)
-                await self.repository.add_image(image)
-            else:
-                log.info(f"File '{file_name}' is not a supported image format. Skipping.")
-                return
+        if extension in IMAGE_FILETYPES:
+            cdn_path = file_path.replace('/mnt/ext1', '')
+            image = Image(file_name=file_name, cdn_path=cdn_path, uploaded=None)
+            await self.repository.add_image(image)
+            return True
         else:
-            log.info("File is already processed and stored: " + file_name)
\ No newline at end of file
+            log.info(f"File '{file_name}' is not a supported image format. Skipping.")
+            return False
@@ -6,10 +6,15 @@ class Show:
     description: str
     thumbnail_id: int
     id: int = None
+    show_folder: str = None
 
     def to_dict(self):
         return asdict(self)
 
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
 @dataclass
 class Season:
     show_id: int
@@ -25,6 +30,7 @@ class Episode:
     episode_number: int
     show_id: int
     season_id: int = None
+    description: str = ""
 
     def to_dict(self):
         return asdict(self)
\ No newline at end of file
@@ -0,0 +1,207 @@
+import hashlib
+import mmap
+import os
+import shlex
+
+from torrent_agent.common import logger
+from torrent_agent.common.configuration import Configuration
+from torrent_agent.common.metrics import MetricEmitter
+from torrent_agent.remote.ssh_pool import CONNECTION_ERRORS
+
+log = logger.get_logger()
+metric_emitter = MetricEmitter()
+
+PART_SUFFIX = ".part"
+# Chunks are hashed whole but written in slices of this size, with progress reported before
+# each one, so a bandwidth limit applied in on_progress paces the writes instead of the chunks.
+WRITE_SLICE_SIZE = 256 * 1024
+
+# Prints the sha256 of every chunk of a file, then "total <sha256 of the whole file>".
+REMOTE_HASH_SCRIPT = """
+import hashlib, sys
+path, chunk_size = sys.argv[1], int(sys.argv[2])
+total = hashlib.sha256()
+with open(path, 'rb') as f:
+    while True:
+        data = f.read(chunk_size)
+        if not data:
+            break
+        total.update(data)
+        print(hashlib.sha256(data).hexdigest())
+print('total', total.hexdigest())
+"""
+
+# Same output as REMOTE_HASH_SCRIPT for hosts without python3.
+REMOTE_HASH_SHELL = (
+    'size=$(stat -c %s "$0"); i=0; '
+    'while [ $((i * $1)) -lt "$size" ]; do '
+    'dd if="$0" bs="$1" skip=$i count=1 2>/dev/null | sha256sum | cut -d" " -f1; i=$((i + 1)); '
+    'done; '
+    'echo "total $(sha256sum "$0" | cut -d" " -f1)"'
+)
+
+class TransferVerificationError(Exception):
+    pass
+
+class LocalFileDigests:
+    """
+    sha256 of every chunk of a local file and of the whole file, read through mmap so a
+    large file is hashed without copying it into memory.
+    """
+
+    def __init__(self, path: str, chunk_size: int):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.size = os.path.getsize(path)
+        self.chunks = []
+        self.total = None
+
+    def compute(self):
+        if self.total is None:
+            for _ in self.iter_chunks():
+                pass
+
+    def iter_chunks(self, start_chunk: int = 0):
+        """
+        Yields memoryviews of the file's chunks from start_chunk on. Reading the whole file
+        also records its hashes, so an upload from the start doesn't read it twice.
+        """
+        record = self.total is None and start_chunk == 0
+        if record:
+            self.chunks = []
+            total = hashlib.sha256()
+        if self.size:
+            with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                with memoryview(mapped) as view:
+                    for offset in range(start_chunk * self.chunk_size, self.size, self.chunk_size):
+                        with view[offset:offset + self.chunk_size] as chunk:
+                            if record:
+                                total.update(chunk)
+                                self.chunks.append(hashlib.sha256(chunk).hexdigest())
+                            yield chunk
+        if record:
+            self.total = total.hexdigest()
+
+class ChunkedUploader:
+    """
+    Uploads a file over SFTP in chunks that are checked against sha256 hashes computed on
+    the remote host.
+
+    The file is written to <remote_path>.part and only renamed into place once the hash of
+    the whole remote file matches the local one. If the connection drops or a chunk doesn't
+    match, the next attempt hashes what is already on the host and carries on from the
+    first chunk that differs, instead of sending the file again from the start.
+    """
+
+    def __init__(self, ssh_pool, exec_command, chunk_size: int = None, max_attempts: int = None):
+        """
+        :param ssh_pool: SSHConnectionPool to get connections from.
+        :param exec_command: Callable taking a connection and a command, returning (exit status, stdout, stderr).
+        :param chunk_size: Bytes per chunk. Defaults to the configured value.
+        :param max_attempts: Attempts before giving up. Defaults to the configured value.
+        """
+        transfer_config = Configuration().get_transfer_config()
+        self.ssh_pool = ssh_pool
+        self.exec_command = exec_command
+        self.chunk_size = chunk_size or transfer_config["chunk_size"]
+        self.max_attempts = max_attempts or transfer_config["max_attempts"]
+
+    def upload(self, host: str, local_path: str, remote_path: str, on_progress=None) -> bool:
+        """
+        Upload a file, resuming after failures. Blocking; run it in a thread.
+        :param host: Remote host.
+        :param local_path: Path to the local file.
+        :param remote_path: Where the file ends up on the remote host.
+        :param on_progress: Called with the bytes of the file on the host so far, the file size
+            and whether the bytes since the last call were sent over the network. While sending,
+            it is called just before each slice of at most WRITE_SLICE_SIZE bytes is written.
+        :return: True once the remote copy is in place and matches the local file.
+        """
+        digests = LocalFileDigests(local_path, self.chunk_size)
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                with self.ssh_pool.session(host) as ssh:
+                    self._upload_once(ssh, host, digests, remote_path, on_progress)
+                return True
+            except (TransferVerificationError, *CONNECTION_ERRORS) as e:
+                metric_emitter.transfer_retries.labels(host=host).inc()
+                log.warning(f"Upload of {local_path} to {host} failed on attempt {attempt}/{self.max_attempts}: {e}")
+        log.error(f"Giving up on uploading {local_path} to {host} after {self.max_attempts} attempts.")
+        return False
+
+    def matches_remote(self, ssh, local_path: str, remote_path: str) -> bool:
+        """
+        Returns True if the file on the remote host has the same sha256 as the local file.
+        """
+        digests = LocalFileDigests(local_path, self.chunk_size)
+        remote = self._remote_digests(ssh, remote_path)
+        if remote is None:
+            return False
+        digests.compute()
+        return remote[1] == digests.total
+
+    def _upload_once(self, ssh, host, digests: LocalFileDigests, remote_path: str, on_progress):
+        part_path = remote_path + PART_SUFFIX
+        self.exec_command(ssh, f"mkdir -p {shlex.quote(os.path.dirname(remote_path))}")
+        with ssh.open_sftp() as sftp:
+            resume_chunk = self._verified_chunks(ssh, digests, part_path)
+            offset = min(resume_chunk * self.chunk_size, digests.size)
+            if offset:
+                log.info(f"Resuming upload of {digests.path} to {host} at {offset / 1024 ** 2:.0f}MB")
+                metric_emitter.transfer_resumed_bytes.labels(host=host).inc(offset)
+            if on_progress:
+                on_progress(offset, digests.size, False)
+
+            with sftp.open(part_path, "r+b" if resume_chunk else "wb") as remote_file:
+                remote_file.set_pipelined(True)
+                remote_file.truncate(offset)
+                remote_file.seek(offset)
+                for chunk in digests.iter_chunks(resume_chunk):
+                    for start in range(0, len(chunk), WRITE_SLICE_SIZE):
+                        with chunk[start:start + WRITE_SLICE_SIZE] as data:
+                            offset += len(data)
+                            if on_progress:
+                                on_progress(offset, digests.size, True)
+                            remote_file.write(data)
+
+            digests.compute()
+            remote = self._remote_digests(ssh, part_path)
+            if remote is None or remote[1] != digests.total:
+                metric_emitter.transfer_verification_failures.labels(host=host).inc()
+                raise TransferVerificationError(f"sha256 of {host}:{part_path} doesn't match {digests.path}")
+            sftp.posix_rename(part_path, remote_path)
+
+    def _verified_chunks(self, ssh, digests: LocalFileDigests, part_path: str) -> int:
+        """
+        Returns how many leading chunks of a partial upload match the local file.
+        """
+        remote = self._remote_digests(ssh, part_path)
+        if remote is None:
+            return 0
+        digests.compute()
+        verified = 0
+        for local_chunk, remote_chunk in zip(digests.chunks, remote[0]):
+            if local_chunk != remote_chunk:
+                break
+            verified += 1
+        return verified
+
+    def _remote_digests(self, ssh, remote_path: str):
+        """
+        Returns the remote file's chunk hashes and whole-file hash, or None if it doesn't exist.
+        """
+        path = shlex.quote(remote_path)
+        chunk_size = str(self.chunk_size)
+        command = (
+            f"test -f {path} || exit 3; "
+            f"if command -v python3 >/dev/null 2>&1; "
+            f"then python3 -c {shlex.quote(REMOTE_HASH_SCRIPT)} {path} {chunk_size}; "
+            f"else sh -c {shlex.quote(REMOTE_HASH_SHELL)} {path} {chunk_size}; fi"
+        )
+        exit_status, output, error_output = self.exec_command(ssh, command)
+        if exit_status == 3:
+            return None
+        lines = output.split()
+        if exit_status != 0 or len(lines) < 2 or lines[-2] != "total":
+            raise TransferVerificationError(f"Could not hash {remote_path} on the remote host: {error_output.strip()}")
+        return lines[:-2], lines[-1]
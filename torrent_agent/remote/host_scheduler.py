@@ -0,0 +1,202 @@
+import asyncio
+import os
+import time
+from collections import deque
+
+from torrent_agent.common import logger
+from torrent_agent.common.configuration import Configuration
+from torrent_agent.common.metrics import MetricEmitter
+
+log = logger.get_logger()
+metric_emitter = MetricEmitter()
+configuration = Configuration()
+
+LOCAL_HOST = "local"
+# Weight given to each new encode or transfer rate sample.
+RATE_SMOOTHING = 0.3
+DEFAULT_TRANSFER_RATE = 10 * 1024 * 1024
+
+class HostState:
+    """
+    What the scheduler knows about one conversion host.
+    Costs are in seconds of 1080p transcoding, as estimated by the ConversionScheduler.
+    """
+
+    def __init__(self, host: str, encode_rate: float):
+        self.host = host
+        self.free_gb = None
+        self.load_average = 0.0
+        self.cpu_count = 1
+        self.pending_files = 0
+        self.outstanding = deque()
+        self.busy_since = None
+        self.encode_rate = encode_rate
+        self.transfer_rate = DEFAULT_TRANSFER_RATE
+        self.last_probed = 0.0
+        self.reachable = True
+
+    @property
+    def outstanding_cost(self):
+        return sum(self.outstanding)
+
+    def load_factor(self):
+        """
+        How much slower than its measured rate the host is expected to encode. The load of a
+        host that is running conversions comes mostly from them, so only an idle host's
+        load counts against it.
+        """
+        if self.outstanding:
+            return 1.0
+        return max(1.0, self.load_average / max(self.cpu_count, 1))
+
+    def record_encode_rate(self, rate: float):
+        self.encode_rate = (1 - RATE_SMOOTHING) * self.encode_rate + RATE_SMOOTHING * rate
+
+    def record_transfer_rate(self, rate: float):
+        self.transfer_rate = (1 - RATE_SMOOTHING) * self.transfer_rate + RATE_SMOOTHING * rate
+
+class HostScheduler:
+    """
+    Assigns each conversion to the host expected to finish it first, counting the local
+    host as one of the candidates.
+
+    A host's predicted completion is the work already assigned to it plus the new job,
+    divided by its encode rate and slowed down by its load, plus the time needed to copy
+    the file there. Hosts that are unreachable or too short on disk are skipped.
+
+    Free space, load and backlog are probed at most once per probe interval. Remote agents
+    don't report back when they finish, so a remote job counts as done once the host's
+    backlog of unconverted files drops below the number of jobs sent to it, and the host's
+    encode rate is learned from the work that finished since it last became busy.
+    """
+
+    def __init__(self, remote_processor, hosts=None, probe_interval: float = None, default_encode_rate: float = None, min_free_gb: float = None):
+        """
+        :param remote_processor: RemoteProcessor used to probe remote hosts.
+        :param hosts: Remote hosts to schedule on. Defaults to the configured hosts.
+        :param probe_interval: Seconds between probes of the same host.
+        :param default_encode_rate: Encode rate assumed for hosts that haven't finished a job yet.
+        :param min_free_gb: Free space a remote host must keep after receiving a file.
+        """
+        scheduling_config = configuration.get_host_scheduling_config()
+        self.remote_processor = remote_processor
+        self.probe_interval = probe_interval if probe_interval is not None else scheduling_config["probe_interval"]
+        self.min_free_gb = min_free_gb if min_free_gb is not None else scheduling_config["min_free_gb"]
+        default_encode_rate = default_encode_rate or scheduling_config["default_encode_rate"]
+        hosts = configuration.get_remote_hosts() if hosts is None else hosts
+        self.hosts = {host: HostState(host, default_encode_rate) for host in [LOCAL_HOST] + list(hosts)}
+        self._refresh_lock = asyncio.Lock()
+
+    async def choose_host(self, cost: float, size_bytes: int = 0) -> str:
+        """
+        Pick the host with the earliest predicted completion for a job.
+        :param cost: Estimated cost of the job.
+        :param size_bytes: Size of the input file, which has to be copied to a remote host.
+        :return: The chosen host, or LOCAL_HOST.
+        """
+        await self.refresh()
+        best_host, best_completion = LOCAL_HOST, None
+        for state in self.hosts.values():
+            completion = self.predict_completion(state, cost, size_bytes)
+            if completion is None:
+                continue
+            metric_emitter.host_predicted_completion.labels(host=state.host).set(completion)
+            if best_completion is None or completion < best_completion:
+                best_host, best_completion = state.host, completion
+        log.debug(f"Assigning job of cost {cost:.0f}s to {best_host}, predicted to finish in {best_completion:.0f}s")
+        return best_host
+
+    def predict_completion(self, state: HostState, cost: float, size_bytes: int = 0):
+        """
+        Returns the predicted seconds until a job would finish on a host, or None if the
+        host can't take it.
+        """
+        encode_time = (state.outstanding_cost + cost) / state.encode_rate * state.load_factor()
+        if state.host == LOCAL_HOST:
+            return encode_time
+        if not state.reachable:
+            return None
+        if state.free_gb is not None and state.free_gb - size_bytes / 1024 ** 3 < self.min_free_gb:
+            return None
+        return encode_time + size_bytes / state.transfer_rate
+
+    def record_dispatch(self, host: str, cost: float, size_bytes: int = 0, transfer_seconds: float = None):
+        """
+        Record that a job has been assigned to a host.
+        :param transfer_seconds: How long copying the file to the host took, if it was copied.
+        """
+        state = self.hosts[host]
+        if not state.outstanding:
+            state.busy_since = time.monotonic()
+        state.outstanding.append(cost)
+        if transfer_seconds and transfer_seconds >= 1 and size_bytes:
+            state.record_transfer_rate(size_bytes / transfer_seconds)
+        metric_emitter.conversion_jobs_dispatched.labels(host=host).inc()
+        self._emit(state)
+
+    def record_completion(self, host: str, cost: float, elapsed: float = None, concurrency: int = 1):
+        """
+        Record that a job assigned to a host has finished.
+        :param elapsed: Seconds the job took, or None if it didn't finish successfully.
+        :param concurrency: Number of jobs the host was running at the same time.
+        """
+        state = self.hosts[host]
+        try:
+            state.outstanding.remove(cost)
+        except ValueError:
+            pass
+        if elapsed and cost:
+            state.record_encode_rate(cost / elapsed * max(concurrency, 1))
+        self._emit(state)
+
+    async def refresh(self):
+        """
+        Probe every host whose state is older than the probe interval.
+        """
+        async with self._refresh_lock:
+            now = time.monotonic()
+            stale = [state for state in self.hosts.values() if now - state.last_probed >= self.probe_interval]
+            if stale:
+                await asyncio.gather(*(self._probe(state) for state in stale))
+
+    async def _probe(self, state: HostState):
+        try:
+            if state.host == LOCAL_HOST:
+                result = {"load_average": os.getloadavg()[0], "cpu_count": os.cpu_count() or 1}
+            else:
+                result = await asyncio.to_thread(self.remote_processor.probe_host, state.host)
+        except Exception as e:
+            if state.reachable:
+                log.warning(f"Could not probe conversion host {state.host}, not assigning it jobs: {e}")
+            state.reachable = False
+            state.last_probed = time.monotonic()
+            return
+
+        if not state.reachable:
+            log.info(f"Conversion host {state.host} is reachable again.")
+        now = time.monotonic()
+        if state.host != LOCAL_HOST:
+            self._infer_completions(state, result["pending_files"], now)
+            state.free_gb = result["free_gb"]
+            state.pending_files = result["pending_files"]
+        state.load_average = result["load_average"]
+        state.cpu_count = result["cpu_count"]
+        state.reachable = True
+        state.last_probed = now
+        self._emit(state)
+
+    def _infer_completions(self, state: HostState, pending_files: int, now: float):
+        # The oldest jobs sent to a host are assumed to be the ones it has finished.
+        finished_cost = 0.0
+        while len(state.outstanding) > pending_files:
+            finished_cost += state.outstanding.popleft()
+        if finished_cost and now > state.busy_since:
+            state.record_encode_rate(finished_cost / (now - state.busy_since))
+            state.busy_since = now
+
+    def _emit(self, state: HostState):
+        if state.free_gb is not None:
+            metric_emitter.host_free_gb.labels(host=state.host).set(state.free_gb)
+        metric_emitter.host_load_average.labels(host=state.host).set(state.load_average)
+        metric_emitter.host_in_flight.labels(host=state.host).set(len(state.outstanding))
+        metric_emitter.host_encode_rate.labels(host=state.host).set(state.encode_rate)
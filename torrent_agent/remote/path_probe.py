@@ -0,0 +1,103 @@
+import posixpath
+import threading
+import time
+from dataclasses import dataclass
+
+# Reads "<1 if free space is wanted>\t<path>" lines on stdin and prints, for each path,
+# "<exists>\t<size>\t<device>\t<free bytes or ->\t<path>". Free space is that of the partition
+# holding the path's nearest existing directory, so it can be asked for before the directory exists.
+REMOTE_PROBE_SCRIPT = (
+    'last_dir=; free=; '
+    'while IFS="$(printf "\\t")" read -r want_free path; do '
+    'dir=$(dirname -- "$path"); '
+    'while [ ! -d "$dir" ]; do dir=$(dirname -- "$dir"); done; '
+    'if [ -f "$path" ]; then exists=1; size=$(stat -c %s -- "$path"); else exists=0; size=0; fi; '
+    'device=$(stat -c %d -- "$dir"); '
+    'if [ "$want_free" = 1 ]; then '
+    'if [ "$dir" != "$last_dir" ]; then free=$(df -P -B1 -- "$dir" | awk \'NR == 2 {print $4}\'); last_dir=$dir; fi; '
+    'answer=$free; '
+    'else answer=-; fi; '
+    'printf "%s\\t%s\\t%s\\t%s\\t%s\\n" "$exists" "$size" "$device" "$answer" "$path"; '
+    'done'
+)
+
+ACTION_SEND = "send"
+ACTION_VERIFY = "verify"
+ACTION_NO_SPACE = "no_space"
+ACTION_MISSING = "missing"
+
+@dataclass
+class RemotePathStatus:
+    """
+    What a batch probe found out about one path on a remote host.
+    free_bytes is the free space of the path's partition less the bytes already planned for it.
+    """
+    remote_path: str
+    exists: bool
+    size: int
+    device: str
+    free_bytes: int
+
+@dataclass
+class PlannedTransfer:
+    """
+    What to do with one file of a batch sent to a remote host.
+    """
+    local_path: str
+    remote_path: str
+    action: str
+
+class FreeSpaceCache:
+    """
+    Free space per partition of each remote host, kept for a short time so batches sent in
+    quick succession don't all ask for it. Bytes planned for a partition are taken off its
+    entry straight away, so files sent before the next probe are counted against it.
+    """
+
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self._devices = {}
+        self._free = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, host: str, remote_path: str):
+        """
+        Returns (device, free bytes) for the partition holding remote_path, or None if unknown or expired.
+        """
+        with self._lock:
+            device = self._devices.get((host, posixpath.dirname(remote_path)))
+            entry = self._free.get((host, device))
+            if device is None or entry is None or time.monotonic() - entry[1] > self.ttl_seconds:
+                return None
+            return device, entry[0]
+
+    def store(self, host: str, remote_path: str, device: str, free_bytes: int = None):
+        with self._lock:
+            self._devices[(host, posixpath.dirname(remote_path))] = device
+            if free_bytes is not None:
+                self._free[(host, device)] = (free_bytes, time.monotonic())
+
+    def reserve(self, host: str, device: str, size: int):
+        with self._lock:
+            entry = self._free.get((host, device))
+            if entry is not None:
+                self._free[(host, device)] = (entry[0] - size, entry[1])
+
+    def invalidate(self, host: str):
+        with self._lock:
+            for key in [key for key in self._free if key[0] == host]:
+                del self._free[key]
+
+def parse_probe_output(output: str) -> dict:
+    """
+    Parse the output of REMOTE_PROBE_SCRIPT.
+    :return: Dict of remote path to (exists, size, device, free bytes or None).
+    :raises ValueError: If a line can't be parsed.
+    """
+    results = {}
+    for line in output.splitlines():
+        if not line:
+            continue
+        exists, size, device, free, path = line.split("\t", 4)
+        results[path] = (exists == "1", int(size), device, None if free in ("-", "") else int(free))
+    return results
@@ -1,10 +1,26 @@
 import os
-import paramiko
-from scp import SCPClient
+import shlex
+import uuid
+from torrent_agent.common.metrics import MetricEmitter
 from torrent_agent.common.configuration import Configuration
+from torrent_agent.common.constants import NON_BROWSER_FRIENDLY_VIDEO_FILETYPES
 from torrent_agent.common import logger
+from torrent_agent.remote.chunked_upload import PART_SUFFIX, ChunkedUploader
+from torrent_agent.remote.path_probe import (
+    ACTION_MISSING,
+    ACTION_NO_SPACE,
+    ACTION_SEND,
+    ACTION_VERIFY,
+    REMOTE_PROBE_SCRIPT,
+    FreeSpaceCache,
+    PlannedTransfer,
+    RemotePathStatus,
+    parse_probe_output,
+)
+from torrent_agent.remote.ssh_pool import SSHConnectionPool
 
 log = logger.get_logger()
+metric_emitter = MetricEmitter()
 
 class RemoteProcessor:
     _instance = None
@@ -25,27 +41,23 @@ class RemoteProcessor:
             self.configuration = Configuration()
             self.hosts = self.configuration.get_remote_hosts()
             self.current_host_index = 0
+            self.ssh_pool = SSHConnectionPool(self.get_username)
+            self.uploader = ChunkedUploader(self.ssh_pool, self._exec)
+            self.free_space = FreeSpaceCache(self.configuration.get_transfer_config()["free_space_ttl"])
+            self.min_free_gb = self.configuration.get_host_scheduling_config()["min_free_gb"]
             self.initialized = True
 
-    def _file_exists_on_remote(self, host, remote_path):
+    def _exec(self, ssh, command, input=None):
         """
-        Check if a file exists on the remote host.
-        :param host: Remote host IP.
-        :param remote_path: Path to check on the remote host.
-        :return: True if the file exists, False otherwise.
+        Run a command over an open connection and return its exit status and output.
+        :param input: Text written to the command's stdin.
         """
-        try:
-            log.debug(f"Checking if file exists on remote host {host}: {remote_path}")
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            ssh.connect(host, username=self.get_username(host))
-            stdin, stdout, stderr = ssh.exec_command(f"test -f {remote_path} && echo exists || echo missing")
-            result = stdout.read().decode().strip()
-            ssh.close()
-            return result == "exists"
-        except Exception as e:
-            log.error(f"Error checking file on remote host {host}: {e}", exc_info=True)
-            return False
+        stdin, stdout, stderr = ssh.exec_command(command)
+        if input is not None:
+            stdin.write(input)
+            stdin.channel.shutdown_write()
+        output = stdout.read().decode()
+        return stdout.channel.recv_exit_status(), output, stderr.read().decode(errors="replace")
 
     def _get_next_host(self):
         """
@@ -56,104 +68,294 @@ class RemoteProcessor:
         self.current_host_index = (self.current_host_index + 1) % len(self.hosts)
         return host
 
-    def _has_enough_space_on_remote(self, host, remote_path, min_free_gb=4):
+    def probe_paths(self, host, remote_paths):
         """
-        Check if the remote host has at least min_free_gb of free space on the partition containing remote_path.
+        Find out whether each path exists on a remote host, its size and the free space of its
+        partition, with one command for the whole list. Free space still in the cache isn't asked for again.
+        Blocking; run it in a thread.
         :param host: Remote host IP.
-        :param remote_path: Path on the remote host.
-        :param min_free_gb: Minimum free space in GB to leave on the host.
-        :return: True if enough space, False otherwise.
+        :param remote_paths: Paths on the remote host.
+        :return: Dict of remote path to RemotePathStatus. free_bytes is None if the host didn't report it.
+        :raises RuntimeError: If the host's answer can't be parsed.
         """
+        remote_paths = sorted(set(remote_paths), key=lambda path: (os.path.dirname(path), path))
+        if not remote_paths:
+            return {}
+        cached = {path: self.free_space.lookup(host, path) for path in remote_paths}
+        request = "".join(f"{0 if cached[path] else 1}\t{path}\n" for path in remote_paths)
+        with self.ssh_pool.session(host) as ssh:
+            _, output, error_output = self._exec(ssh, f"sh -c {shlex.quote(REMOTE_PROBE_SCRIPT)}", input=request)
+        metric_emitter.remote_path_probes.labels(host=host).inc()
+        metric_emitter.remote_path_probe_batch_size.observe(len(remote_paths))
         try:
-            log.debug(f"Checking free space on remote host {host} for path {remote_path}")
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            ssh.connect(host, username=self.get_username(host))
-            
-            # Determine the device to check based on whether we are a remote agent
-            cmd = f"df -BG --output=avail \"$(dirname '{remote_path}')\" | tail -1 | tr -dc '0-9'"
+            answers = parse_probe_output(output)
+        except ValueError as e:
+            raise RuntimeError(f"Unexpected path probe output from {host}: {output!r}") from e
 
-            if self.configuration.is_remote_agent():
-                cmd = "df -BG --output=avail /mnt/ext1 | tail -1 | tr -dc '0-9'"
-            
-            stdin, stdout, stderr = ssh.exec_command(cmd)
-            free_gb_str = stdout.read().decode().strip()
-            ssh.close()
-            if not free_gb_str:
-                log.error(f"Could not determine free space on remote host {host}", exc_info=True)
-                return False
-            free_gb = int(free_gb_str)
-            log.debug(f"Remote host {host} has {free_gb}GB free at {remote_path}")
-            return free_gb > min_free_gb
-        except Exception as e:
-            log.error(f"Error checking free space on remote host {host}: {e}", exc_info=True)
-            return False
-        
-    def _scp_file_to_remote(self, host, local_path, remote_path):
+        statuses = {}
+        for path in remote_paths:
+            if path not in answers:
+                raise RuntimeError(f"Path probe on {host} didn't answer for {path}: {error_output.strip()}")
+            exists, size, device, free_bytes = answers[path]
+            if free_bytes is None and cached[path] and cached[path][0] == device:
+                metric_emitter.remote_free_space_cache_hits.labels(host=host).inc()
+            self.free_space.store(host, path, device, free_bytes)
+            cached_free = self.free_space.lookup(host, path)
+            statuses[path] = RemotePathStatus(path, exists, size, device, cached_free[1] if cached_free else None)
+        return statuses
+
+    def plan_dispatch(self, host, local_paths, remote_paths=None):
         """
-        SCP a file to the remote host, creating necessary directories if they don't exist.
+        Decide what to do with each of a batch of files bound for a remote host, from one probe
+        of the host: send it, compare it with an identical-looking copy already there, or skip it
+        because its partition would be left with less than the minimum free space. The space of
+        every file planned for sending is reserved, so the batch as a whole has to fit.
+        Blocking; run it in a thread.
         :param host: Remote host IP.
-        :param local_path: Path to the local file.
-        :param remote_path: Path to copy the file to on the remote host.
+        :param local_paths: Paths of the local files.
+        :param remote_paths: Where each file goes on the host. Defaults to the paths derived from the local paths.
+        :return: Dict of local path to PlannedTransfer.
+        :raises RuntimeError: If the host's answer can't be parsed.
+        """
+        remote_paths = remote_paths or [None] * len(local_paths)
+        targets = {
+            local_path: remote_path or self._default_remote_path(local_path, host)
+            for local_path, remote_path in zip(local_paths, remote_paths)
+        }
+        statuses = self.probe_paths(host, targets.values())
+        min_free_bytes = self.min_free_gb * 1024 ** 3
+
+        plan = {}
+        for local_path, remote_path in targets.items():
+            status = statuses[remote_path]
+            try:
+                size = os.path.getsize(local_path)
+            except OSError:
+                plan[local_path] = PlannedTransfer(local_path, remote_path, ACTION_MISSING)
+                continue
+            if status.exists and status.size == size:
+                # Same size: only the hashes can tell whether it's the same file.
+                action = ACTION_VERIFY
+            elif status.free_bytes is None:
+                log.error(f"Could not determine free space on remote host {host} for {remote_path}")
+                action = ACTION_NO_SPACE
+            elif status.free_bytes - size < min_free_bytes:
+                log.debug(f"Remote host {host} has {status.free_bytes / 1024 ** 3:.1f}GB free for {remote_path}, which needs {size / 1024 ** 3:.1f}GB")
+                action = ACTION_NO_SPACE
+            else:
+                action = ACTION_SEND
+                self.free_space.reserve(host, status.device, size)
+                status.free_bytes -= size
+                for other in statuses.values():
+                    if other is not status and other.device == status.device and other.free_bytes is not None:
+                        other.free_bytes -= size
+            plan[local_path] = PlannedTransfer(local_path, remote_path, action)
+        return plan
+
+    def conversions_dir(self, host):
         """
+        Returns the directory a remote host converts files from.
+        """
+        return f"/home/{self.get_username(host)}/conversions"
+
+    def probe_host(self, host):
+        """
+        Read a remote host's free space, load and conversion backlog in one command.
+        Blocking; run it in a thread.
+        :param host: Remote host IP.
+        :return: Dict with free_gb, load_average, cpu_count and pending_files.
+        :raises RuntimeError: If the host's answer can't be parsed.
+        """
+        conversions_dir = shlex.quote(self.conversions_dir(host))
+        name_filters = " -o ".join(f"-iname '*{extension}'" for extension in NON_BROWSER_FRIENDLY_VIDEO_FILETYPES)
+        command = (
+            f"mkdir -p {conversions_dir}; "
+            f"df -BG --output=avail {conversions_dir} | tail -1 | tr -dc '0-9'; echo; "
+            f"cut -d' ' -f1 /proc/loadavg; "
+            f"nproc; "
+            f"find {conversions_dir} -type f -not -path '*/.segments/*' \\( {name_filters} \\) | wc -l"
+        )
+        with self.ssh_pool.session(host) as ssh:
+            _, output, _ = self._exec(ssh, command)
         try:
-            log.debug(f"Copying file to remote host {host}: {local_path} -> {remote_path}")
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            ssh.connect(host, username=self.get_username(host))
-            
-            # Create the directory structure on the remote host
-            remote_dir = os.path.dirname(remote_path)
-            mkdir_cmd = f"mkdir -p {remote_dir}"
-            ssh.exec_command(mkdir_cmd)
-            log.debug(f"Ensured directory exists on remote host {host}: {remote_dir}")
-            
-            # Copy the file
-            with SCPClient(ssh.get_transport()) as scp:
-                scp.put(local_path, remote_path)
-            log.debug(f"File {local_path} copied to {host}:{remote_path}")
-            ssh.close()
+            free_gb, load_average, cpu_count, pending_files = output.split()
+            return {
+                "free_gb": int(free_gb),
+                "load_average": float(load_average),
+                "cpu_count": int(cpu_count),
+                "pending_files": int(pending_files),
+            }
+        except ValueError as e:
+            raise RuntimeError(f"Unexpected probe output from {host}: {output!r}") from e
+
+    def segment_dir(self, host):
+        """
+        Returns a new directory on the host for the files of one remotely encoded segment.
+        """
+        return f"/home/{self.get_username(host)}/conversions/.segments/{uuid.uuid4().hex}"
+
+    def put_file(self, host, local_path, remote_path, on_progress=None):
+        """
+        Copy a file to a remote host as is, creating its directory.
+        Blocking; use TransferManager.encode_remote from async code.
+        :param on_progress: Called with the bytes sent so far, the file size and True.
+        :return: True once the file is copied.
+        """
+        with self.ssh_pool.session(host) as ssh:
+            self._exec(ssh, f"mkdir -p {shlex.quote(os.path.dirname(remote_path))}")
+            with ssh.open_sftp() as sftp:
+                callback = (lambda sent, total: on_progress(sent, total, True)) if on_progress else None
+                sftp.put(local_path, remote_path, callback=callback)
+        return True
+
+    def get_file(self, host, remote_path, local_path, on_progress=None):
+        """
+        Copy a file from a remote host as is.
+        Blocking; use TransferManager.encode_remote from async code.
+        :param on_progress: Called with the bytes received so far, the file size and True.
+        :return: True once the file is copied.
+        """
+        with self.ssh_pool.session(host) as ssh:
+            with ssh.open_sftp() as sftp:
+                callback = (lambda received, total: on_progress(received, total, True)) if on_progress else None
+                sftp.get(remote_path, local_path, callback=callback)
+        return True
+
+    def run_remote_ffmpeg(self, host, remote_input, remote_output, ffmpeg_args, timeout=None):
+        """
+        Run ffmpeg on a file already on a remote host.
+        Used to encode the segments of a segmented transcode. Blocking; use
+        TransferManager.encode_remote from async code.
+        :param host: Remote host IP.
+        :param remote_input: Path of the file to encode on the host.
+        :param remote_output: Where to put the encoded file on the host.
+        :param ffmpeg_args: ffmpeg output options placed between the input and the output file.
+        :param timeout: Seconds after which the remote ffmpeg is killed.
+        :raises RuntimeError: If the remote ffmpeg fails.
+        """
+        command = ["ffmpeg", "-nostdin", "-y", "-v", "error", "-i", remote_input] + ffmpeg_args + [remote_output]
+        if timeout:
+            command = ["timeout", "-s", "KILL", str(int(timeout))] + command
+        log.debug(f"Encoding {remote_input} on remote host {host}")
+        with self.ssh_pool.session(host) as ssh:
+            exit_status, _, error_output = self._exec(ssh, shlex.join(command))
+        if exit_status != 0:
+            raise RuntimeError(f"Remote ffmpeg on {host} exited with status {exit_status}: {error_output.strip()}")
+
+    def remove_remote_dir(self, host, remote_dir):
+        """
+        Delete a directory on a remote host, logging rather than raising on failure.
+        """
+        try:
+            with self.ssh_pool.session(host) as ssh:
+                self._exec(ssh, f"rm -rf {shlex.quote(remote_dir)}")
         except Exception as e:
-            log.error(f"Error copying file to remote host {host}: {e}", exc_info=True)
+            log.warning(f"Could not clean up {remote_dir} on remote host {host}: {e}")
+
+    def resolve_host(self, host=None):
+        """
+        Returns the host a file will be sent to: the control host when running as a remote
+        agent, otherwise the given host or the next one in round-robin order.
+        """
+        if self.configuration.is_remote_agent():
+            return self.configuration.get_control_agent_host()
+        return host or self._get_next_host()
 
-    def process_file(self, local_path):
+    def process_file(self, local_path, host=None, on_progress=None, remote_path=None, planned=None):
         """
-        Process a file by SCPing it to a remote host in a round-robin fashion and removing it locally.
+        Process a file by uploading it to a remote host and removing it locally once the
+        remote copy's sha256 matches.
         If the file is being sent back to the control host, ensure it is placed in the same folder structure.
+        Blocking; use TransferManager.send from async code.
         :param local_path: Path to the local file.
+        :param host: Remote host to send the file to. Defaults to the next host in round-robin order.
+        :param on_progress: Progress callback passed on to ChunkedUploader.upload.
+        :param remote_path: Where to put the file on the host. Defaults to the path derived from local_path.
+        :param planned: PlannedTransfer for the file from plan_dispatch. Probed here if not given.
+        :return: True if the file was handed to the host.
         """
         if not os.path.exists(local_path):
             log.info(f"File {local_path} does not exist locally.")
-            return
+            return False
         
+        host = self.resolve_host(host)
+        if planned is None:
+            try:
+                planned = self.plan_dispatch(host, [local_path], [remote_path])[local_path]
+            except Exception as e:
+                log.error(f"Could not probe remote host {host} for {local_path}: {e}", exc_info=True)
+                return False
+        remote_path = planned.remote_path
+
+        if planned.action == ACTION_MISSING:
+            log.info(f"File {local_path} does not exist locally.")
+            return False
+
+        if planned.action == ACTION_NO_SPACE:
+            log.error(f"Not enough space on remote host {host} for file {local_path}. Skipping.")
+            return False
+            
+        if planned.action == ACTION_VERIFY:
+            try:
+                with self.ssh_pool.session(host) as ssh:
+                    matches = self.uploader.matches_remote(ssh, local_path, remote_path)
+                if matches:
+                    log.info(f"File already exists on remote host {host}. Removing local file.")
+                    os.remove(local_path)
+                    return True
+                log.warning(f"File on remote host {host} differs from {local_path}. Replacing it.")
+            except Exception as e:
+                log.warning(f"Could not compare {local_path} with the copy on remote host {host}, sending it again: {e}")
+
+        log.info(f"Copying {local_path} to {host}:{remote_path}")
+        if not self.uploader.upload(host, local_path, remote_path, on_progress):
+            # Whatever the failure was, the next batch shouldn't plan on stale numbers.
+            self.free_space.invalidate(host)
+            return False
+        log.info(f"File {local_path} copied to {host} and verified. Removing local file.")
+        os.remove(local_path)
+        return True
+
+    def _default_remote_path(self, local_path, host):
         base_remote_path = "/mnt/ext1/torrents"
-        host = None
-        remote_path = None
         if self.configuration.is_remote_agent():
             if "movies" in local_path:
-                remote_path = f"{base_remote_path}/movies/{os.path.basename(local_path)}"
+                return f"{base_remote_path}/movies/{os.path.basename(local_path)}"
             elif "tv" in local_path:
-                remote_path = f"{base_remote_path}/tv/{os.path.basename(local_path)}"
+                return f"{base_remote_path}/tv/{os.path.basename(local_path)}"
             else:
-                remote_path = f"{base_remote_path}/videos/{os.path.basename(local_path)}"
-            host = self.configuration.get_control_agent_host()
-        else:
-            host = self._get_next_host()
-            relative_path = os.path.relpath(local_path, "/mnt/ext1/torrents")
-            remote_path = f"/home/{self.get_username(host)}/conversions/{relative_path}"
-
-        if not self._has_enough_space_on_remote(host, remote_path):
-            log.error(f"Not enough space on remote host {host} for file {local_path}. Skipping.", exc_info=True)
-            return
-            
-        if not self._file_exists_on_remote(host, remote_path):
-            log.info(f"Copying {local_path} to {host}:{remote_path}")
-            self._scp_file_to_remote(host, local_path, remote_path)
-            log.info(f"File {local_path} copied to {host}. Removing local file.")
-            os.remove(local_path)
-        else:
-            log.info(f"File already exists on remote host {host}. Removing local file.")
-            os.remove(local_path)
+                return f"{base_remote_path}/videos/{os.path.basename(local_path)}"
+        relative_path = os.path.relpath(local_path, base_remote_path)
+        return f"{self.conversions_dir(host)}/{relative_path}"
+
+    def fetch_file(self, host, remote_path, local_path, on_progress=None):
+        """
+        Download a file from a remote host and check its sha256 against the remote copy.
+        Blocking; use TransferManager.fetch from async code.
+        :param host: Remote host to download from.
+        :param remote_path: Path of the file on the host.
+        :param local_path: Where to put the file locally.
+        :param on_progress: Called with the bytes received so far, the file size and True.
+        :return: True if the file was downloaded and matches the remote copy.
+        """
+        part_path = local_path + PART_SUFFIX
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        try:
+            with self.ssh_pool.session(host) as ssh:
+                with ssh.open_sftp() as sftp:
+                    callback = (lambda received, total: on_progress(received, total, True)) if on_progress else None
+                    sftp.get(remote_path, part_path, callback=callback)
+                if not self.uploader.matches_remote(ssh, part_path, remote_path):
+                    log.error(f"Downloaded copy of {host}:{remote_path} doesn't match the remote file.")
+                    os.remove(part_path)
+                    return False
+        except Exception as e:
+            log.error(f"Error downloading {remote_path} from remote host {host}: {e}", exc_info=True)
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            return False
+        os.replace(part_path, local_path)
+        return True
 
     def get_username(self, host):
         """
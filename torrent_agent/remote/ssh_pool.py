@@ -0,0 +1,141 @@
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+import paramiko
+
+from torrent_agent.common import logger
+from torrent_agent.common.configuration import Configuration
+from torrent_agent.common.metrics import MetricEmitter
+
+log = logger.get_logger()
+metric_emitter = MetricEmitter()
+
+# Errors that mean the connection itself is broken rather than the command failing.
+CONNECTION_ERRORS = (paramiko.SSHException, EOFError, socket.error)
+
+class PooledConnection:
+    def __init__(self, client: paramiko.SSHClient):
+        self.client = client
+        self.last_checked = time.monotonic()
+
+class SSHConnectionPool:
+    """
+    Keeps one persistent SSH connection per host.
+
+    paramiko multiplexes any number of channels over a transport, so probe commands, SFTP
+    and SCP for a host share the same connection and only pay for the key exchange and
+    authentication once. Connections send keepalives, are health checked when they have
+    been idle, and are replaced when they break.
+    """
+
+    def __init__(self, username_for, port: int = None, keepalive_seconds: int = None, health_check_seconds: int = None, connect_timeout: int = None, connect_kwargs: dict = None):
+        """
+        :param username_for: Callable returning the SSH username for a host.
+        :param port: SSH port.
+        :param keepalive_seconds: Interval between keepalive packets.
+        :param health_check_seconds: Idle time after which a connection is checked before it is reused.
+        :param connect_timeout: Timeout for establishing a connection.
+        :param connect_kwargs: Extra arguments for SSHClient.connect, e.g. a password or key file.
+        """
+        ssh_config = Configuration().get_ssh_config()
+        self.username_for = username_for
+        self.port = port or ssh_config["port"]
+        self.keepalive_seconds = keepalive_seconds or ssh_config["keepalive_seconds"]
+        self.health_check_seconds = health_check_seconds or ssh_config["health_check_seconds"]
+        self.connect_timeout = connect_timeout or ssh_config["connect_timeout"]
+        self.connect_kwargs = connect_kwargs or {}
+        self._connections = {}
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def get(self, host) -> paramiko.SSHClient:
+        """
+        Returns a healthy connection to the host, connecting or reconnecting if needed.
+        Safe to call from several threads; they share the connection.
+        """
+        with self._lock_for(host):
+            connection = self._connections.get(host)
+            if connection is not None and self._is_healthy(connection):
+                metric_emitter.ssh_connections_reused.labels(host=host).inc()
+                return connection.client
+            if connection is not None:
+                log.info(f"SSH connection to {host} is no longer healthy. Reconnecting.")
+                self._close(connection)
+            connection = PooledConnection(self._connect(host))
+            self._connections[host] = connection
+            return connection.client
+
+    @contextmanager
+    def session(self, host):
+        """
+        Yields the host's connection. If it breaks while in use it is dropped from the pool,
+        so the next caller gets a fresh one.
+        """
+        client = self.get(host)
+        try:
+            yield client
+        except CONNECTION_ERRORS:
+            self.discard(host, client)
+            raise
+
+    def discard(self, host, client=None):
+        """
+        Close and forget the connection to a host. With client given, only if it is still the pooled one.
+        """
+        with self._lock_for(host):
+            connection = self._connections.get(host)
+            if connection is not None and (client is None or connection.client is client):
+                del self._connections[host]
+                self._close(connection)
+
+    def close_all(self):
+        for host in list(self._connections):
+            self.discard(host)
+
+    def _connect(self, host) -> paramiko.SSHClient:
+        log.debug(f"Opening SSH connection to {host}:{self.port}")
+        with metric_emitter.ssh_connect_duration.time():
+            client = paramiko.SSHClient()
+            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            client.connect(
+                host,
+                port=self.port,
+                username=self.username_for(host),
+                timeout=self.connect_timeout,
+                banner_timeout=self.connect_timeout,
+                auth_timeout=self.connect_timeout,
+                **self.connect_kwargs,
+            )
+        transport = client.get_transport()
+        transport.set_keepalive(self.keepalive_seconds)
+        # Probe commands are a few bytes each way; don't let Nagle hold them back.
+        transport.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        metric_emitter.ssh_connections_opened.labels(host=host).inc()
+        return client
+
+    def _is_healthy(self, connection: PooledConnection) -> bool:
+        transport = connection.client.get_transport()
+        if transport is None or not transport.is_active():
+            return False
+        now = time.monotonic()
+        if now - connection.last_checked < self.health_check_seconds:
+            return True
+        # Sending an ignore packet fails straight away on a connection the peer has dropped.
+        try:
+            transport.send_ignore()
+        except CONNECTION_ERRORS:
+            return False
+        connection.last_checked = now
+        return True
+
+    def _close(self, connection: PooledConnection):
+        try:
+            connection.client.close()
+        except Exception as e:
+            log.debug(f"Error while closing SSH connection: {e}")
+
+    def _lock_for(self, host):
+        with self._locks_lock:
+            return self._locks.setdefault(host, threading.Lock())
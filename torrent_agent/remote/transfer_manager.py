@@ -0,0 +1,222 @@
+import asyncio
+import itertools
+import os
+import threading
+import time
+
+from torrent_agent.common import logger
+from torrent_agent.common.configuration import Configuration
+from torrent_agent.common.metrics import MetricEmitter
+from torrent_agent.remote.remote_processor import RemoteProcessor
+
+log = logger.get_logger()
+metric_emitter = MetricEmitter()
+configuration = Configuration()
+remote_processor = RemoteProcessor()
+
+class TokenBucket:
+    """
+    Bandwidth limiter shared by every transfer thread.
+    Senders take tokens before each write and sleep off any debt, so the combined rate of all
+    transfers stays at the limit while a single idle-then-busy transfer can burst up to capacity.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        """
+        :param rate: Bytes per second. 0 disables the limit.
+        :param capacity: Largest burst in bytes. Defaults to one second's worth.
+        """
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, amount: int) -> float:
+        """
+        Take tokens for amount bytes, sleeping until they are available. Blocking; only call
+        it from a transfer thread.
+        :return: Seconds spent waiting.
+        """
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+class TransferManager:
+    """
+    Runs file transfers to remote hosts off the event loop.
+
+    Each transfer runs in a worker thread. A per-host semaphore caps the number of parallel
+    streams to a host, and every stream draws from one global token bucket so transfers don't
+    starve torrent traffic on the same link.
+
+    Files sent to the same host within the plan window of each other are planned together:
+    one probe of the host says which of them are already there and whether the rest fit.
+    """
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if not cls._instance:
+            cls._instance = super(TransferManager, cls).__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        if not hasattr(self, "initialized"):
+            transfer_config = configuration.get_transfer_config()
+            self.streams_per_host = transfer_config["streams_per_host"]
+            self.bucket = TokenBucket(transfer_config["bandwidth_limit"])
+            self.plan_window = transfer_config["plan_window"]
+            self.plan_max_batch = transfer_config["plan_max_batch"]
+            self._plan_batches = {}
+            self._plan_timers = {}
+            self._plan_tasks = set()
+            self._semaphores = {}
+            self._counter = itertools.count()
+            self.initialized = True
+
+    async def send(self, local_path: str, host: str = None, remote_path: str = None) -> bool:
+        """
+        Hand a file to a remote host, waiting for a free stream to it first.
+        :param local_path: Path to the local file.
+        :param host: Remote host. Defaults to the one RemoteProcessor picks.
+        :param remote_path: Where to put the file on the host. Defaults to the path RemoteProcessor derives.
+        :return: True if the file was handed to the host.
+        """
+        host = remote_processor.resolve_host(host)
+        planned = await self._plan(host, local_path, remote_path)
+        return await self._run(host, local_path, lambda on_progress: remote_processor.process_file(local_path, host, on_progress=on_progress, remote_path=remote_path, planned=planned))
+
+    async def fetch(self, host: str, remote_path: str, local_path: str) -> bool:
+        """
+        Download a file from a remote host, sharing the host's streams and the bandwidth cap with uploads.
+        :return: True if the file was downloaded and verified.
+        """
+        return await self._run(host, remote_path, lambda on_progress: remote_processor.fetch_file(host, remote_path, local_path, on_progress=on_progress))
+
+    async def encode_remote(self, host: str, local_input: str, local_output: str, ffmpeg_args: list, timeout: float = None):
+        """
+        Encode a file on a remote host with ffmpeg. The copies there and back share the
+        host's streams and the bandwidth cap with other transfers; the encode itself doesn't
+        hold a stream.
+        :param ffmpeg_args: ffmpeg output options placed between the input and the output file.
+        :param timeout: Seconds after which the remote ffmpeg is killed.
+        :raises RuntimeError: If a copy or the remote ffmpeg fails.
+        """
+        remote_dir = remote_processor.segment_dir(host)
+        remote_input = f"{remote_dir}/{os.path.basename(local_input)}"
+        remote_output = f"{remote_dir}/{os.path.basename(local_output)}"
+        try:
+            await self._run(host, local_input, lambda on_progress: remote_processor.put_file(host, local_input, remote_input, on_progress=on_progress))
+            await asyncio.to_thread(remote_processor.run_remote_ffmpeg, host, remote_input, remote_output, ffmpeg_args, timeout)
+            await self._run(host, remote_output, lambda on_progress: remote_processor.get_file(host, remote_output, local_output, on_progress=on_progress))
+        finally:
+            await asyncio.to_thread(remote_processor.remove_remote_dir, host, remote_dir)
+
+    async def _plan(self, host: str, local_path: str, remote_path: str):
+        """
+        Add a file to the host's next batch and wait for the batch's plan.
+        Returns the file's PlannedTransfer, or None if the host couldn't be probed, in which
+        case process_file probes for the file on its own.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch = self._plan_batches.setdefault(host, [])
+        batch.append((local_path, remote_path, future))
+        if len(batch) >= self.plan_max_batch:
+            self._flush_plan(host)
+        elif len(batch) == 1:
+            self._plan_timers[host] = loop.call_later(self.plan_window, self._flush_plan, host)
+        return await future
+
+    def _flush_plan(self, host: str):
+        timer = self._plan_timers.pop(host, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._plan_batches.pop(host, None)
+        if batch:
+            task = asyncio.create_task(self._resolve_plan(host, batch))
+            self._plan_tasks.add(task)
+            task.add_done_callback(self._plan_tasks.discard)
+
+    async def _resolve_plan(self, host: str, batch: list):
+        local_paths = [local_path for local_path, _, _ in batch]
+        remote_paths = [remote_path for _, remote_path, _ in batch]
+        try:
+            plan = await asyncio.to_thread(remote_processor.plan_dispatch, host, local_paths, remote_paths)
+        except Exception as e:
+            log.warning(f"Could not plan {len(batch)} transfers to {host}, checking them one by one: {e}")
+            plan = {}
+        for local_path, _, future in batch:
+            if not future.done():
+                future.set_result(plan.get(local_path))
+
+    async def _run(self, host: str, path: str, transfer) -> bool:
+        semaphore = self._semaphores.setdefault(host, asyncio.Semaphore(self.streams_per_host))
+        async with semaphore:
+            return await asyncio.to_thread(self._transfer, host, path, transfer)
+
+    def _transfer(self, host: str, path: str, transfer) -> bool:
+        job = f"{host}:{next(self._counter)}"
+        progress = TransferProgress(host, job, self.bucket)
+        metric_emitter.transfer_active.labels(host=host).inc()
+        started = time.monotonic()
+        try:
+            transferred = transfer(progress.update)
+        finally:
+            metric_emitter.transfer_active.labels(host=host).dec()
+            progress.clear()
+        elapsed = time.monotonic() - started
+        if transferred and progress.sent_bytes:
+            metric_emitter.transfer_duration.observe(elapsed)
+            log.info(f"Transferred {path} with {host}: {progress.sent_bytes / 1024 ** 2:.0f}MB in {elapsed:.1f}s ({progress.sent_bytes / 1024 ** 2 / max(elapsed, 1e-6):.1f}MB/s)")
+        return transferred
+
+class TransferProgress:
+    """
+    Progress callback for one transfer. Throttles the sending thread and publishes metrics.
+    """
+
+    def __init__(self, host: str, job: str, bucket: TokenBucket):
+        self.host = host
+        self.job = job
+        self.bucket = bucket
+        self.position = 0
+        self.sent_bytes = 0
+        self.started = time.monotonic()
+
+    def update(self, position: int, total_bytes: int, transferred: bool = True):
+        """
+        :param position: Bytes of the file on the remote host so far.
+        :param total_bytes: Size of the file.
+        :param transferred: False if the bytes since the last call were already on the host,
+            e.g. when an upload resumes.
+        """
+        delta = position - self.position
+        self.position = position
+        if total_bytes:
+            metric_emitter.transfer_progress.labels(job=self.job).set(position / total_bytes)
+        if delta <= 0 or not transferred:
+            return
+        self.sent_bytes += delta
+        metric_emitter.transfer_bytes.labels(host=self.host).inc(delta)
+        waited = self.bucket.consume(delta)
+        if waited:
+            metric_emitter.transfer_throttled.inc(waited)
+        elapsed = time.monotonic() - self.started
+        if elapsed > 0:
+            metric_emitter.transfer_throughput.labels(job=self.job).set(self.sent_bytes / elapsed)
+
+    def clear(self):
+        for gauge in (metric_emitter.transfer_progress, metric_emitter.transfer_throughput):
+            try:
+                gauge.remove(self.job)
+            except KeyError:
+                pass
@@ -0,0 +1,145 @@
+import asyncio
+import os
+import stat
+from pathlib import Path
+
+from torrent_agent.common import logger
+from torrent_agent.common.configuration import Configuration
+from torrent_agent.common.constants import BROWSER_FRIENDLY_VIDEO_FILETYPES, IMAGE_FILETYPES, NON_BROWSER_FRIENDLY_VIDEO_FILETYPES
+from torrent_agent.image.image_processor import ImageProcessor
+from torrent_agent.scan.scan_manifest import OUTCOME_DEFERRED, OUTCOME_FAILED, OUTCOME_PROCESSED, OUTCOME_UNSUPPORTED, ScanManifest
+from torrent_agent.thumbnail.thumbnail_generator import ThumbnailGenerator
+from torrent_agent.torrent.torrent_manager import TorrentManager
+from torrent_agent.video.video_processor import VideoProcessor
+
+log = logger.get_logger()
+configuration = Configuration()
+
+class FilePipeline:
+    """
+    Runs scanned paths through lookup, ingestion and thumbnailing with a separate
+    concurrency limit per stage. Each path moves through its stages in order, so a
+    video is always inserted before its thumbnail is generated, while different paths
+    overlap freely. Show directories are reconciled once all files have been ingested.
+    """
+
+    def __init__(
+        self,
+        video_processor: VideoProcessor,
+        image_processor: ImageProcessor,
+        thumbnail_generator: ThumbnailGenerator,
+        torrent_manager: TorrentManager,
+        scan_manifest: ScanManifest,
+        ignored_paths=None,
+    ):
+        self.video_processor = video_processor
+        self.image_processor = image_processor
+        self.thumbnail_generator = thumbnail_generator
+        self.torrent_manager = torrent_manager
+        self.scan_manifest = scan_manifest
+        self.ignored_paths = ignored_paths or []
+
+        concurrency = configuration.get_pipeline_concurrency()
+        self.lookup_semaphore = asyncio.Semaphore(concurrency["lookup"])
+        self.ingest_semaphore = asyncio.Semaphore(concurrency["ingest"])
+        self.thumbnail_semaphore = asyncio.Semaphore(concurrency["thumbnail"])
+        # Bound the number of paths in flight so a huge backlog doesn't become one task per file up front.
+        self.max_in_flight = max(concurrency.values()) * 4
+
+        self.files_skipped = 0
+        self.files_processed = 0
+        self.seen_paths = set()
+
+    async def run(self, paths):
+        """
+        Process every path and wait for all of them to finish.
+        """
+        directories = []
+        in_flight = asyncio.Semaphore(self.max_in_flight)
+        tasks = set()
+
+        for file_path in paths:
+            if any(ignored in file_path for ignored in self.ignored_paths):
+                log.debug(f"Skipping ignored path: {file_path}")
+                continue
+
+            try:
+                stat_result = os.stat(file_path)
+            except FileNotFoundError:
+                log.debug(f"File disappeared before it could be scanned: {file_path}")
+                continue
+
+            if not stat.S_ISREG(stat_result.st_mode):
+                directories.append(file_path)
+                continue
+
+            self.seen_paths.add(file_path)
+            if self.scan_manifest.is_unchanged(file_path, stat_result):
+                self.files_skipped += 1
+                continue
+
+            self.files_processed += 1
+            await in_flight.acquire()
+            task = asyncio.create_task(self._process_file(file_path, stat_result))
+            tasks.add(task)
+            task.add_done_callback(lambda done_task: (tasks.discard(done_task), in_flight.release()))
+
+        if tasks:
+            await asyncio.gather(*tasks)
+
+        if directories:
+            await asyncio.gather(*(self._process_directory(directory) for directory in directories))
+
+    async def _process_directory(self, directory):
+        async with self.ingest_semaphore:
+            try:
+                log.debug(f"Checking if directory is a TV show: {directory}")
+                await self.torrent_manager.add_show_to_database(directory)
+            except Exception as e:
+                log.error(f"An error occurred while processing directory '{directory}': {e}", exc_info=True)
+
+    async def _process_file(self, file_path, stat_result):
+        file_name = Path(file_path).stem
+        extension = "." + file_path.split(".")[-1].lower()
+        log.info("Processing file: " + file_name)
+
+        outcome = OUTCOME_DEFERRED
+        try:
+            if extension in NON_BROWSER_FRIENDLY_VIDEO_FILETYPES or extension in BROWSER_FRIENDLY_VIDEO_FILETYPES:
+                outcome = await self._process_video(file_name, file_path)
+            elif extension in IMAGE_FILETYPES:
+                outcome = await self._process_image(file_name, file_path)
+            else:
+                log.info(f"File '{file_name}' of type '{extension}' is not a supported format. Skipping.")
+                outcome = OUTCOME_UNSUPPORTED
+        except Exception as e:
+            log.error(f"An error occurred while processing file '{file_name}': {e}", exc_info=True)
+            outcome = OUTCOME_FAILED
+        finally:
+            self.scan_manifest.record(file_path, stat_result, outcome)
+
+    async def _process_video(self, file_name, file_path):
+        async with self.lookup_semaphore:
+            stored = await self.video_processor.is_stored(file_path)
+
+        if stored:
+            log.info(f"File is already processed and stored {file_path}")
+        else:
+            async with self.ingest_semaphore:
+                stored = await self.video_processor.ingest_video(file_name, file_path)
+
+        if stored and not configuration.is_remote_agent():
+            async with self.thumbnail_semaphore:
+                await self.thumbnail_generator.generate_thumbnail(file_path, file_name)
+        return OUTCOME_PROCESSED if stored else OUTCOME_DEFERRED
+
+    async def _process_image(self, file_name, file_path):
+        async with self.lookup_semaphore:
+            stored = await self.image_processor.is_stored(file_name)
+
+        if stored:
+            log.info("File is already processed and stored: " + file_name)
+        else:
+            async with self.ingest_semaphore:
+                stored = await self.image_processor.ingest_image(file_name, file_path)
+        return OUTCOME_PROCESSED if stored else OUTCOME_DEFERRED
@@ -0,0 +1,120 @@
+import asyncio
+import json
+import os
+from urllib.parse import parse_qs
+
+from torrent_agent.common import logger
+
+log = logger.get_logger()
+
+MAX_BODY_BYTES = 64 * 1024
+# A client that stops sending mid-request doesn't get to hold its connection open.
+REQUEST_TIMEOUT_SECONDS = 10
+REASONS = {200: "OK", 202: "Accepted", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed", 408: "Request Timeout", 413: "Payload Too Large"}
+
+class IngestServer:
+    """
+    Small local HTTP endpoint that lets Transmission's torrent-done script push a
+    completed torrent to the agent instead of waiting for the next scan.
+
+    POST /ingest with either a JSON body {"path": "..."} or a form-encoded path=...
+    The path must be inside the media directory. The request is answered with 202 straight
+    away and the path is handed to the handler in the background.
+    """
+
+    def __init__(self, handler, media_directory: str, host: str = "127.0.0.1", port: int = 8003):
+        """
+        :param handler: Coroutine function called with the absolute path of the completed torrent.
+        :param media_directory: Only paths inside this directory are accepted.
+        :param host: Interface to listen on.
+        :param port: Port to listen on.
+        """
+        self.handler = handler
+        self.media_directory = os.path.realpath(media_directory)
+        self.host = host
+        self.port = port
+        self._server = None
+        self._tasks = set()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        log.info(f"Ingest endpoint listening on http://{self.host}:{self.port}/ingest")
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            status, message = await asyncio.wait_for(self._handle_request(reader), REQUEST_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            status, message = 408, "Request timed out"
+        except (asyncio.IncompleteReadError, ValueError) as e:
+            status, message = 400, f"Malformed request: {e}"
+        except Exception as e:
+            log.error(f"Error while handling ingest request: {e}", exc_info=True)
+            status, message = 400, "Could not handle request"
+
+        body = json.dumps({"message": message}).encode()
+        writer.write(
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode() + body
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def _handle_request(self, reader: asyncio.StreamReader):
+        request_line = (await reader.readline()).decode("latin-1").strip()
+        method, target, _ = request_line.split(" ", 2)
+
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1").strip()
+            if not line:
+                break
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+
+        if target == "/health":
+            return 200, "ok"
+        if target != "/ingest":
+            return 404, f"Unknown path '{target}'"
+        if method != "POST":
+            return 405, "Use POST"
+
+        content_length = int(headers.get("content-length", "0"))
+        if content_length > MAX_BODY_BYTES:
+            return 413, "Request body too large"
+        body = (await reader.readexactly(content_length)).decode()
+
+        if headers.get("content-type", "").startswith("application/json"):
+            path = json.loads(body).get("path")
+        else:
+            path = parse_qs(body).get("path", [None])[0]
+        if not path:
+            return 400, "Missing 'path'"
+
+        real_path = os.path.realpath(path)
+        if os.path.commonpath([real_path, self.media_directory]) != self.media_directory:
+            log.warning(f"Rejected ingest request for '{path}' outside the media directory.")
+            return 403, "Path is outside the media directory"
+        if not os.path.exists(real_path):
+            return 404, f"Path '{path}' does not exist"
+
+        log.info(f"Ingest requested for '{real_path}'.")
+        task = asyncio.create_task(self._run_handler(real_path))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return 202, f"Ingest scheduled for '{real_path}'"
+
+    async def _run_handler(self, path):
+        try:
+            await self.handler(path)
+        except Exception as e:
+            log.error(f"Error while ingesting '{path}': {e}", exc_info=True)
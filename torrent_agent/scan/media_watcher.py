@@ -0,0 +1,164 @@
+import asyncio
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+
+from torrent_agent.common import logger
+
+log = logger.get_logger()
+
+# inotify constants from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+_EVENT_HEADER = struct.Struct("iIII")
+_READ_SIZE = 64 * 1024
+
+class MediaWatcher:
+    """
+    Watches the media directory with inotify and hands batches of changed paths to an
+    async handler once they have been quiet for the debounce period.
+    Files are reported on close-after-write and moved-to; new directories are watched
+    recursively and reported together with any files they already contain.
+    """
+
+    def __init__(self, root: str, handler, debounce_seconds: float = 5, ignored_paths=None):
+        """
+        :param root: Directory tree to watch.
+        :param handler: Coroutine function called with a list of paths.
+        :param debounce_seconds: How long a path must be quiet before it is handed over.
+        :param ignored_paths: Path fragments whose events are dropped.
+        """
+        self.root = root
+        self.handler = handler
+        self.debounce_seconds = debounce_seconds
+        self.ignored_paths = ignored_paths or []
+        self.rescan_requested = asyncio.Event()
+        self._fd = None
+        self._libc = None
+        self._watches = {}
+        self._pending = {}
+        self._debounce_task = None
+        self._loop = None
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_init1 failed: {os.strerror(err)}")
+
+        self._watch_tree(self.root)
+        self._loop.add_reader(self._fd, self._read_events)
+        self._debounce_task = asyncio.create_task(self._debounce_loop())
+        log.info(f"Watching {len(self._watches)} directories under {self.root} for new media.")
+
+    def stop(self):
+        if self._debounce_task:
+            self._debounce_task.cancel()
+            self._debounce_task = None
+        if self._fd is not None:
+            self._loop.remove_reader(self._fd)
+            os.close(self._fd)
+            self._fd = None
+        self._watches.clear()
+
+    def push(self, path: str):
+        """
+        Queue a path for the handler, restarting its debounce timer.
+        """
+        if any(ignored in path for ignored in self.ignored_paths):
+            return
+        self._pending[path] = self._loop.time()
+
+    def _watch_tree(self, directory: str):
+        """
+        Add a watch for a directory and every directory below it.
+        Returns the files found while walking so events missed before the watch existed are not lost.
+        """
+        found_files = []
+        for dir_path, _, file_names in os.walk(directory):
+            if any(ignored in dir_path for ignored in self.ignored_paths):
+                continue
+            self._add_watch(dir_path)
+            found_files.extend(os.path.join(dir_path, file_name) for file_name in file_names)
+        return found_files
+
+    def _add_watch(self, directory: str):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                log.error(f"inotify watch limit reached while watching '{directory}'. Raise fs.inotify.max_user_watches; relying on full scans for the rest of the tree.")
+            else:
+                log.error(f"Failed to watch '{directory}': {os.strerror(err)}")
+            return
+        self._watches[wd] = directory
+
+    def _read_events(self):
+        while True:
+            try:
+                buffer = os.read(self._fd, _READ_SIZE)
+            except BlockingIOError:
+                return
+            if not buffer:
+                return
+
+            offset = 0
+            while offset + _EVENT_HEADER.size <= len(buffer):
+                wd, mask, _, name_length = _EVENT_HEADER.unpack_from(buffer, offset)
+                offset += _EVENT_HEADER.size
+                name = buffer[offset:offset + name_length].rstrip(b"\0")
+                offset += name_length
+                self._handle_event(wd, mask, os.fsdecode(name))
+
+    def _handle_event(self, wd: int, mask: int, name: str):
+        if mask & IN_Q_OVERFLOW:
+            log.warning("inotify event queue overflowed. Requesting a full scan.")
+            self.rescan_requested.set()
+            return
+
+        if mask & IN_IGNORED:
+            self._watches.pop(wd, None)
+            return
+
+        directory = self._watches.get(wd)
+        if directory is None or not name:
+            return
+        path = os.path.join(directory, name)
+
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                for file_path in self._watch_tree(path):
+                    self.push(file_path)
+                self.push(path)
+        elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+            self.push(path)
+
+    async def _debounce_loop(self):
+        interval = max(self.debounce_seconds / 2, 0.1)
+        while True:
+            await asyncio.sleep(interval)
+            now = self._loop.time()
+            ready = [path for path, last_event in self._pending.items() if now - last_event >= self.debounce_seconds]
+            if not ready:
+                continue
+            for path in ready:
+                del self._pending[path]
+
+            log.info(f"{len(ready)} paths changed under {self.root}. Processing them now.")
+            try:
+                await self.handler(ready)
+            except Exception as e:
+                log.error(f"Error while processing watched paths: {e}", exc_info=True)
@@ -0,0 +1,148 @@
+import json
+import os
+from threading import Lock
+
+from torrent_agent.common import logger
+from torrent_agent.common.configuration import Configuration
+
+log = logger.get_logger()
+
+OUTCOME_PROCESSED = "processed"
+OUTCOME_UNSUPPORTED = "unsupported"
+OUTCOME_DEFERRED = "deferred"
+OUTCOME_FAILED = "failed"
+
+# Outcomes that mean nothing more can happen to a file until it changes on disk.
+FINAL_OUTCOMES = (OUTCOME_PROCESSED, OUTCOME_UNSUPPORTED)
+
+class ScanManifestEntry:
+    def __init__(self, size: int, mtime: float, inode: int, outcome: str):
+        self.size = size
+        self.mtime = mtime
+        self.inode = inode
+        self.outcome = outcome
+
+    def matches(self, stat_result: os.stat_result) -> bool:
+        return (
+            self.size == stat_result.st_size
+            and self.mtime == stat_result.st_mtime
+            and self.inode == stat_result.st_ino
+        )
+
+    def to_dict(self):
+        return {"size": self.size, "mtime": self.mtime, "inode": self.inode, "outcome": self.outcome}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(size=data["size"], mtime=data["mtime"], inode=data["inode"], outcome=data["outcome"])
+
+class ScanManifest:
+    """
+    Persistent record of every file seen by a scan, keyed by path.
+    A file whose size, mtime and inode are unchanged since it last reached a final
+    outcome is skipped before any cache or database lookup is made.
+    """
+    _instance = None
+    _lock = Lock()
+
+    def __new__(cls, *args, **kwargs):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = super(ScanManifest, cls).__new__(cls)
+        return cls._instance
+
+    def __init__(self, manifest_path: str = None):
+        if not hasattr(self, "_initialized"):
+            self.manifest_path = manifest_path or Configuration().get_scan_manifest_path()
+            self.entries = {}
+            self.fingerprints = {}
+            self._dirty = False
+            self._initialized = True
+            self.load()
+
+    def load(self):
+        """
+        Load the manifest from disk. A missing or unreadable manifest starts empty,
+        which only costs one full pass through the repositories.
+        """
+        try:
+            with open(self.manifest_path, "r") as manifest_file:
+                data = json.load(manifest_file)
+            self.entries = {path: ScanManifestEntry.from_dict(entry) for path, entry in data.get("files", {}).items()}
+            self.fingerprints = dict(data.get("fingerprints", {}))
+            log.info(f"Loaded scan manifest with {len(self.entries)} entries from {self.manifest_path}")
+        except FileNotFoundError:
+            log.info(f"No scan manifest found at {self.manifest_path}. Starting with an empty manifest.")
+            self.entries = {}
+            self.fingerprints = {}
+        except (ValueError, KeyError, TypeError) as e:
+            log.error(f"Scan manifest at {self.manifest_path} is corrupt, starting with an empty manifest: {e}", exc_info=True)
+            self.entries = {}
+            self.fingerprints = {}
+        self._dirty = False
+
+    def save(self):
+        """
+        Atomically write the manifest to disk if anything changed since the last save.
+        """
+        if not self._dirty:
+            return
+        data = {
+            "files": {path: entry.to_dict() for path, entry in self.entries.items()},
+            "fingerprints": self.fingerprints,
+        }
+        temp_path = f"{self.manifest_path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+            with open(temp_path, "w") as manifest_file:
+                json.dump(data, manifest_file)
+            os.replace(temp_path, self.manifest_path)
+            self._dirty = False
+            log.debug(f"Saved scan manifest with {len(self.entries)} entries to {self.manifest_path}")
+        except OSError as e:
+            log.error(f"Failed to save scan manifest to {self.manifest_path}: {e}", exc_info=True)
+
+    def is_unchanged(self, file_path: str, stat_result: os.stat_result) -> bool:
+        """
+        Returns True if the file reached a final outcome and has not changed since.
+        """
+        entry = self.entries.get(file_path)
+        return entry is not None and entry.outcome in FINAL_OUTCOMES and entry.matches(stat_result)
+
+    def record(self, file_path: str, stat_result: os.stat_result, outcome: str):
+        """
+        Record the outcome of processing a file together with the stat it was processed at.
+        """
+        self.entries[file_path] = ScanManifestEntry(
+            size=stat_result.st_size,
+            mtime=stat_result.st_mtime,
+            inode=stat_result.st_ino,
+            outcome=outcome,
+        )
+        self._dirty = True
+
+    def get_fingerprint(self, key: str):
+        return self.fingerprints.get(key)
+
+    def set_fingerprint(self, key: str, fingerprint: str):
+        """
+        Remember a fingerprint for a directory tree (or anything else keyed by path) across runs.
+        """
+        if self.fingerprints.get(key) != fingerprint:
+            self.fingerprints[key] = fingerprint
+            self._dirty = True
+
+    def forget(self, file_path: str):
+        if self.entries.pop(file_path, None) is not None:
+            self._dirty = True
+
+    def prune(self, seen_paths: set):
+        """
+        Drop entries for files that no longer exist in the scanned tree.
+        """
+        removed = [path for path in self.entries if path not in seen_paths]
+        for path in removed:
+            del self.entries[path]
+        if removed:
+            self._dirty = True
+            log.debug(f"Pruned {len(removed)} stale entries from the scan manifest.")
@@ -0,0 +1,76 @@
+import os
+import time
+
+from torrent_agent.common import logger
+from torrent_agent.common.configuration import Configuration
+
+log = logger.get_logger()
+configuration = Configuration()
+
+class FileSnapshot:
+    def __init__(self, size: int, mtime: float, observed_at: float):
+        self.size = size
+        self.mtime = mtime
+        self.observed_at = observed_at
+
+class DownloadStabilityTracker:
+    """
+    Decides whether a file has finished downloading without sleeping.
+    Size/mtime snapshots are kept across scans and watch events; a file is stable once it
+    has not changed for the quiet period. When Transmission knows about the file, its
+    completion status takes precedence over the snapshots.
+    """
+
+    def __init__(self, quiet_period_seconds: float = None, completion_provider=None):
+        """
+        :param quiet_period_seconds: How long a file must stay unchanged to count as downloaded.
+        :param completion_provider: Optional callable taking a file path and returning True if the
+            torrent holding it is complete, False if it is still downloading, or None if unknown.
+        """
+        if quiet_period_seconds is None:
+            quiet_period_seconds = configuration.get_download_quiet_period_seconds()
+        self.quiet_period_seconds = quiet_period_seconds
+        self.completion_provider = completion_provider
+        self.snapshots = {}
+
+    def is_stable(self, file_path: str) -> bool:
+        if file_path.endswith(".part"):
+            log.info(f"File '{file_path}' is a partial download (.part). Skipping.")
+            return False
+
+        completed = self.completion_provider(file_path) if self.completion_provider else None
+        if completed is False:
+            log.info(f"File '{file_path}' belongs to a torrent that is still downloading.")
+            self.snapshots.pop(file_path, None)
+            return False
+
+        try:
+            stat_result = os.stat(file_path)
+        except FileNotFoundError:
+            log.warning(f"File '{file_path}' not found during download check.")
+            self.snapshots.pop(file_path, None)
+            return False
+
+        if completed:
+            self.snapshots.pop(file_path, None)
+            return True
+
+        now = time.monotonic()
+        snapshot = self.snapshots.get(file_path)
+        if snapshot is None or snapshot.size != stat_result.st_size or snapshot.mtime != stat_result.st_mtime:
+            # A file that hasn't been written to for the quiet period is stable the first time it is seen.
+            if snapshot is None and time.time() - stat_result.st_mtime >= self.quiet_period_seconds:
+                return True
+            self.snapshots[file_path] = FileSnapshot(stat_result.st_size, stat_result.st_mtime, now)
+            return False
+
+        if now - snapshot.observed_at >= self.quiet_period_seconds:
+            del self.snapshots[file_path]
+            return True
+        return False
+
+    def pending_paths(self):
+        """
+        Returns the paths that have been seen changing and are not yet stable.
+        """
+        return list(self.snapshots)
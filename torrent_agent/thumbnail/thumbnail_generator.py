@@ -72,7 +72,7 @@ class ThumbnailGenerator:
         os.makedirs(self.image_dir, exist_ok=True)
         log.debug(f"Ensured image directory exists: {self.image_dir}")
 
-        image_path = os.path.join(self.image_dir, f"{os.path.splitext(file_name)[0]}-{video_id}.jpeg")
+        image_path = self.thumbnail_path(file_name, video_id)
         log.debug(f"Saving thumbnail to path: {image_path}")
 
         if not cv2.imwrite(image_path, frame):
@@ -83,6 +83,25 @@ class ThumbnailGenerator:
         cap.release()
         log.debug("Video capture released.")
 
+        await self.register_thumbnail(video_id, image_path)
+        log.info(f"Thumbnail generated and saved at {image_path}.")
+
+    def thumbnail_path(self, file_name, video_id):
+        """
+        Returns where the thumbnail of a video is saved.
+        """
+        return os.path.join(self.image_dir, f"{os.path.splitext(os.path.basename(file_name))[0]}-{video_id}.jpeg")
+
+    def preview_strip_path(self, file_name, video_id):
+        """
+        Returns where the preview strip of a video is saved.
+        """
+        return os.path.join(self.image_dir, f"{os.path.splitext(os.path.basename(file_name))[0]}-{video_id}-preview.jpeg")
+
+    async def register_thumbnail(self, video_id, image_path):
+        """
+        Add a thumbnail that has already been written to image_path to the images table and link it to the video.
+        """
         # Insert into images table and update videos table
         image = Image(
             file_name=os.path.basename(image_path),
@@ -95,5 +114,3 @@ class ThumbnailGenerator:
 
         await self.video_repository.update_video_thumbnail(video_id, image_id)
         log.debug(f"Updated video record with video_id: {video_id} to include thumbnail_id: {image_id}")
-
-        log.info(f"Thumbnail generated and saved at {image_path}.")
@@ -1,93 +1,114 @@
+import asyncio
+import hashlib
 import os
 import pathlib
-import subprocess
 from torrent_agent.common import logger
 from torrent_agent.common.configuration import Configuration
+from torrent_agent.common.constants import BROWSER_FRIENDLY_VIDEO_FILETYPES, NON_BROWSER_FRIENDLY_VIDEO_FILETYPES
+from torrent_agent.common.utils import file_name_to_cdn_path
 from torrent_agent.database.cache.shows_cache import ShowsRepositoryCache
 from torrent_agent.database.dao.show_dao import IShowsDAO
 import re
 
-from torrent_agent.model.show import Show
+from torrent_agent.model.show import Episode, Show
+from torrent_agent.scan.scan_manifest import ScanManifest
+from torrent_agent.torrent.transmission_client import TransmissionClient
 
 configuration = Configuration()
 log = logger.get_logger()
 
+VIDEO_FILETYPES = BROWSER_FRIENDLY_VIDEO_FILETYPES + NON_BROWSER_FRIENDLY_VIDEO_FILETYPES
+TORRENT_FIELDS = ["id", "name", "downloadDir", "percentDone", "status"]
+
 class TorrentManager:
-    def __init__(self, shows_repository: IShowsDAO):
+    def __init__(self, shows_repository: IShowsDAO, transmission_client: TransmissionClient = None, scan_manifest: ScanManifest = None):
         """
         Initializes the TorrentManager with a ShowsRepository instance.
         :param shows_repository: An instance of IShowsDAO to interact with the shows database.
+        :param transmission_client: Client used to fetch torrent status from Transmission.
+        :param scan_manifest: Manifest used to remember show folder fingerprints between runs.
         """
         self.shows_repository = shows_repository
+        self.scan_manifest = scan_manifest
+        self.transmission_client = transmission_client or TransmissionClient()
+        self._index_ready = False
+        self._downloading_dirs = set()
+        self._downloading_roots = set()
+        self._completed_roots = set()
+
+    async def refresh_torrent_index(self):
+        """
+        Fetches every torrent from Transmission in one RPC call and indexes the directories
+        that are still downloading, so per-file checks are set lookups.
+        Call once per cycle. If Transmission can't be reached the index is cleared and
+        every status is reported as unknown.
+        """
+        if configuration.is_remote_agent():
+            return
+
+        try:
+            torrents = await self.transmission_client.torrent_get(TORRENT_FIELDS)
+        except Exception as e:
+            log.error(f"Error fetching torrents from Transmission: {e}", exc_info=True)
+            self._index_ready = False
+            return
+
+        downloading_dirs = set()
+        downloading_roots = set()
+        completed_roots = set()
+        for torrent in torrents:
+            download_dir = os.path.abspath(torrent.get("downloadDir") or "")
+            torrent_root = os.path.join(download_dir, torrent.get("name") or "")
+            if torrent.get("percentDone", 0) < 1:
+                downloading_dirs.add(download_dir)
+                downloading_roots.add(torrent_root)
+            else:
+                completed_roots.add(torrent_root)
+
+        self._downloading_dirs = downloading_dirs
+        self._downloading_roots = downloading_roots
+        self._completed_roots = completed_roots
+        self._index_ready = True
+        log.debug(f"Indexed {len(torrents)} torrents, {len(downloading_roots)} still downloading.")
 
     def is_tv_show_downloading(self, file_path):
         """
-        Checks if the directory containing the file is within a '/tv/' folder and,
-        if not a remote agent, uses transmission-remote to check if any torrents
-        in that directory are still downloading.
+        Checks if the directory containing the file is within a '/tv/' folder and
+        if any torrents in that directory are still downloading.
         Returns True if a TV show is still downloading in the folder, False otherwise.
         """
-        if configuration.is_remote_agent():
-            return False
-
-        # Check if the file is in a '/tv/' directory
-        path = pathlib.Path(file_path)
-        if '/tv/' not in str(path).replace("\\", "/").lower():
+        if '/tv/' not in str(pathlib.Path(file_path)).replace("\\", "/").lower():
             return False
+        return self.get_download_status(file_path) is False
 
-        # Get the parent directory
-        parent_dir = str(path.parent)
+    def get_download_status(self, file_path):
+        """
+        Looks up the torrent a file belongs to in the index built by refresh_torrent_index.
+        Returns True if Transmission reports it complete, False if it is still downloading,
+        or None if the file isn't tracked by Transmission or its status is unavailable.
+        """
+        if configuration.is_remote_agent() or not self._index_ready:
+            return None
 
-        try:
-            # List all torrents with their download directories and status
-            result = subprocess.run(
-                ["transmission-remote", "--auth","pi:raspberry","-l"],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                check=True
-            )
-            lines = result.stdout.splitlines()
-            # Skip header lines, parse each torrent line
-            for line in lines[1:]:
-                if not line.strip() or line.startswith("Sum:"):
-                    continue
-                parts = line.split()
-                if len(parts) < 9:
-                    continue
-                # The download directory is usually at the end, but may need to parse with -t <id> -i for more details
-                torrent_id = parts[0]
-                # Get detailed info for this torrent
-                info_result = subprocess.run(
-                    ["transmission-remote", "--auth","pi:raspberry","-t", torrent_id, "-i"],
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True,
-                    check=True
-                )
-                info_lines = info_result.stdout.splitlines()
-                download_dir = ""
-                percent_done = ""
-                for info_line in info_lines:
-                    if info_line.strip().startswith("Location:"):
-                        download_dir = info_line.split(":", 1)[1].strip()
-                    if info_line.strip().startswith("Percent Done:"):
-                        percent_done = info_line.split(":", 1)[1].strip()
-                # Check if the download directory matches the parent directory
-                if os.path.abspath(download_dir) == os.path.abspath(parent_dir):
-                    # If percent done is not 100%, it's still downloading
-                    if not percent_done.startswith("100%"):
-                        log.info(f"TV show in '{parent_dir}' is still downloading (torrent id {torrent_id}). Skipping.")
-                        return True
-        except Exception as e:
-            log.error(f"Error checking transmission-remote: {e}", exc_info=True)
+        path = pathlib.Path(os.path.abspath(file_path))
+        # Any unfinished torrent downloading into a TV show's folder blocks the whole folder.
+        if '/tv/' in str(path).replace("\\", "/").lower() and str(path.parent) in self._downloading_dirs:
+            log.info(f"TV show in '{path.parent}' is still downloading. Skipping.")
             return False
 
-        return False
+        candidates = [str(path)] + [str(parent) for parent in path.parents]
+        if any(candidate in self._downloading_roots for candidate in candidates):
+            return False
+        if any(candidate in self._completed_roots for candidate in candidates):
+            return True
+        return None
     
     async def add_show_to_database(self, folder_path):
         """
-        Adds a show to the database by checking the folder structure and adding seasons and episodes.
+        Reconciles a show folder with the database. The show's seasons and episodes are
+        loaded in one query, diffed against the folder tree in memory, and everything missing
+        is written in one transaction. Folders whose tree fingerprint hasn't changed since the
+        last complete reconciliation are skipped.
         """
 
         # Ensure the folder is within '/torrents/tv/'
@@ -95,18 +116,27 @@ class TorrentManager:
         # Ensure the folder is within '/torrents/tv/' and is not deeper than one level (xyz format)
         path_parts = str(path).replace("\\", "/").lower().split('/torrents/tv/')
         if len(path_parts) != 2 or '/' in path_parts[1]:
-            log.error(f"Folder '{folder_path}' is not in the expected '/torrents/tv/xyz' format.", exc_info=True)
+            log.debug(f"Folder '{folder_path}' is not in the expected '/torrents/tv/xyz' format.")
+            return
+
+        fingerprint_key = f"show:{path}"
+        # Walking a show tree on a USB disk takes a while; keep it off the event loop.
+        fingerprint = await asyncio.to_thread(self._fingerprint_show_tree, path)
+        if self.scan_manifest and self.scan_manifest.get_fingerprint(fingerprint_key) == fingerprint:
+            log.debug(f"Show folder '{folder_path}' is unchanged since it was last reconciled. Skipping.")
             return
 
         # Extract the show folder name (xyz)
         show_folder = path.name
         show = await self.shows_repository.get_show_by_folder(show_folder)
 
-        if not show:
-            log.warning(f"Show folder '{show_folder}' does not exist in the database.", exc_info=True)
+        if show:
+            show_id = show.id
+        else:
+            log.warning(f"Show folder '{show_folder}' does not exist in the database.")
 
             # Add the show to the database
-            show = await self.shows_repository.add_show(
+            show_id = await self.shows_repository.add_show(
                 Show(
                     name=show_folder,
                     description="",
@@ -115,50 +145,82 @@ class TorrentManager:
                 )
             )
             log.info(f"Added show '{show_folder}' to the database.")
-            return
 
-        show_id = show['id']
+        season_folders = await asyncio.to_thread(self._read_season_folders, path)
+        existing_seasons = await self.shows_repository.get_show_tree(show_id)
+        video_ids = await self.shows_repository.get_video_ids_in_folder(file_name_to_cdn_path(str(path)))
+
+        new_seasons = [season_number for season_number in season_folders if season_number not in existing_seasons]
+        new_episodes = {}
+        complete = True
+        for season_number, episode_files in season_folders.items():
+            existing_season = existing_seasons.get(season_number)
+            known_episodes = existing_season['episodes'] if existing_season else set()
+            for episode_number, file in episode_files.items():
+                if episode_number in known_episodes:
+                    continue
+                video_id = video_ids.get(file_name_to_cdn_path(str(file)))
+                if video_id is None:
+                    # The video hasn't been ingested yet; pick the episode up on a later run.
+                    log.debug(f"No video found for '{file}' yet. Deferring episode {episode_number} of season {season_number}.")
+                    complete = False
+                    continue
+                new_episodes.setdefault(season_number, []).append(Episode(
+                    video_id=video_id,
+                    episode_number=episode_number,
+                    show_id=show_id,
+                    season_id=existing_season['id'] if existing_season else None
+                ))
+
+        if new_seasons or new_episodes:
+            await self.shows_repository.add_seasons_and_episodes(show_id, new_seasons, new_episodes)
+            log.info(f"Added {len(new_seasons)} seasons and {sum(len(episodes) for episodes in new_episodes.values())} episodes for show '{show_folder}'.")
+
+        if complete and self.scan_manifest:
+            self.scan_manifest.set_fingerprint(fingerprint_key, fingerprint)
 
-        # Iterate through subfolders (seasons)
+    def _read_season_folders(self, path: pathlib.Path):
+        """
+        Maps each season folder's number to its episode files, keyed by episode number.
+        """
+        season_folders = {}
         for subfolder in path.iterdir():
-            if subfolder.is_dir():
-                try:
-                    # Extract season number from folder name
-                    match = re.search(r'\d+', subfolder.name)
-                    if match:
-                        season_number = int(match.group())
-                    else:
-                        raise ValueError(f"Could not extract season number from folder name '{subfolder.name}'.")
-                except ValueError:
-                    log.warning(f"Skipping folder '{subfolder}' as it does not represent a season.")
+            if not subfolder.is_dir():
+                continue
+            # Extract season number from folder name
+            match = re.search(r'\d+', subfolder.name)
+            if not match:
+                log.warning(f"Skipping folder '{subfolder}' as it does not represent a season.")
+                continue
+            season_number = int(match.group())
+
+            episodes = season_folders.setdefault(season_number, {})
+            for file in sorted(subfolder.iterdir()):
+                if not file.is_file() or file.suffix.lower() not in VIDEO_FILETYPES:
                     continue
-
-                # Check if the season already exists
-                existing_season = await self.shows_repository.get_season_by_show_and_number(show_id, season_number)
-                if existing_season:
-                    log.info(f"Season {season_number} for show '{show_folder}' already exists. Skipping.")
+                # Extract season and episode numbers from the filename (e.g., S01E06)
+                match = re.search(r'[Ss](\d+)[Ee](\d+)', file.stem)
+                if not match:
+                    log.warning(f"Skipping file '{file.name}' as it does not match the SxxExx pattern.")
+                    continue
+                # Ensure the season matches the folder's season
+                if int(match.group(1)) != season_number:
+                    log.warning(f"File '{file.name}' does not match season {season_number}. Skipping.")
                     continue
+                episodes.setdefault(int(match.group(2)), file)
+        return season_folders
 
-                # Add the season
-                await self.shows_repository.add_season(show_id, season_number)
-                log.info(f"Added season {season_number} for show '{show_folder}'.")
-
-                # Check for episodes within the season folder
-                for file in subfolder.iterdir():
-                    if file.is_file():
-                        # Extract season and episode numbers from the filename (e.g., S01E06)
-                        match = re.search(r'[Ss](\d+)[Ee](\d+)', file.stem)
-                        if match:
-                            season_from_file = int(match.group(1))
-                            episode_number = int(match.group(2))
-
-                            # Ensure the season matches the folder's season
-                            if season_from_file != season_number:
-                                log.warning(f"File '{file.name}' does not match season {season_number}. Skipping.")
-                                continue
-
-                            # Add the episode
-                            await self.shows_repository.add_episode(show_id, season_number, episode_number)
-                            log.info(f"Added episode {episode_number} to season {season_number} for show '{show_folder}'.")
-                        else:
-                            log.warning(f"Skipping file '{file.name}' as it does not match the SxxExx pattern.")
\ No newline at end of file
+    def _fingerprint_show_tree(self, path: pathlib.Path):
+        """
+        Hashes the names and mtimes of a show folder, its season folders and their files.
+        """
+        digest = hashlib.sha1()
+        for dir_path, dir_names, file_names in os.walk(path):
+            dir_names.sort()
+            for name in [dir_path] + [os.path.join(dir_path, file_name) for file_name in sorted(file_names)]:
+                try:
+                    mtime = os.stat(name).st_mtime_ns
+                except FileNotFoundError:
+                    continue
+                digest.update(f"{name}\0{mtime}\n".encode())
+        return digest.hexdigest()
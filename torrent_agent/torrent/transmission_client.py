@@ -0,0 +1,76 @@
+import asyncio
+import base64
+import json
+import urllib.error
+import urllib.request
+
+from torrent_agent.common import logger
+from torrent_agent.common.configuration import Configuration
+
+log = logger.get_logger()
+
+SESSION_ID_HEADER = "X-Transmission-Session-Id"
+
+class TransmissionError(Exception):
+    pass
+
+class TransmissionClient:
+    """
+    Minimal client for the Transmission JSON-RPC API.
+    Handles the session-id handshake (HTTP 409) and basic auth from the configuration.
+    """
+
+    def __init__(self, host=None, port=None, username=None, password=None, rpc_path=None, timeout=10):
+        transmission_config = Configuration().get_transmission_config()
+        self.host = host or transmission_config["host"]
+        self.port = port or transmission_config["port"]
+        self.username = username if username is not None else transmission_config["username"]
+        self.password = password if password is not None else transmission_config["password"]
+        self.rpc_path = rpc_path or transmission_config["rpc_path"]
+        self.timeout = timeout
+        self.session_id = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}{self.rpc_path}"
+
+    async def torrent_get(self, fields):
+        """
+        Fetch the given fields for every torrent in a single call.
+        :param fields: List of torrent field names, e.g. ["downloadDir", "percentDone"].
+        :return: List of torrent dicts.
+        """
+        arguments = await self.request("torrent-get", {"fields": fields})
+        return arguments.get("torrents", [])
+
+    async def request(self, method, arguments=None):
+        """
+        Call an RPC method and return its arguments.
+        """
+        payload = json.dumps({"method": method, "arguments": arguments or {}}).encode()
+        response = await asyncio.to_thread(self._post, payload)
+        if response.get("result") != "success":
+            raise TransmissionError(f"Transmission RPC '{method}' failed: {response.get('result')}")
+        return response.get("arguments", {})
+
+    def _post(self, payload, retry_count=0):
+        headers = {"Content-Type": "application/json"}
+        if self.session_id:
+            headers[SESSION_ID_HEADER] = self.session_id
+        if self.username:
+            credentials = base64.b64encode(f"{self.username}:{self.password}".encode()).decode()
+            headers["Authorization"] = f"Basic {credentials}"
+
+        request = urllib.request.Request(self.url, data=payload, headers=headers, method="POST")
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read().decode())
+        except urllib.error.HTTPError as e:
+            # Transmission rejects requests without a current session id and hands out a new one.
+            if e.code == 409 and retry_count < 1:
+                self.session_id = e.headers.get(SESSION_ID_HEADER)
+                log.debug("Negotiated a new Transmission RPC session id.")
+                return self._post(payload, retry_count + 1)
+            if e.code == 401:
+                raise TransmissionError("Transmission RPC rejected the configured credentials.") from e
+            raise TransmissionError(f"Transmission RPC returned HTTP {e.code}.") from e
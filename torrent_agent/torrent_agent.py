@@ -1,21 +1,25 @@
 import asyncio
 import glob
 import os
-from pathlib import Path
+import signal
 
 from torrent_agent.common import logger
-from torrent_agent.common.constants import BROWSER_FRIENDLY_VIDEO_FILETYPES, IMAGE_FILETYPES, NON_BROWSER_FRIENDLY_VIDEO_FILETYPES
 from torrent_agent.common.metrics import MetricEmitter
 from torrent_agent.database.cache.images_cache import ImagesRepositoryCache
 from torrent_agent.database.cache.shows_cache import ShowsRepositoryCache
 from torrent_agent.database.cache.video_conversions_cache import VideoConversionsRepositoryCache
 from torrent_agent.database.cache.videos_cache import VideosRepositoryCache
-from torrent_agent.database.database_connector import DatabaseConnector
+from torrent_agent.database.database_connector import create_database_connector
 from torrent_agent.database.images_repository import ImagesRepository
 from torrent_agent.database.shows_repository import ShowsRepository
 from torrent_agent.database.video_conversions_repository import VideoConversionsRepository
 from torrent_agent.database.videos_repository import VideosRepository
 from torrent_agent.image.image_processor import ImageProcessor
+from torrent_agent.scan.file_pipeline import FilePipeline
+from torrent_agent.scan.ingest_server import IngestServer
+from torrent_agent.scan.media_watcher import MediaWatcher
+from torrent_agent.scan.scan_manifest import ScanManifest
+from torrent_agent.scan.stability_tracker import DownloadStabilityTracker
 from torrent_agent.thumbnail.thumbnail_generator import ThumbnailGenerator
 from torrent_agent.torrent.torrent_manager import TorrentManager
 from torrent_agent.video.video_conversion_queue import VideoConversionQueue
@@ -25,83 +29,176 @@ from torrent_agent.common.configuration import Configuration  # Import the Confi
 metric_emitter = MetricEmitter()
 log = logger.get_logger()
 
-connection = DatabaseConnector()
+connection = create_database_connector()
 video_repository = VideosRepositoryCache(VideosRepository(connection))
 image_repository = ImagesRepositoryCache(ImagesRepository(connection))
 shows_repository = ShowsRepositoryCache(ShowsRepository(connection))
 conversion_repository = VideoConversionsRepositoryCache(VideoConversionsRepository(connection))
-torrent_manager = TorrentManager(shows_repository)
 configuration = Configuration()
+scan_manifest = ScanManifest()
+torrent_manager = TorrentManager(shows_repository, scan_manifest=scan_manifest)
+stability_tracker = DownloadStabilityTracker(completion_provider=torrent_manager.get_download_status)
+thumbnail_generator = ThumbnailGenerator(video_repository, image_repository)
+video_conversion_queue = VideoConversionQueue(video_repository, conversion_repository, thumbnail_generator=thumbnail_generator)
 
-async def main():
-    video_conversion_queue = VideoConversionQueue(video_repository,conversion_repository)
-    video_processor = VideoProcessor(video_conversion_queue, video_repository, conversion_repository)
+# Working directories of segmented transcodes, stream jobs and HLS output are ignored too.
+IGNORED_PATHS = ["/mnt/ext1/mariadb_data", "/.segments_", "/.stream_jobs/", ".hls/"]
+cycle_lock = asyncio.Lock()
+
+def expand_watched_paths(paths):
+    """
+    Adds the show folder of every changed TV file so new episodes reach the show handler.
+    """
+    expanded = set(paths)
+    tv_root = os.path.join(configuration.get_media_directory(), "torrents", "tv")
+    for path in paths:
+        relative_path = os.path.relpath(path, tv_root)
+        if not relative_path.startswith(".."):
+            expanded.add(os.path.join(tv_root, relative_path.split(os.sep)[0]))
+    return sorted(expanded)
+
+async def main(paths=None):
+    """
+    Runs one processing cycle. With no paths the whole media directory is scanned,
+    otherwise only the given paths are processed.
+    """
+    video_processor = VideoProcessor(video_conversion_queue, video_repository, conversion_repository, stability_tracker)
     image_processor = ImageProcessor(image_repository)
-    thumbnail_generator = ThumbnailGenerator(video_repository, image_repository)
-
-    async def video_conversion_worker():
-        """
-        Worker task to process video conversion tasks from the queue.
-        """
-        try:
-            await video_conversion_queue.process_queue()
-        except Exception as e:
-            log.error(f"Error while processing video conversion queue: {e}", exc_info=True)
-
-    for file_path in glob.glob(f"{configuration.get_media_directory()}/**/*.*", recursive=True):
-        # Skip ignored paths
-        if "/mnt/ext1/mariadb_data" in file_path:
-            log.debug(f"Skipping ignored path: {file_path}")
-            continue
-        
-        # Skip directories
-        if not os.path.isfile(file_path):
-            log.debug(f"Checking if directory is a TV show: {file_path}")
-            await torrent_manager.add_show_to_database(file_path)
-            log.debug(f"Skipping directory: {file_path}")
-            continue
-
-        file_name = Path(file_path).stem
-        log.info("Processing file: " + file_name)
-
-        try:
-            extension = "." + file_path.split(".")[-1].lower()
-            if extension in NON_BROWSER_FRIENDLY_VIDEO_FILETYPES or extension in BROWSER_FRIENDLY_VIDEO_FILETYPES:
-                if torrent_manager.is_tv_show_downloading(file_name):
-                    log.info(f"Show '{file_name}' is still downloading. Skipping.")
-                    continue
-                await video_processor.process_video(file_name, file_path)
-
-                if not configuration.is_remote_agent():
-                    await thumbnail_generator.generate_thumbnail(file_path, file_name)
-            elif extension in IMAGE_FILETYPES:
-                await image_processor.process_image(file_name, file_path)
-            else:
-                log.info(f"File '{file_name}' of type '{extension}' is not a supported format. Skipping.")
-                continue
-        except Exception as e:
-            log.error(f"An error occurred while processing file '{file_name}': {e}", exc_info=True)
-            continue
-    
-    asyncio.create_task(video_conversion_worker())
-    # Wait for all video conversions to complete
-    await video_conversion_queue.queue.join()
+
+    await torrent_manager.refresh_torrent_index()
+
+    full_scan = paths is None
+    if full_scan:
+        # Pick up conversions left behind by a restart or by an agent that stopped renewing its lease.
+        await video_conversion_queue.restore()
+        paths = glob.glob(f"{configuration.get_media_directory()}/**/*.*", recursive=True)
+
+    pipeline = FilePipeline(
+        video_processor,
+        image_processor,
+        thumbnail_generator,
+        torrent_manager,
+        scan_manifest,
+        ignored_paths=IGNORED_PATHS,
+    )
+    await pipeline.run(paths)
+
+    if full_scan:
+        scan_manifest.prune(pipeline.seen_paths)
+    scan_manifest.save()
+    metric_emitter.scan_files_skipped.inc(pipeline.files_skipped)
+    metric_emitter.scan_files_processed.inc(pipeline.files_processed)
+    log.info(f"Scan complete: {pipeline.files_processed} files processed, {pipeline.files_skipped} unchanged files skipped.")
+
+async def wait_for_conversions():
+    """
+    Conversion workers start with the first queued job; wait for them to finish.
+    """
+    try:
+        await video_conversion_queue.drain()
+    except Exception as e:
+        log.error(f"Error while processing video conversion queue: {e}", exc_info=True)
     log.info("All video conversions completed.")
-        
-if __name__ == "__main__":
-    log.info("Starting home media torrent util agent...")
 
-    async def run_agent():
+async def restore_expired_leases():
+    """
+    A crash leaves this agent's conversions 'converting' under a lease that is still fresh when
+    it starts again, so the first scan can't reclaim them. Restore again once those leases have
+    run out rather than leaving them until the next full scan.
+    """
+    await asyncio.sleep(configuration.get_conversion_lease_seconds())
+    try:
+        async with cycle_lock:
+            await video_conversion_queue.restore()
+    except Exception as e:
+        log.error(f"Failed to restore conversions with expired leases: {e}", exc_info=True)
+
+async def run_cycle(paths=None):
+    async with cycle_lock:
+        with metric_emitter.agent_runs_cycles_duration.time():
+            try:
+                await main(paths)
+                log.info("Completed processing.")
+                metric_emitter.agent_runs_cycles.inc()
+            except Exception as e:
+                log.error(f"An error occurred: {e}", exc_info=True)
+                metric_emitter.agent_runs_cycles_failed.inc()
+
+    # Conversions can take hours, so only full scans wait for them, and outside the lock:
+    # ingest and watch cycles only cover the scan and database work, and run meanwhile.
+    if paths is None:
+        await wait_for_conversions()
+
+async def ingest_torrent(path):
+    """
+    Runs a completed torrent (a file or a directory) through the handlers straight away.
+    """
+    paths = [path]
+    if os.path.isdir(path):
+        paths += glob.glob(f"{glob.escape(path)}/**/*", recursive=True)
+    await run_cycle(expand_watched_paths(paths))
+
+async def run_agent():
+    watcher = None
+    ingest_server = None
+
+    # systemd stops the service with SIGTERM; cancel cleanly so running ffmpeg processes are killed.
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+
+    async def process_watched_paths(paths):
+        await run_cycle(expand_watched_paths(paths))
+        # Files that are still settling won't raise another event, so look at them again
+        # once they have had time to go quiet.
+        pending_paths = stability_tracker.pending_paths()
+        if pending_paths:
+            asyncio.get_running_loop().call_later(
+                stability_tracker.quiet_period_seconds,
+                lambda: [watcher.push(path) for path in pending_paths],
+            )
+
+    if configuration.is_watch_mode_enabled():
+        watcher = MediaWatcher(
+            configuration.get_media_directory(),
+            process_watched_paths,
+            debounce_seconds=configuration.get_watch_debounce_seconds(),
+            ignored_paths=IGNORED_PATHS,
+        )
+        watcher.start()
+
+    if configuration.is_ingest_server_enabled() and not configuration.is_remote_agent():
+        host, port = configuration.get_ingest_server_address()
+        ingest_server = IngestServer(ingest_torrent, configuration.get_media_directory(), host, port)
+        await ingest_server.start()
+
+    restore_task = asyncio.create_task(restore_expired_leases())
+    full_scan_interval = configuration.get_full_scan_interval_seconds()
+    try:
         while True:
-            with metric_emitter.agent_runs_cycles_duration.time():
-                try:
-                    await main()
-                    log.info("Completed processing.")
-                    metric_emitter.agent_runs_cycles.inc()
-                except Exception as e:
-                    log.error(f"An error occurred: {e}", exc_info=True)
-                    metric_emitter.agent_runs_cycles_failed.inc()
-                await asyncio.sleep(300)
-
-    asyncio.run(run_agent())
+            await run_cycle()
+            if watcher is None:
+                await asyncio.sleep(full_scan_interval)
+                continue
+
+            # Watched paths are processed as they arrive; a full scan runs as a safety net
+            # on the interval or straight away if the watcher lost events.
+            try:
+                await asyncio.wait_for(watcher.rescan_requested.wait(), timeout=full_scan_interval)
+            except asyncio.TimeoutError:
+                pass
+            watcher.rescan_requested.clear()
+    finally:
+        restore_task.cancel()
+        if watcher is not None:
+            watcher.stop()
+        if ingest_server is not None:
+            await ingest_server.stop()
+        await video_conversion_queue.stop()
+        if hasattr(connection, "close"):
+            await connection.close()
 
+if __name__ == "__main__":
+    log.info("Starting home media torrent util agent...")
+    try:
+        asyncio.run(run_agent())
+    except asyncio.CancelledError:
+        log.info("Agent stopped.")
\ No newline at end of file
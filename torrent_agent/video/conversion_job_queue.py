@@ -0,0 +1,188 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import OrderedDict
+
+from torrent_agent.common import logger
+from torrent_agent.common.metrics import MetricEmitter
+
+log = logger.get_logger()
+metric_emitter = MetricEmitter()
+
+# Finished jobs kept for status lookups; the least recently looked up go first.
+FINISHED_ENTRIES_KEPT = 1000
+
+class ConversionJobQueue:
+    """
+    Priority queue of conversion entries with O(1) lookup by input path and video id.
+    Pending entries are ordered by the scheduler's sort key (FIFO without a scheduler) in a
+    heap; removed and reprioritized entries are dropped from the heap lazily. Pending and
+    in-progress entries stay indexed until they finish or are removed; finished entries move
+    to a bounded LRU, so the status of recent jobs can still be looked up without the index
+    growing with every file the agent has converted.
+
+    The get/task_done/join/empty/qsize methods behave like asyncio.Queue.
+    """
+
+    def __init__(self, scheduler=None, finished_limit: int = FINISHED_ENTRIES_KEPT):
+        """
+        :param scheduler: ConversionScheduler deciding the order jobs run in.
+        :param finished_limit: Most finished entries kept for lookups.
+        """
+        self.scheduler = scheduler
+        self.finished_limit = finished_limit
+        # In enqueue order, so the oldest pending entry is the first one.
+        self._pending = OrderedDict()
+        self._heap = []
+        self._counter = itertools.count()
+        self._by_input_file = {}
+        self._by_video_id = {}
+        self._finished = OrderedDict()
+        self._finished_by_video_id = {}
+        self._not_empty = asyncio.Event()
+        self._all_done = asyncio.Event()
+        self._all_done.set()
+        self._unfinished = 0
+        metric_emitter.conversion_queue_depth.set_function(self.qsize)
+        metric_emitter.conversion_queue_oldest_age.set_function(self.oldest_age)
+
+    def put_nowait(self, entry) -> bool:
+        """
+        Add an entry to the back of the queue.
+        Returns False without adding it if a job for the same input file is already pending or in progress.
+        """
+        existing = self._by_input_file.get(entry.input_file)
+        if existing is not None and not (existing.is_converted or existing.is_failed):
+            log.info(f"Conversion for '{entry.input_file}' is already queued. Skipping.")
+            return False
+        if existing is not None:
+            self._unindex(existing)
+        self._forget_finished(entry.input_file)
+
+        entry.enqueued_at = time.monotonic()
+        self._pending[entry.input_file] = entry
+        self._push(entry, self.scheduler.sort_key(entry) if self.scheduler else entry.enqueued_at)
+        self._by_input_file[entry.input_file] = entry
+        if entry.video_id is not None:
+            self._by_video_id[entry.video_id] = entry
+        self._unfinished += 1
+        self._all_done.clear()
+        self._not_empty.set()
+        return True
+
+    async def put(self, entry) -> bool:
+        return self.put_nowait(entry)
+
+    async def get(self):
+        """
+        Remove and return the entry at the front of the queue, waiting until one is available.
+        """
+        while not self._pending:
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        while True:
+            heap_item = heapq.heappop(self._heap)
+            entry = heap_item[2]
+            # Skip heap items left behind by remove() and reprioritize().
+            if entry.heap_item is heap_item:
+                entry.heap_item = None
+                del self._pending[entry.input_file]
+                return entry
+
+    def task_done(self, entry=None):
+        """
+        :param entry: The finished entry. It moves from the index to the finished entries.
+        """
+        if self._unfinished <= 0:
+            raise ValueError("task_done() called too many times")
+        if entry is not None and self._by_input_file.get(entry.input_file) is entry:
+            self._unindex(entry)
+            self._remember_finished(entry)
+        self._unfinished -= 1
+        if self._unfinished == 0:
+            self._all_done.set()
+
+    async def join(self):
+        await self._all_done.wait()
+
+    def empty(self):
+        return not self._pending
+
+    def qsize(self):
+        return len(self._pending)
+
+    def get_entry(self, input_file: str):
+        entry = self._by_input_file.get(input_file)
+        if entry is None:
+            entry = self._finished.get(input_file)
+            if entry is not None:
+                self._finished.move_to_end(input_file)
+        return entry
+
+    def get_entry_by_video_id(self, video_id: int):
+        entry = self._by_video_id.get(video_id)
+        if entry is None:
+            entry = self._finished_by_video_id.get(video_id)
+            if entry is not None:
+                self._finished.move_to_end(entry.input_file)
+        return entry
+
+    def remove(self, input_file: str):
+        """
+        Remove a job from the queue and the index. A pending job is dropped without being run.
+        Returns the removed entry, or None if the queue didn't know about it.
+        """
+        entry = self._by_input_file.get(input_file)
+        if entry is None:
+            return self._forget_finished(input_file)
+        if self._pending.pop(input_file, None) is not None:
+            entry.heap_item = None
+            self.task_done()
+        self._unindex(entry)
+        return entry
+
+    def reprioritize(self, input_file: str) -> bool:
+        """
+        Move a pending job to the front of the queue. Returns False if it isn't pending.
+        """
+        entry = self._pending.get(input_file)
+        if entry is None:
+            return False
+        self._push(entry, float("-inf"))
+        return True
+
+    def _push(self, entry, sort_key):
+        # Lower keys come out first; the counter keeps equal keys in FIFO order.
+        entry.heap_item = (sort_key, next(self._counter), entry)
+        heapq.heappush(self._heap, entry.heap_item)
+
+    def oldest_age(self):
+        """
+        Returns how many seconds the oldest pending job has been waiting.
+        """
+        if not self._pending:
+            return 0
+        return time.monotonic() - next(iter(self._pending.values())).enqueued_at
+
+    def _unindex(self, entry):
+        if self._by_input_file.get(entry.input_file) is entry:
+            del self._by_input_file[entry.input_file]
+        if entry.video_id is not None and self._by_video_id.get(entry.video_id) is entry:
+            del self._by_video_id[entry.video_id]
+
+    def _remember_finished(self, entry):
+        self._forget_finished(entry.input_file)
+        self._finished[entry.input_file] = entry
+        if entry.video_id is not None:
+            self._finished_by_video_id[entry.video_id] = entry
+        while len(self._finished) > self.finished_limit:
+            _, evicted = self._finished.popitem(last=False)
+            if evicted.video_id is not None and self._finished_by_video_id.get(evicted.video_id) is evicted:
+                del self._finished_by_video_id[evicted.video_id]
+
+    def _forget_finished(self, input_file: str):
+        entry = self._finished.pop(input_file, None)
+        if entry is not None and entry.video_id is not None and self._finished_by_video_id.get(entry.video_id) is entry:
+            del self._finished_by_video_id[entry.video_id]
+        return entry
@@ -0,0 +1,121 @@
+import os
+import time
+
+from torrent_agent.common import logger
+from torrent_agent.common.configuration import Configuration
+from torrent_agent.common.metrics import MetricEmitter
+from torrent_agent.video.video_probe import CONVERSION_AUDIO_TRANSCODE, CONVERSION_FULL_TRANSCODE, CONVERSION_REMUX
+
+log = logger.get_logger()
+metric_emitter = MetricEmitter()
+configuration = Configuration()
+
+POLICY_SHORTEST_JOB_FIRST = "sjf"
+POLICY_NEWEST_FIRST = "newest"
+POLICY_ENTERTAINMENT_TYPE = "type"
+POLICIES = [POLICY_SHORTEST_JOB_FIRST, POLICY_NEWEST_FIRST, POLICY_ENTERTAINMENT_TYPE]
+
+# Relative cost of each conversion path per second of 1080p video.
+MODE_COST_FACTORS = {
+    CONVERSION_REMUX: 0.02,
+    CONVERSION_AUDIO_TRANSCODE: 0.05,
+    CONVERSION_FULL_TRANSCODE: 1.0,
+}
+REFERENCE_PIXELS = 1920 * 1080
+# Used to guess the duration of files that couldn't be probed.
+FALLBACK_BYTES_PER_SECOND = 1_000_000
+# Extra cost given to each lower entertainment type tier by the type policy.
+TYPE_TIER_SECONDS = 4 * 3600
+
+class ConversionScheduler:
+    """
+    Orders conversion jobs by a policy and tracks how long it takes for queued videos to
+    become playable.
+
+    Every job gets a static sort key: its policy score in seconds plus aging_factor times the
+    time it was queued. Subtracting the same aging_factor * now from every key leaves their
+    order unchanged, so a job's effective score drops by aging_factor for each second it has
+    waited without the queue having to re-sort. A job can therefore only be overtaken for a
+    bounded time, which prevents starvation.
+    """
+
+    def __init__(self, policy: str = None, aging_factor: float = None, type_priority: list = None):
+        """
+        :param policy: One of "sjf" (shortest estimated encode first), "newest" (most recently
+            downloaded first) or "type" (by entertainment type, shortest first within a type).
+        :param aging_factor: Seconds of score a job gains for every second it waits. 0 disables aging.
+        :param type_priority: Entertainment types in priority order, used by the "type" policy.
+        """
+        self.policy = policy or configuration.get_conversion_scheduling_policy()
+        if self.policy not in POLICIES:
+            log.warning(f"Unknown conversion scheduling policy '{self.policy}', using '{POLICY_SHORTEST_JOB_FIRST}'.")
+            self.policy = POLICY_SHORTEST_JOB_FIRST
+        self.aging_factor = configuration.get_conversion_aging_factor() if aging_factor is None else aging_factor
+        self.type_priority = type_priority or configuration.get_conversion_type_priority()
+        self.completed = 0
+        self.total_time_to_playable = 0.0
+        metric_emitter.conversion_mean_time_to_playable.set_function(self.mean_time_to_playable)
+
+    def sort_key(self, entry) -> float:
+        """
+        Returns the key the queue sorts on; the job with the lowest key runs first.
+        """
+        return self.score(entry) + self.aging_factor * entry.enqueued_at
+
+    def score(self, entry) -> float:
+        if self.policy == POLICY_NEWEST_FIRST:
+            return self.content_age(entry)
+        if self.policy == POLICY_ENTERTAINMENT_TYPE:
+            return self.type_tier(entry) * TYPE_TIER_SECONDS + self.estimate_cost(entry)
+        return self.estimate_cost(entry)
+
+    def estimate_cost(self, entry) -> float:
+        """
+        Estimates the work needed to convert a job, in seconds of 1080p transcoding.
+        """
+        probe = entry.probe
+        if probe is not None and probe.duration:
+            pixels = (probe.width * probe.height) / REFERENCE_PIXELS if probe.width and probe.height else 1.0
+            return probe.duration * max(pixels, 0.1) * MODE_COST_FACTORS[probe.conversion_mode()]
+        try:
+            return os.path.getsize(entry.input_file) / FALLBACK_BYTES_PER_SECOND
+        except OSError:
+            return 0.0
+
+    def content_age(self, entry) -> float:
+        try:
+            return max(0.0, time.time() - os.path.getmtime(entry.input_file))
+        except OSError:
+            return 0.0
+
+    def type_tier(self, entry) -> int:
+        entertainment_type = entertainment_type_of(entry.input_file)
+        if entertainment_type in self.type_priority:
+            return self.type_priority.index(entertainment_type)
+        return len(self.type_priority)
+
+    def record_playable(self, entry):
+        """
+        Record that a queued video has become playable.
+        """
+        time_to_playable = time.monotonic() - entry.enqueued_at
+        self.completed += 1
+        self.total_time_to_playable += time_to_playable
+        metric_emitter.conversion_time_to_playable.labels(policy=self.policy).observe(time_to_playable)
+
+    def mean_time_to_playable(self) -> float:
+        """
+        Returns the mean number of seconds between queuing a video and it becoming playable.
+        """
+        if not self.completed:
+            return 0.0
+        return self.total_time_to_playable / self.completed
+
+def entertainment_type_of(file_path: str) -> str:
+    """
+    Returns the folder under torrents/ a file lives in, e.g. "tv" or "movies".
+    """
+    parts = file_path.split("/")
+    if "torrents" in parts and parts.index("torrents") + 1 < len(parts) - 1:
+        return parts[parts.index("torrents") + 1]
+    return None
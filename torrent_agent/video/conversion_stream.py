@@ -0,0 +1,201 @@
+import asyncio
+import time
+from collections import deque
+
+from torrent_agent.common import logger
+from torrent_agent.common.configuration import Configuration
+from torrent_agent.common.metrics import MetricEmitter
+from torrent_agent.database.cache.redis_connector import RedisConnector
+
+log = logger.get_logger()
+metric_emitter = MetricEmitter()
+configuration = Configuration()
+
+JOBS_STREAM = "conversions:jobs"
+RESULTS_STREAM = "conversions:results"
+WORKERS_GROUP = "converters"
+RESULTS_GROUP = "control"
+# Results are only kept for visibility; the control agent acks them as it records them.
+RESULTS_MAX_LENGTH = 10000
+# Entries read per XREADGROUP when going through this consumer's pending list.
+PENDING_READ_COUNT = 100
+
+STATUS_COMPLETED = "completed"
+STATUS_FAILED = "failed"
+
+class ConversionStream:
+    """
+    Conversion work queue shared by the control agent and the remote agents, on Redis Streams.
+
+    Jobs are added to the jobs stream and read by every agent through one consumer group,
+    one job per free conversion worker, so faster hosts take more of the work. A job stays in
+    the group's pending list until its worker acks it; workers renew it while converting and
+    take over jobs that have been idle for longer than the lease, which is how the jobs of a
+    dead worker are retried. A job delivered more than max_deliveries times is given up on.
+    Workers report every job on the results stream, which the control agent reads with its
+    own consumer group to record the outcome.
+    """
+
+    def __init__(self, redis_connector: RedisConnector = None, consumer: str = None, lease_seconds: int = None, max_deliveries: int = None, block_seconds: float = None):
+        """
+        :param consumer: Name of this agent in the consumer groups.
+        :param lease_seconds: How long a job may go without being renewed before another worker takes it.
+        :param max_deliveries: Deliveries after which a job is reported as failed instead of retried.
+        :param block_seconds: How long a read waits for a new job.
+        """
+        stream_config = configuration.get_conversion_stream_config()
+        self.redis = redis_connector or RedisConnector()
+        self.consumer = consumer or stream_config["consumer"]
+        self.lease_seconds = lease_seconds or configuration.get_conversion_lease_seconds()
+        self.max_deliveries = max_deliveries or stream_config["max_deliveries"]
+        self.block_seconds = block_seconds or stream_config["block_seconds"]
+        self._groups_created = False
+        self._own_pending_read = False
+        self._own_pending_lock = asyncio.Lock()
+        self._own_pending = deque()
+        self._last_stale_claim = 0.0
+
+    async def setup(self):
+        if not self._groups_created:
+            await self.redis.xgroup_create(JOBS_STREAM, WORKERS_GROUP)
+            await self.redis.xgroup_create(RESULTS_STREAM, RESULTS_GROUP)
+            self._groups_created = True
+
+    async def publish(self, fields: dict) -> str:
+        """
+        Add a job to the stream.
+        :return: The job id.
+        """
+        await self.setup()
+        job_id = await self.redis.xadd(JOBS_STREAM, {key: str(value) for key, value in fields.items() if value is not None})
+        metric_emitter.conversion_stream_jobs.labels(event="published").inc()
+        return job_id
+
+    async def next_job(self):
+        """
+        Returns the next (job id, fields) for this agent, or None if no job arrived in time.
+        Jobs this consumer was given before a restart come first, then jobs abandoned by other
+        workers, then new jobs.
+        """
+        await self.setup()
+        # Every worker of this agent shares the consumer, so its pending list is read once and
+        # each job handed to one worker; reading it per worker gives them all the same first job.
+        if not self._own_pending_read:
+            async with self._own_pending_lock:
+                if not self._own_pending_read:
+                    self._own_pending.extend(await self._read_own_pending())
+                    self._own_pending_read = True
+        while self._own_pending:
+            job_id, fields = self._own_pending.popleft()
+            if await self._still_owned(job_id):
+                await self.renew(job_id)
+                metric_emitter.conversion_stream_jobs.labels(event="resumed").inc()
+                return job_id, fields
+
+        now = time.monotonic()
+        if now - self._last_stale_claim >= self.lease_seconds / 3:
+            self._last_stale_claim = now
+            job = await self._claim_stale()
+            if job is not None:
+                return job
+
+        job = await self._read(">", block=int(self.block_seconds * 1000))
+        if job is not None:
+            metric_emitter.conversion_stream_jobs.labels(event="read").inc()
+        return job
+
+    async def renew(self, job_id: str):
+        """
+        Reset the idle time of a job this worker is converting so nobody else takes it over.
+        """
+        await self.redis.xclaim(JOBS_STREAM, WORKERS_GROUP, self.consumer, 0, [job_id], justid=True)
+
+    async def finish(self, job_id: str, fields: dict, status: str, **result):
+        """
+        Report a job's outcome on the results stream and ack it.
+        :param fields: The job's fields, copied into the result.
+        :param status: STATUS_COMPLETED or STATUS_FAILED.
+        :param result: Extra fields for the result, e.g. the error message.
+        """
+        entry = dict(fields, job_id=job_id, status=status, worker=self.consumer, finished_at=time.time(), **result)
+        await self.redis.xadd(RESULTS_STREAM, {key: str(value) for key, value in entry.items() if value is not None}, maxlen=RESULTS_MAX_LENGTH)
+        await self.redis.xack(JOBS_STREAM, WORKERS_GROUP, job_id)
+        # Finished jobs are deleted so the stream only holds outstanding work.
+        await self.redis.xdel(JOBS_STREAM, job_id)
+        metric_emitter.conversion_stream_jobs.labels(event=status).inc()
+
+    async def read_results(self, count: int = 10):
+        """
+        Returns the next results for the control agent as (result id, fields) pairs.
+        """
+        await self.setup()
+        response = await self.redis.xreadgroup(RESULTS_GROUP, self.consumer, {RESULTS_STREAM: ">"}, count=count, block=int(self.block_seconds * 1000))
+        return [message for _, messages in response or [] for message in messages]
+
+    async def ack_result(self, result_id: str):
+        await self.redis.xack(RESULTS_STREAM, RESULTS_GROUP, result_id)
+
+    async def queued_input_files(self) -> set:
+        """
+        Returns the input files of every job that hasn't finished yet.
+        """
+        await self.setup()
+        return {fields.get("input_file") for _, fields in await self.redis.xrange(JOBS_STREAM) if fields}
+
+    async def pending_count(self) -> int:
+        """
+        Returns the number of jobs read by a worker and not yet finished.
+        """
+        summary = await self.redis.xpending(JOBS_STREAM, WORKERS_GROUP)
+        return int(summary["pending"])
+
+    async def _read_own_pending(self) -> list:
+        """
+        Returns every job this consumer was given and hasn't acked, oldest first.
+        """
+        jobs = []
+        start_id = "0"
+        while True:
+            response = await self.redis.xreadgroup(WORKERS_GROUP, self.consumer, {JOBS_STREAM: start_id}, count=PENDING_READ_COUNT)
+            messages = [message for _, messages in response or [] for message in messages]
+            if not messages:
+                return jobs
+            for job_id, fields in messages:
+                # Entries trimmed from the stream come back without fields.
+                if fields:
+                    jobs.append((job_id, fields))
+                else:
+                    await self.redis.xack(JOBS_STREAM, WORKERS_GROUP, job_id)
+            start_id = messages[-1][0]
+
+    async def _still_owned(self, job_id: str) -> bool:
+        # A resumed job waits for a free worker and may have been taken over by another agent meanwhile.
+        pending = await self.redis.xpending_range(JOBS_STREAM, WORKERS_GROUP, job_id, job_id, 1, consumername=self.consumer)
+        return bool(pending)
+
+    async def _read(self, start_id: str, block: int = None):
+        response = await self.redis.xreadgroup(WORKERS_GROUP, self.consumer, {JOBS_STREAM: start_id}, count=1, block=block)
+        for _, messages in response or []:
+            for job_id, fields in messages:
+                # Entries trimmed from the stream come back without fields.
+                if fields:
+                    return job_id, fields
+                await self.redis.xack(JOBS_STREAM, WORKERS_GROUP, job_id)
+        return None
+
+    async def _claim_stale(self):
+        _, messages, *_ = await self.redis.xautoclaim(JOBS_STREAM, WORKERS_GROUP, self.consumer, int(self.lease_seconds * 1000), count=1)
+        for job_id, fields in messages:
+            pending = await self.redis.xpending_range(JOBS_STREAM, WORKERS_GROUP, job_id, job_id, 1)
+            deliveries = pending[0]["times_delivered"] if pending else 1
+            if not fields:
+                await self.redis.xack(JOBS_STREAM, WORKERS_GROUP, job_id)
+                continue
+            if deliveries > self.max_deliveries:
+                log.error(f"Conversion job {job_id} for '{fields.get('input_file')}' was abandoned {deliveries - 1} times. Giving up on it.")
+                await self.finish(job_id, fields, STATUS_FAILED, error_message=f"Abandoned by {deliveries - 1} workers")
+                continue
+            log.warning(f"Taking over conversion job {job_id} for '{fields.get('input_file')}' after its worker stopped renewing it.")
+            metric_emitter.conversion_stream_jobs.labels(event="reclaimed").inc()
+            return job_id, fields
+        return None
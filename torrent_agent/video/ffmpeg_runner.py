@@ -0,0 +1,175 @@
+import asyncio
+import os
+import signal
+import time
+from collections import deque
+
+from torrent_agent.common import logger
+from torrent_agent.common.metrics import MetricEmitter
+
+log = logger.get_logger()
+metric_emitter = MetricEmitter()
+
+STDERR_TAIL_LINES = 20
+
+class FFmpegError(RuntimeError):
+    def __init__(self, message: str, returncode: int = None, stderr_tail: str = ""):
+        super().__init__(f"{message}: {stderr_tail}" if stderr_tail else message)
+        self.returncode = returncode
+        self.stderr_tail = stderr_tail
+
+class FFmpegTimeoutError(FFmpegError):
+    """
+    Raised when ffmpeg is killed because it stalled or ran past its time budget.
+    """
+    pass
+
+class FFmpegProgress:
+    """
+    Latest state reported by ffmpeg on its -progress output.
+    """
+
+    def __init__(self, duration: float = None):
+        self.duration = duration
+        self.out_time = 0.0
+        self.fps = 0.0
+        self.speed = 0.0
+        self.finished = False
+
+    def update(self, key: str, value: str):
+        try:
+            if key == "out_time_us" or key == "out_time_ms":
+                # Despite its name, out_time_ms is also in microseconds.
+                self.out_time = max(0.0, int(value) / 1_000_000)
+            elif key == "fps":
+                self.fps = float(value)
+            elif key == "speed":
+                self.speed = float(value.rstrip("x"))
+            elif key == "progress":
+                self.finished = value == "end"
+        except ValueError:
+            # ffmpeg reports N/A until it has output something.
+            pass
+
+    def eta(self):
+        """
+        Returns the estimated number of seconds left, or None if it can't be estimated yet.
+        """
+        if not self.duration or self.speed <= 0:
+            return None
+        return max(0.0, (self.duration - self.out_time) / self.speed)
+
+async def run_ffmpeg(command: list, duration: float = None, stall_timeout: float = None, time_budget: float = None):
+    """
+    Run an ffmpeg command, publishing its progress as per-job gauges.
+
+    ffmpeg is killed if its output position doesn't advance for stall_timeout seconds,
+    if it runs longer than time_budget seconds, or if the calling task is cancelled.
+    :param command: Full command line; may be wrapped by nice/ionice. -progress is added after "ffmpeg".
+    :param duration: Duration of the input in seconds, used for the ETA.
+    :param stall_timeout: Seconds without progress before ffmpeg is killed. None disables stall detection.
+    :param time_budget: Maximum wall-clock seconds for the whole run. None means no limit.
+    :raises FFmpegTimeoutError: If ffmpeg stalled or ran out of time.
+    :raises FFmpegError: If ffmpeg exited with a non-zero status.
+    """
+    ffmpeg_index = next(index for index, arg in enumerate(command) if os.path.basename(arg) == "ffmpeg")
+    command = command[:ffmpeg_index + 1] + ["-nostats", "-progress", "pipe:1"] + command[ffmpeg_index + 1:]
+    job = os.path.basename(command[-1])
+
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        # Own process group, so a kill reaches anything ffmpeg was wrapped in or spawned.
+        start_new_session=True,
+    )
+    stderr_tail = deque(maxlen=STDERR_TAIL_LINES)
+    stderr_reader = asyncio.create_task(_read_stderr(process.stderr, stderr_tail))
+    progress = FFmpegProgress(duration)
+    started_at = last_advance = time.monotonic()
+    last_out_time = -1.0
+
+    try:
+        while True:
+            now = time.monotonic()
+            timeouts = []
+            if stall_timeout:
+                timeouts.append(last_advance + stall_timeout - now)
+            if time_budget:
+                timeouts.append(started_at + time_budget - now)
+            timeout = max(0.0, min(timeouts)) if timeouts else None
+
+            try:
+                line = await asyncio.wait_for(process.stdout.readline(), timeout)
+            except asyncio.TimeoutError:
+                line = None
+            if line == b"":
+                break
+
+            now = time.monotonic()
+            if line:
+                key, _, value = line.decode(errors="replace").strip().partition("=")
+                progress.update(key, value.strip())
+                if progress.out_time > last_out_time:
+                    last_out_time = progress.out_time
+                    last_advance = now
+                if key == "progress":
+                    _publish(job, progress)
+
+            if time_budget and now - started_at >= time_budget:
+                await _kill(process, job, "budget")
+                raise FFmpegTimeoutError(f"ffmpeg exceeded its {time_budget:.0f}s time budget", stderr_tail="\n".join(stderr_tail))
+            if stall_timeout and now - last_advance >= stall_timeout:
+                await _kill(process, job, "stall")
+                raise FFmpegTimeoutError(f"ffmpeg made no progress for {stall_timeout:.0f}s", stderr_tail="\n".join(stderr_tail))
+
+        returncode = await process.wait()
+        await stderr_reader
+        if returncode != 0:
+            raise FFmpegError(f"ffmpeg exited with status {returncode}", returncode, "\n".join(stderr_tail))
+    except asyncio.CancelledError:
+        await _kill(process, job, "cancelled")
+        raise
+    finally:
+        if process.returncode is None:
+            _kill_group(process)
+        stderr_reader.cancel()
+        _clear(job)
+
+async def _read_stderr(stream: asyncio.StreamReader, tail: deque):
+    # Keep draining stderr so ffmpeg never blocks on a full pipe.
+    while True:
+        line = await stream.readline()
+        if not line:
+            return
+        tail.append(line.decode(errors="replace").rstrip())
+
+async def _kill(process, job: str, reason: str):
+    if process.returncode is not None:
+        return
+    log.warning(f"Killing ffmpeg for '{job}' ({reason}).")
+    metric_emitter.conversion_ffmpeg_killed.labels(reason=reason).inc()
+    _kill_group(process)
+    await process.wait()
+
+def _kill_group(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+def _publish(job: str, progress: FFmpegProgress):
+    metric_emitter.conversion_progress_fps.labels(job=job).set(progress.fps)
+    metric_emitter.conversion_progress_speed.labels(job=job).set(progress.speed)
+    eta = progress.eta()
+    if eta is not None:
+        metric_emitter.conversion_progress_eta.labels(job=job).set(eta)
+
+def _clear(job: str):
+    # Drop finished jobs so the gauges only show conversions that are running.
+    for gauge in (metric_emitter.conversion_progress_fps, metric_emitter.conversion_progress_speed, metric_emitter.conversion_progress_eta):
+        try:
+            gauge.remove(job)
+        except KeyError:
+            pass
@@ -0,0 +1,196 @@
+import asyncio
+import os
+import shutil
+
+from torrent_agent.common import logger
+from torrent_agent.common.configuration import Configuration
+from torrent_agent.common.metrics import MetricEmitter
+from torrent_agent.remote.transfer_manager import TransferManager
+from torrent_agent.video.ffmpeg_runner import run_ffmpeg
+from torrent_agent.video.video_probe import VideoProbe, probe_video
+
+log = logger.get_logger()
+metric_emitter = MetricEmitter()
+configuration = Configuration()
+transfer_manager = TransferManager()
+
+# The output may differ from the source by up to this many seconds, or this fraction of its duration.
+DURATION_TOLERANCE_SECONDS = 1.0
+DURATION_TOLERANCE_RATIO = 0.005
+
+class SegmentedTranscodeError(RuntimeError):
+    pass
+
+class SegmentedTranscoder:
+    """
+    Transcodes a long video by splitting it into segments at keyframes and encoding the
+    segments at the same time on local workers and remote hosts.
+
+    1. The first video stream, not counting cover art, is split with stream copy. ffmpeg only cuts at keyframes, so
+       segments decode on their own.
+    2. Each segment is encoded without audio by whichever worker is free. Remote workers send
+       the segment to a host from REMOTE_AGENT_HOSTS; a segment a host fails on goes back to
+       the local workers.
+    3. The first audio stream is encoded once, alongside the video, so there are no gaps
+       at segment boundaries.
+    4. The encoded segments and the audio are joined with the concat demuxer using stream
+       copy, with faststart applied.
+    5. The output's duration and stream counts are checked against the source.
+    """
+
+    def __init__(self, local_workers: int = None, segment_count: int = None, hosts: list = None):
+        """
+        :param local_workers: Number of segments encoded locally at once.
+        :param segment_count: Number of segments to split into. Defaults to twice the number of workers.
+        :param hosts: Remote hosts to encode segments on. Defaults to the configured remote hosts.
+        """
+        segmented_config = configuration.get_segmented_conversion_config()
+        self.local_workers = local_workers or segmented_config["local_workers"]
+        if hosts is None:
+            hosts = [] if configuration.is_remote_agent() else configuration.get_remote_hosts()
+        self.hosts = hosts
+        self.segment_count = segment_count or segmented_config["segments"] or 2 * (self.local_workers + len(self.hosts))
+        self.min_duration = segmented_config["min_duration"]
+        self.enabled = segmented_config["enabled"]
+
+    def should_segment(self, probe: VideoProbe) -> bool:
+        return self.enabled and probe is not None and probe.duration >= self.min_duration and self.segment_count > 1
+
+    async def transcode(self, input_file: str, output_file: str, probe: VideoProbe, video_args: list, audio_args: list, image_output_args: list = None, stall_timeout: float = None, time_budget: float = None):
+        """
+        Transcode input_file into output_file.
+        :param probe: Result of probe_video for the input.
+        :param video_args: ffmpeg video encoding options used for every segment.
+        :param audio_args: ffmpeg audio encoding options.
+        :param image_output_args: Extra ffmpeg outputs (thumbnails) taken from the source while it is read.
+        :raises SegmentedTranscodeError: If a step fails or the output doesn't match the source.
+        """
+        output_dir, output_name = os.path.split(output_file)
+        stem = os.path.splitext(output_name)[0]
+        work_dir = os.path.join(output_dir, f".segments_{stem}")
+        await asyncio.to_thread(os.makedirs, work_dir, exist_ok=True)
+        try:
+            image_output_args = image_output_args or []
+            # The source is read twice: once to split the video and once for the audio. The images
+            # are taken in the audio pass, or the split if there is no audio.
+            segments = await self._split(input_file, work_dir, stem, probe.duration, [] if probe.audio_streams else image_output_args)
+            log.info(f"Split '{input_file}' into {len(segments)} segments.")
+
+            audio_file = None
+            audio_task = None
+            if probe.audio_streams:
+                audio_file = os.path.join(work_dir, f"{stem}.audio.m4a")
+                audio_task = asyncio.create_task(run_ffmpeg(
+                    ["ffmpeg", "-y", "-i", input_file] + image_output_args + ["-map", "0:a:0", "-vn", "-sn", "-dn"] + audio_args + [audio_file],
+                    duration=probe.duration,
+                    stall_timeout=stall_timeout,
+                    time_budget=time_budget,
+                ))
+            try:
+                encoded = await self._encode_segments(segments, video_args, stall_timeout, time_budget)
+                if audio_task:
+                    await audio_task
+            finally:
+                if audio_task and not audio_task.done():
+                    audio_task.cancel()
+                    await asyncio.gather(audio_task, return_exceptions=True)
+
+            await self._concat(encoded, audio_file, work_dir, stem, output_file, stall_timeout)
+            await self.verify(probe, output_file)
+        finally:
+            await asyncio.to_thread(shutil.rmtree, work_dir, True)
+
+    async def verify(self, source: VideoProbe, output_file: str):
+        """
+        Check the output has the source's duration, one video stream, and audio if the source had it.
+        """
+        output = await probe_video(output_file)
+        tolerance = max(DURATION_TOLERANCE_SECONDS, source.duration * DURATION_TOLERANCE_RATIO)
+        if abs(output.duration - source.duration) > tolerance:
+            raise SegmentedTranscodeError(f"Output duration {output.duration:.2f}s doesn't match the source's {source.duration:.2f}s")
+        expected_audio_streams = min(source.audio_streams, 1)
+        if output.video_streams != 1 or output.audio_streams != expected_audio_streams:
+            raise SegmentedTranscodeError(
+                f"Output has {output.video_streams} video and {output.audio_streams} audio streams, expected 1 and {expected_audio_streams}"
+            )
+
+    async def _split(self, input_file, work_dir, stem, duration, image_output_args):
+        pattern = os.path.join(work_dir, f"{stem}.part%03d.mkv")
+        await run_ffmpeg(["ffmpeg", "-y", "-i", input_file] + image_output_args + [
+            "-map", "0:V:0", "-an", "-sn", "-dn", "-c", "copy",
+            "-f", "segment", "-segment_time", f"{duration / self.segment_count:.3f}",
+            "-reset_timestamps", "1", "-avoid_negative_ts", "make_zero",
+            pattern,
+        ], duration=duration)
+        segments = sorted(
+            os.path.join(work_dir, name) for name in os.listdir(work_dir)
+            if name.startswith(f"{stem}.part") and name.endswith(".mkv")
+        )
+        if not segments:
+            raise SegmentedTranscodeError(f"Splitting '{input_file}' produced no segments")
+        return segments
+
+    async def _encode_segments(self, segments, video_args, stall_timeout, time_budget):
+        pending = asyncio.Queue()
+        for segment in segments:
+            pending.put_nowait(segment)
+        encoded = {}
+
+        async def local_worker():
+            while not pending.empty():
+                segment = pending.get_nowait()
+                output = self._encoded_path(segment)
+                await run_ffmpeg(
+                    ["ffmpeg", "-y", "-i", segment, "-map", "0:V:0", "-an"] + video_args + [output],
+                    stall_timeout=stall_timeout,
+                    time_budget=time_budget,
+                )
+                encoded[segment] = output
+                metric_emitter.conversion_segments.labels(host="local").inc()
+
+        async def remote_worker(host):
+            while not pending.empty():
+                segment = pending.get_nowait()
+                output = self._encoded_path(segment)
+                try:
+                    await transfer_manager.encode_remote(host, segment, output, ["-map", "0:V:0", "-an"] + video_args, time_budget)
+                except Exception as e:
+                    # Leave the segment to the other workers and stop using this host for this file.
+                    log.warning(f"Encoding segment '{segment}' on {host} failed, retrying elsewhere: {e}")
+                    metric_emitter.conversion_segments_failed.labels(host=host).inc()
+                    pending.put_nowait(segment)
+                    return
+                encoded[segment] = output
+                metric_emitter.conversion_segments.labels(host=host).inc()
+
+        workers = [asyncio.create_task(local_worker()) for _ in range(self.local_workers)]
+        workers += [asyncio.create_task(remote_worker(host)) for host in self.hosts]
+        try:
+            await asyncio.gather(*workers)
+            # Segments handed back by a failing host after the local workers finished.
+            if not pending.empty():
+                await local_worker()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+        return [encoded[segment] for segment in segments]
+
+    async def _concat(self, encoded, audio_file, work_dir, stem, output_file, stall_timeout):
+        concat_list = os.path.join(work_dir, f"{stem}.concat.txt")
+        with open(concat_list, "w") as file:
+            for segment in encoded:
+                escaped = segment.replace("'", "'\\''")
+                file.write(f"file '{escaped}'\n")
+
+        command = ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", concat_list]
+        if audio_file:
+            command += ["-i", audio_file, "-map", "0:V:0", "-map", "1:a:0"]
+        else:
+            command += ["-map", "0:V:0"]
+        command += ["-c", "copy", "-movflags", "+faststart", output_file]
+        await run_ffmpeg(command, stall_timeout=stall_timeout)
+
+    @staticmethod
+    def _encoded_path(segment):
+        return segment[:-len(".mkv")] + ".x264.mp4"
@@ -1,27 +1,49 @@
 import asyncio
+import os
+import shutil
+import time
 
 from torrent_agent.common import logger
 from torrent_agent.common.metrics import MetricEmitter
 from torrent_agent.common.utils import file_name_to_cdn_path
 from torrent_agent.database.dao.video_conversion_dao import IVideoConversionsDAO
 from torrent_agent.database.dao.video_dao import IVideosDAO
+from torrent_agent.model.video_conversion import VideoConversion
+from torrent_agent.remote.host_scheduler import LOCAL_HOST, HostScheduler
 from torrent_agent.remote.remote_processor import RemoteProcessor
-from torrent_agent.video.video_converter import VideoConverter
+from torrent_agent.remote.transfer_manager import TransferManager
+from torrent_agent.thumbnail.thumbnail_generator import ThumbnailGenerator
+from torrent_agent.video.conversion_job_queue import ConversionJobQueue
+from torrent_agent.video.conversion_scheduler import ConversionScheduler
+from torrent_agent.video.conversion_stream import STATUS_COMPLETED, STATUS_FAILED, ConversionStream
+from torrent_agent.video.video_converter import OUTPUT_FORMAT_MP4, VideoConverter
+from torrent_agent.video.video_probe import probe_video
 from torrent_agent.common.configuration import Configuration
 
 log = logger.get_logger()
 metric_emitter = MetricEmitter()
 remote_processor = RemoteProcessor()  
+transfer_manager = TransferManager()
 configuration = Configuration()
 
+# Remote agents download the inputs of stream jobs into this directory under ~/conversions.
+STREAM_WORK_DIR = ".stream_jobs"
+
 class VideoConversionQueueEntry:
-    def __init__(self, video_id: int, input_file: str, output_file: str):
+    def __init__(self, video_id: int, input_file: str, output_file: str, conversion_id: int = None):
         self.video_id = video_id
         self.input_file = input_file
         self.output_file = output_file
+        self.conversion_id = conversion_id
         self.is_converted = False
         self.is_failed = False
         self.error_message = None
+        self.enqueued_at = None
+        self.probe = None
+        self.cost = 0.0
+        self.heap_item = None
+        self.is_playable = False
+        self.job_id = None
 
     def mark_as_converted(self):
         self.is_converted = True
@@ -34,45 +56,220 @@ class VideoConversionQueueEntry:
     
     def __str__(self):
         status = "Converted" if self.is_converted else "Failed" if self.is_failed else "Pending"
-        return f"VideoConversionQueueEntry(input_file={self.input_file}, output_file={self.output_file}, status={status}, error_message={self.error_message})"
+        return f"VideoConversionQueueEntry(conversion_id={self.conversion_id}, input_file={self.input_file}, output_file={self.output_file}, status={status}, error_message={self.error_message})"
+
+    @classmethod
+    def from_conversion(cls, conversion: VideoConversion):
+        return cls(conversion.original_video_id, conversion.original_filename, conversion.converted_filename, conversion_id=conversion.id)
+
+    def to_job_fields(self):
+        return {
+            "conversion_id": self.conversion_id,
+            "video_id": self.video_id,
+            "input_file": self.input_file,
+            "output_file": self.output_file,
+        }
+
+    @classmethod
+    def from_job(cls, job_id: str, fields: dict):
+        entry = cls(
+            int(fields["video_id"]) if fields.get("video_id") else None,
+            fields["input_file"],
+            fields["output_file"],
+            conversion_id=int(fields["conversion_id"]) if fields.get("conversion_id") else None,
+        )
+        entry.job_id = job_id
+        return entry
 
 class VideoConversionQueue:
+    """
+    Conversion jobs are persisted in the video_conversions table so they survive a restart.
+    A job is claimed (pending -> converting) before it is run and its lease is renewed while
+    ffmpeg runs; restore() hands abandoned leases back to pending and requeues them.
+
+    With the "redis" queue backend, jobs are published to a ConversionStream instead and the
+    workers of every agent pull them from there. The stream holds the leases; the control
+    agent records the results the other agents report.
+    """
     _instance = None
 
-    def __init__(self, video_repository: IVideosDAO, conversion_repository: IVideoConversionsDAO):
-        self.queue = asyncio.Queue()
-        self.converter = VideoConverter()
+    def __init__(self, video_repository: IVideosDAO, conversion_repository: IVideoConversionsDAO, worker_count: int = None, threads_per_encode: int = None, thumbnail_generator: ThumbnailGenerator = None):
+        """
+        :param worker_count: Number of concurrent local encodes. Defaults to the configured value.
+        :param threads_per_encode: ffmpeg threads per encode. Defaults to the configured value.
+        :param thumbnail_generator: Registers the thumbnails written during conversion. Without it,
+            thumbnails are left to the separate thumbnail pass.
+        """
+        self.scheduler = ConversionScheduler()
+        self.queue = ConversionJobQueue(self.scheduler)
+        self.worker_count = worker_count or configuration.get_conversion_workers()
+        self.converter = VideoConverter(threads=threads_per_encode or configuration.get_conversion_threads_per_encode())
         self.video_repository = video_repository
+        self.thumbnail_generator = thumbnail_generator
         self.conversion_dao = conversion_repository
-        self.remote_requests_left = len(configuration.get_remote_hosts())
+        self.host_scheduler = HostScheduler(remote_processor)
+        self.lease_seconds = configuration.get_conversion_lease_seconds()
+        self.workers = []
+        self.busy_workers = 0
+        self.stream = ConversionStream() if configuration.get_conversion_queue_backend() == "redis" else None
+        self.results_consumer = None
+        # Stream jobs converted for another host are sent back as a single file.
+        self.stream_job_converter = VideoConverter(threads=self.converter.threads, output_format=OUTPUT_FORMAT_MP4)
 
     async def add_to_queue(self, video_conversion_entry: VideoConversionQueueEntry):
-        if not configuration.is_remote_agent():
-            if self.remote_requests_left > 0:
-                log.info(f"Adding {str(video_conversion_entry)} to remote conversion queue.")
-                remote_processor.process_file(video_conversion_entry.input_file)
-                self.remote_requests_left -= 1
+        if self.is_queued(video_conversion_entry.input_file):
+            log.info(f"{str(video_conversion_entry)} is already queued. Skipping.")
+            return
+
+        if self.stream is not None:
+            await self._add_conversion_record(video_conversion_entry)
+            await self._publish(video_conversion_entry)
+            return
+
+        await self._probe(video_conversion_entry)
+        video_conversion_entry.cost = self.scheduler.estimate_cost(video_conversion_entry)
+        if not configuration.is_remote_agent() and configuration.get_remote_hosts():
+            host = await self.host_scheduler.choose_host(video_conversion_entry.cost, self._input_size(video_conversion_entry))
+            if host != LOCAL_HOST and await self._dispatch_remote(video_conversion_entry, host):
                 return
-            else:
-                log.warning("No remote requests left, skipping remote conversion.")
-                self.remote_requests_left = len(configuration.get_remote_hosts())
         
+        await self._add_conversion_record(video_conversion_entry)
+        self._enqueue(video_conversion_entry)
+
+    async def _add_conversion_record(self, video_conversion_entry: VideoConversionQueueEntry):
         # Add conversion to the database using the DAO
-        conversion = {
-            "original_video_id": video_conversion_entry.video_id,  # Assuming input_file is the ID
-            "original_filename": video_conversion_entry.input_file,
-            "converted_filename": video_conversion_entry.output_file,
-            "conversion_status": "pending",
-            "error_message": None
-        }
+        conversion = VideoConversion(
+            original_video_id=video_conversion_entry.video_id,
+            original_filename=video_conversion_entry.input_file,
+            converted_filename=video_conversion_entry.output_file,
+            conversion_status="pending",
+        )
         try:
-            await self.conversion_dao.add_conversion(conversion)
+            video_conversion_entry.conversion_id = await self.conversion_dao.add_conversion(conversion)
             log.info(f"Added conversion record for {str(video_conversion_entry)} to the database.")
         except Exception as e:
             log.error(f"Failed to add conversion record for {str(video_conversion_entry)} to the database: {e}")
-        
-        await self.queue.put(video_conversion_entry)
+
+    async def _publish(self, video_conversion_entry: VideoConversionQueueEntry) -> bool:
+        """
+        Add a job to the conversion stream. If Redis is unavailable the conversion stays pending
+        in the database and restore() publishes it on the next full scan.
+        """
+        try:
+            video_conversion_entry.job_id = await self.stream.publish(video_conversion_entry.to_job_fields())
+        except Exception as e:
+            log.error(f"Failed to publish {str(video_conversion_entry)} to the conversion stream: {e}", exc_info=True)
+            return False
+        log.info(f"Published {str(video_conversion_entry)} to the conversion stream as job {video_conversion_entry.job_id}.")
+        self.start_workers()
+        return True
+
+    async def _dispatch_remote(self, video_conversion_entry: VideoConversionQueueEntry, host: str) -> bool:
+        """
+        Hand a file to a remote host. Returns False if it has to be converted locally instead.
+        """
+        log.info(f"Sending {str(video_conversion_entry)} to remote host {host}.")
+        size_bytes = self._input_size(video_conversion_entry)
+        started = time.monotonic()
+        try:
+            sent = await transfer_manager.send(video_conversion_entry.input_file, host)
+        except Exception as e:
+            log.error(f"Failed to send {str(video_conversion_entry)} to remote host {host}: {e}", exc_info=True)
+            sent = False
+        if not sent:
+            log.warning(f"Could not send {str(video_conversion_entry)} to remote host {host}, converting it locally.")
+            return False
+        self.host_scheduler.record_dispatch(host, video_conversion_entry.cost, size_bytes, time.monotonic() - started)
+        return True
+
+    @staticmethod
+    def _input_size(video_conversion_entry: VideoConversionQueueEntry) -> int:
+        try:
+            return os.path.getsize(video_conversion_entry.input_file)
+        except OSError:
+            return 0
+
+    async def restore(self) -> int:
+        """
+        Requeue the conversions left in the database by a previous run. Leases that haven't been
+        renewed in time are reclaimed first. Conversions whose input isn't on this host are left
+        for the agent that has it.
+        Returns the number of requeued conversions.
+        """
+        if self.stream is not None:
+            return await self._restore_stream()
+        try:
+            await self.conversion_dao.reclaim_stale_conversions(self.lease_seconds)
+            conversions = await self.conversion_dao.get_conversions_by_status(["pending"])
+        except Exception as e:
+            log.error(f"Failed to load pending conversions from the database: {e}", exc_info=True)
+            return 0
+
+        restored = 0
+        for conversion in conversions:
+            video_conversion_entry = VideoConversionQueueEntry.from_conversion(conversion)
+            if self.is_queued(video_conversion_entry.input_file):
+                continue
+            if os.path.exists(video_conversion_entry.input_file):
+                # ffmpeg can't pick up a half-written output, so the conversion starts over.
+                temp_output_file = VideoConverter.temp_output_path(video_conversion_entry.output_file)
+                if os.path.exists(temp_output_file):
+                    log.info(f"Removing partial output '{temp_output_file}' of an interrupted conversion.")
+                    await asyncio.to_thread(os.remove, temp_output_file)
+                await self._probe(video_conversion_entry)
+                if self._enqueue(video_conversion_entry):
+                    restored += 1
+            elif self.converter.is_output_complete(video_conversion_entry.output_file):
+                # The previous run finished the file but stopped before recording it.
+                log.info(f"Conversion of {str(video_conversion_entry)} finished before the restart. Recording it as completed.")
+                video_conversion_entry.mark_as_converted()
+                await self._complete(video_conversion_entry)
+            else:
+                log.debug(f"Neither the input nor the output of {str(video_conversion_entry)} is on this host. Leaving it.")
+
+        if restored:
+            log.info(f"Restored {restored} conversion(s) from the database.")
+        return restored
+
+    async def _restore_stream(self) -> int:
+        # Leases are kept by the stream, so only conversions that never made it onto it are published.
+        try:
+            conversions = await self.conversion_dao.get_conversions_by_status(["pending"])
+            queued_input_files = await self.stream.queued_input_files()
+        except Exception as e:
+            log.error(f"Failed to load pending conversions: {e}", exc_info=True)
+            return 0
+
+        restored = 0
+        for conversion in conversions:
+            video_conversion_entry = VideoConversionQueueEntry.from_conversion(conversion)
+            if video_conversion_entry.input_file in queued_input_files or not os.path.exists(video_conversion_entry.input_file):
+                continue
+            if await self._publish(video_conversion_entry):
+                restored += 1
+        if restored:
+            log.info(f"Published {restored} pending conversion(s) to the conversion stream.")
+        return restored
+
+    async def _probe(self, video_conversion_entry: VideoConversionQueueEntry):
+        """
+        Probe the input so the scheduler can estimate the job's cost and the converter
+        doesn't have to probe it again.
+        """
+        try:
+            video_conversion_entry.probe = await probe_video(video_conversion_entry.input_file)
+        except Exception as e:
+            log.warning(f"Could not probe {str(video_conversion_entry)}, scheduling it by file size: {e}")
+
+    def _enqueue(self, video_conversion_entry: VideoConversionQueueEntry) -> bool:
+        if not video_conversion_entry.cost:
+            video_conversion_entry.cost = self.scheduler.estimate_cost(video_conversion_entry)
+        if not self.queue.put_nowait(video_conversion_entry):
+            return False
+        self.host_scheduler.record_dispatch(LOCAL_HOST, video_conversion_entry.cost)
         log.info(f"Added {str(video_conversion_entry)} to conversion queue.")
+        self.start_workers()
+        return True
     
     async def get(self):
         if not self.queue.empty():
@@ -82,48 +279,340 @@ class VideoConversionQueue:
             return None
     
     async def get_entry(self, input_file: str) -> VideoConversionQueueEntry:
-        temp_queue = asyncio.Queue()
-        target_entry = None
+        return self.queue.get_entry(input_file)
+
+    async def get_entry_by_video_id(self, video_id: int) -> VideoConversionQueueEntry:
+        return self.queue.get_entry_by_video_id(video_id)
 
-        while not self.queue.empty():
-            entry = await self.queue.get()
-            if entry.input_file == input_file:
-                target_entry = entry
-            await temp_queue.put(entry)
+    def is_queued(self, input_file: str) -> bool:
+        """
+        Returns True if a conversion for the file is pending or in progress.
+        """
+        entry = self.queue.get_entry(input_file)
+        return entry is not None and not (entry.is_converted or entry.is_failed)
 
-        while not temp_queue.empty():
-            await self.queue.put(await temp_queue.get())
+    def remove(self, input_file: str) -> VideoConversionQueueEntry:
+        """
+        Drop a job from the queue. A job that is already converting keeps running.
+        """
+        entry = self.queue.get_entry(input_file)
+        was_pending = entry is not None and entry.heap_item is not None
+        removed = self.queue.remove(input_file)
+        if was_pending:
+            self.host_scheduler.record_completion(LOCAL_HOST, removed.cost)
+        return removed
 
-        return target_entry
+    def reprioritize(self, input_file: str) -> bool:
+        """
+        Move a pending job to the front of the queue.
+        """
+        return self.queue.reprioritize(input_file)
+
+    def start_workers(self):
+        """
+        Start the worker pool if it isn't running, so conversions begin as soon as the
+        first job is queued instead of after the scan has finished.
+        """
+        self.workers = [worker for worker in self.workers if not worker.done()]
+        worker = self._stream_worker if self.stream is not None else self._worker
+        for worker_id in range(len(self.workers), self.worker_count):
+            self.workers.append(asyncio.create_task(worker(str(worker_id)), name=f"conversion-worker-{worker_id}"))
+            log.debug(f"Started conversion worker {worker_id}.")
+        if self.stream is not None and not configuration.is_remote_agent() and (self.results_consumer is None or self.results_consumer.done()):
+            self.results_consumer = asyncio.create_task(self._consume_results(), name="conversion-results-consumer")
+
+    async def drain(self):
+        """
+        Wait for every queued conversion to finish, then stop the workers.
+        Stream workers keep pulling jobs instead; they are only started here.
+        """
+        if self.stream is not None:
+            self.start_workers()
+            return
+        if not self.queue.empty():
+            self.start_workers()
+        await self.queue.join()
+        await self.stop()
+
+    async def stop(self):
+        """
+        Cancel the workers straight away. Conversions in progress are abandoned.
+        """
+        tasks = self.workers + ([self.results_consumer] if self.results_consumer else [])
+        # Cleared first, so a job queued while the workers wind down starts a new pool.
+        self.workers = []
+        self.results_consumer = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
 
     async def process_queue(self):
-        while not self.queue.empty():
+        """
+        Convert everything in the queue with the worker pool and wait until it is done.
+        """
+        await self.drain()
+
+    async def _worker(self, worker_id: str):
+        while True:
             video_conversion_entry: VideoConversionQueueEntry = await self.queue.get()
+            metric_emitter.conversion_worker_busy.labels(worker=worker_id).set(1)
+            self.busy_workers += 1
+            started = time.monotonic()
+            converted = False
             try:
-                log.info(f"Converting {str(video_conversion_entry)}")
+                with metric_emitter.conversion_worker_job_duration.labels(worker=worker_id).time():
+                    converted = await self._convert(video_conversion_entry)
+                metric_emitter.conversion_worker_jobs.labels(worker=worker_id, status="completed" if converted else "failed").inc()
+            except asyncio.CancelledError:
+                log.warning(f"Conversion worker {worker_id} cancelled while converting {str(video_conversion_entry)}")
+                metric_emitter.conversion_worker_jobs.labels(worker=worker_id, status="cancelled").inc()
+                raise
+            finally:
+                elapsed = time.monotonic() - started if converted else None
+                self.host_scheduler.record_completion(LOCAL_HOST, video_conversion_entry.cost, elapsed, self.busy_workers)
+                self.busy_workers -= 1
+                metric_emitter.conversion_worker_busy.labels(worker=worker_id).set(0)
+                self.queue.task_done(video_conversion_entry)
+
+    async def _stream_worker(self, worker_id: str):
+        while True:
+            try:
+                job = await self.stream.next_job()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error(f"Conversion worker {worker_id} could not read from the conversion stream: {e}", exc_info=True)
+                await asyncio.sleep(self.stream.block_seconds)
+                continue
+            if job is None:
+                continue
+
+            job_id, fields = job
+            video_conversion_entry = VideoConversionQueueEntry.from_job(job_id, fields)
+            metric_emitter.conversion_worker_busy.labels(worker=worker_id).set(1)
+            try:
+                if os.path.exists(video_conversion_entry.input_file):
+                    converted = await self._convert(video_conversion_entry)
+                    await self.stream.finish(job_id, fields, STATUS_COMPLETED if converted else STATUS_FAILED, error_message=video_conversion_entry.error_message, recorded=1)
+                elif configuration.is_remote_agent():
+                    converted = await self._convert_stream_job(video_conversion_entry, fields)
+                else:
+                    log.error(f"Input of conversion job {job_id} is missing: {str(video_conversion_entry)}")
+                    converted = False
+                    await self.stream.finish(job_id, fields, STATUS_FAILED, error_message="Input file is missing")
+                metric_emitter.conversion_worker_jobs.labels(worker=worker_id, status="completed" if converted else "failed").inc()
+            except asyncio.CancelledError:
+                # The job stays on the stream and is picked up again when this agent restarts.
+                log.warning(f"Conversion worker {worker_id} cancelled while converting {str(video_conversion_entry)}")
+                metric_emitter.conversion_worker_jobs.labels(worker=worker_id, status="cancelled").inc()
+                raise
+            except Exception as e:
+                log.error(f"Conversion worker {worker_id} failed on job {job_id}, leaving it to be retried: {e}", exc_info=True)
+            finally:
+                metric_emitter.conversion_worker_busy.labels(worker=worker_id).set(0)
+
+    async def _convert_stream_job(self, video_conversion_entry: VideoConversionQueueEntry, fields: dict) -> bool:
+        """
+        Convert a stream job whose input is on the control host: download the input, convert
+        it here and upload the result to the job's output path. Transfer failures leave the
+        job on the stream to be retried; conversion failures are reported.
+        """
+        job_id = video_conversion_entry.job_id
+        control_host = configuration.get_control_agent_host()
+        work_dir = os.path.join(os.path.expanduser("~"), "conversions", STREAM_WORK_DIR, job_id.replace("-", "_"))
+        local_input = os.path.join(work_dir, os.path.basename(video_conversion_entry.input_file))
+        local_output = os.path.join(work_dir, os.path.basename(video_conversion_entry.output_file))
+        heartbeat = asyncio.create_task(self._heartbeat(video_conversion_entry))
+        try:
+            if not await transfer_manager.fetch(control_host, video_conversion_entry.input_file, local_input):
+                log.warning(f"Could not download the input of job {job_id} from {control_host}. Leaving it to be retried.")
+                return False
+            try:
+                log.info(f"Converting {str(video_conversion_entry)} for {control_host}")
                 with metric_emitter.file_conversion_duration.time():
-                    await self.converter.convert(video_conversion_entry.input_file, video_conversion_entry.output_file)
-                video_conversion_entry.mark_as_converted()
-                metric_emitter.files_converted.inc()
-                # Update the database with the converted status
-                await self.conversion_dao.update_conversion_status(
-                    conversion_id=video_conversion_entry.input_file,  
-                    status="completed"
-                )
-                await self.video_repository.update_video_details(
-                    video_id=video_conversion_entry.video_id,
-                    file_name=video_conversion_entry.output_file,
-                    cdn_path=file_name_to_cdn_path(video_conversion_entry.output_file),
-                    is_browser_friendly=True  
-                )
+                    await self.stream_job_converter.convert(local_input, local_output)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error(f"Failed to convert job {job_id}: {e}")
+                await self.stream.finish(job_id, fields, STATUS_FAILED, error_message=str(e))
+                return False
+            if not await transfer_manager.send(local_output, control_host, remote_path=video_conversion_entry.output_file):
+                log.warning(f"Could not upload the output of job {job_id} to {control_host}. Leaving it to be retried.")
+                return False
+            metric_emitter.files_converted.inc()
+            await self.stream.finish(job_id, fields, STATUS_COMPLETED, output_format=OUTPUT_FORMAT_MP4)
+            return True
+        finally:
+            heartbeat.cancel()
+            await asyncio.to_thread(shutil.rmtree, work_dir, True)
+
+    async def _consume_results(self):
+        """
+        Record the results that workers on other agents report on the conversion stream.
+        """
+        while True:
+            try:
+                for result_id, fields in await self.stream.read_results():
+                    await self._record_result(fields)
+                    await self.stream.ack_result(result_id)
+                metric_emitter.conversion_stream_pending.set(await self.stream.pending_count())
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
-                video_conversion_entry.mark_as_failed(str(e))
-                log.error(f"Failed to perform conversion, skipping:  {str(video_conversion_entry)}: {e}")
-                # Update the database with the failed status
-                await self.conversion_dao.update_conversion_status(
-                    conversion_id=video_conversion_entry.input_file,  
-                    status="failed",
-                    error_message=str(e)
+                log.error(f"Error while reading conversion results: {e}", exc_info=True)
+                await asyncio.sleep(self.stream.block_seconds)
+
+    async def _record_result(self, fields: dict):
+        if fields.get("recorded"):
+            # Converted by a worker on this host, which recorded it already.
+            return
+        video_conversion_entry = VideoConversionQueueEntry.from_job(fields.get("job_id"), fields)
+        if fields.get("status") == STATUS_COMPLETED:
+            log.info(f"{fields.get('worker')} converted {str(video_conversion_entry)}")
+            video_conversion_entry.mark_as_converted()
+            # Other agents always send back a single file, whatever this agent writes.
+            await self._complete(video_conversion_entry, video_conversion_entry.output_file)
+            if os.path.exists(video_conversion_entry.input_file):
+                await asyncio.to_thread(os.remove, video_conversion_entry.input_file)
+        else:
+            error_message = fields.get("error_message", "Conversion failed")
+            video_conversion_entry.mark_as_failed(error_message)
+            await self._update_status(video_conversion_entry, "failed", error_message)
+
+    async def _convert(self, video_conversion_entry: VideoConversionQueueEntry):
+        if not await self._claim(video_conversion_entry):
+            return False
+
+        thumbnail_file = preview_file = None
+        if self.thumbnail_generator is not None:
+            thumbnail_file = self.thumbnail_generator.thumbnail_path(video_conversion_entry.output_file, video_conversion_entry.video_id)
+            if configuration.is_preview_strip_enabled():
+                preview_file = self.thumbnail_generator.preview_strip_path(video_conversion_entry.output_file, video_conversion_entry.video_id)
+
+        heartbeat = asyncio.create_task(self._heartbeat(video_conversion_entry))
+        try:
+            log.info(f"Converting {str(video_conversion_entry)}")
+            with metric_emitter.file_conversion_duration.time():
+                await self.converter.convert(
+                    video_conversion_entry.input_file,
+                    video_conversion_entry.output_file,
+                    video_conversion_entry.probe,
+                    thumbnail_file=thumbnail_file,
+                    preview_file=preview_file,
+                    on_playable=lambda playlist_file: self._publish_playable(video_conversion_entry, playlist_file),
                 )
-            finally:
-                self.queue.task_done()
\ No newline at end of file
+            video_conversion_entry.mark_as_converted()
+            metric_emitter.files_converted.inc()
+            await self._complete(video_conversion_entry)
+            if thumbnail_file and os.path.exists(thumbnail_file):
+                # Saves the thumbnail pass from reading the converted file again.
+                try:
+                    await self.thumbnail_generator.register_thumbnail(video_conversion_entry.video_id, thumbnail_file)
+                except Exception as e:
+                    log.warning(f"Failed to register the thumbnail of {str(video_conversion_entry)}, the thumbnail pass will retry: {e}")
+            if not video_conversion_entry.is_playable and video_conversion_entry.enqueued_at is not None:
+                self.scheduler.record_playable(video_conversion_entry)
+            return True
+        except asyncio.CancelledError:
+            # Hand the job back so the next start picks it up without waiting for the lease to expire.
+            await self._update_status(video_conversion_entry, "pending")
+            await self._unpublish_playable(video_conversion_entry)
+            raise
+        except Exception as e:
+            await self._unpublish_playable(video_conversion_entry)
+            video_conversion_entry.mark_as_failed(str(e))
+            log.error(f"Failed to perform conversion, skipping:  {str(video_conversion_entry)}: {e}")
+            await self._update_status(video_conversion_entry, "failed", str(e))
+            return False
+        finally:
+            heartbeat.cancel()
+
+    async def _claim(self, video_conversion_entry: VideoConversionQueueEntry) -> bool:
+        """
+        Take the lease on a persisted conversion. Returns False if another agent already has it.
+        """
+        if video_conversion_entry.job_id is not None:
+            # The stream already gave this worker the job.
+            await self._update_status(video_conversion_entry, "converting")
+            return True
+        if video_conversion_entry.conversion_id is None:
+            return True
+        try:
+            claimed = await self.conversion_dao.claim_conversion(video_conversion_entry.conversion_id)
+        except Exception as e:
+            log.warning(f"Could not claim {str(video_conversion_entry)}, converting without a lease: {e}")
+            return True
+        if not claimed:
+            log.info(f"{str(video_conversion_entry)} is no longer pending. Skipping.")
+            video_conversion_entry.mark_as_failed("Conversion was claimed by another agent")
+        return claimed
+
+    async def _heartbeat(self, video_conversion_entry: VideoConversionQueueEntry):
+        if video_conversion_entry.conversion_id is None and video_conversion_entry.job_id is None:
+            return
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                if video_conversion_entry.job_id is not None:
+                    await self.stream.renew(video_conversion_entry.job_id)
+                else:
+                    await self.conversion_dao.heartbeat_conversion(video_conversion_entry.conversion_id)
+            except Exception as e:
+                log.warning(f"Failed to renew the lease on {str(video_conversion_entry)}: {e}")
+
+    async def _complete(self, video_conversion_entry: VideoConversionQueueEntry, final_output_file: str = None):
+        await self._update_status(video_conversion_entry, "completed")
+        final_output_file = final_output_file or self.converter.final_output_path(video_conversion_entry.output_file)
+        await self.video_repository.update_video_details(
+            video_id=video_conversion_entry.video_id,
+            file_name=final_output_file,
+            cdn_path=file_name_to_cdn_path(final_output_file),
+            is_browser_friendly=True  
+        )
+
+    async def _publish_playable(self, video_conversion_entry: VideoConversionQueueEntry, playlist_file: str):
+        """
+        Point the video at its HLS playlist as soon as the first segments exist.
+        """
+        try:
+            await self.video_repository.update_video_details(
+                video_id=video_conversion_entry.video_id,
+                file_name=playlist_file,
+                cdn_path=file_name_to_cdn_path(playlist_file),
+                is_browser_friendly=True
+            )
+        except Exception as e:
+            log.error(f"Failed to point {str(video_conversion_entry)} at its playlist: {e}")
+            return
+        video_conversion_entry.is_playable = True
+        self.scheduler.record_playable(video_conversion_entry)
+        log.info(f"{str(video_conversion_entry)} is playable from '{playlist_file}' while it converts.")
+
+    async def _unpublish_playable(self, video_conversion_entry: VideoConversionQueueEntry):
+        # The playlist of a failed or interrupted conversion is deleted; go back to the original file.
+        if not video_conversion_entry.is_playable:
+            return
+        video_conversion_entry.is_playable = False
+        try:
+            await self.video_repository.update_video_details(
+                video_id=video_conversion_entry.video_id,
+                file_name=video_conversion_entry.input_file,
+                cdn_path=file_name_to_cdn_path(video_conversion_entry.input_file),
+                is_browser_friendly=False
+            )
+        except Exception as e:
+            log.error(f"Failed to point {str(video_conversion_entry)} back at its original file: {e}")
+
+    async def _update_status(self, video_conversion_entry: VideoConversionQueueEntry, status: str, error_message: str = None):
+        if video_conversion_entry.conversion_id is None:
+            log.warning(f"{str(video_conversion_entry)} has no conversion record. Not recording status '{status}'.")
+            return
+        try:
+            await self.conversion_dao.update_conversion_status(
+                conversion_id=video_conversion_entry.conversion_id,
+                status=status,
+                error_message=error_message
+            )
+        except Exception as e:
+            log.error(f"Failed to record status '{status}' for {str(video_conversion_entry)}: {e}")
@@ -1,17 +1,33 @@
 import asyncio
-import subprocess
+import shutil
 from torrent_agent.common import logger
 from torrent_agent.common.configuration import Configuration
 from torrent_agent.common.metrics import MetricEmitter
+from torrent_agent.video.ffmpeg_runner import FFmpegTimeoutError, run_ffmpeg
+from torrent_agent.video.segmented_transcoder import SegmentedTranscoder
+from torrent_agent.video.video_probe import CONVERSION_AUDIO_TRANSCODE, CONVERSION_FULL_TRANSCODE, CONVERSION_REMUX, VideoProbe, probe_video
 import os
 
 log = logger.get_logger()
 metric_emitter = MetricEmitter()
 configuration = Configuration()
 
+PREVIEW_STRIP_FRAMES = 10
+PREVIEW_STRIP_FRAME_WIDTH = 160
+
+OUTPUT_FORMAT_MP4 = "mp4"
+OUTPUT_FORMAT_HLS = "hls"
+HLS_PLAYLIST_NAME = "index.m3u8"
+HLS_POLL_SECONDS = 1
+
 class VideoConverter:
     """
     A class to handle video file conversion using ffmpeg.
+    Each file is probed first so streams that are already browser-friendly are copied
+    instead of re-encoded. ffmpeg is killed if it stalls or runs past a time budget derived
+    from the probed duration.
+    With the HLS output format the video is written as fMP4 segments and a growing playlist
+    in a <name>.hls directory, so it can be played while it is still being converted.
     Attributes:
         input_file (str): The path to the input video file.
         output_file (str): The path to the output video file.
@@ -22,7 +38,143 @@ class VideoConverter:
             Deletes the input file after successful conversion and logs the completion.
     """
 
-    async def convert(self, input_file: str, output_file: str):
+    def __init__(self, threads: int = None, segmented_transcoder: SegmentedTranscoder = None, output_format: str = None):
+        """
+        :param threads: Number of threads each ffmpeg encode may use. None lets ffmpeg decide.
+        :param segmented_transcoder: Used for full transcodes of long videos when segmented conversion is enabled.
+        :param output_format: "mp4" or "hls". Defaults to the configured value.
+        """
+        self.threads = threads
+        self.segmented_transcoder = segmented_transcoder or SegmentedTranscoder()
+        self.output_format = output_format or configuration.get_conversion_output_format()
+
+    def build_output_args(self, mode: str):
+        """
+        Returns the ffmpeg output options for a conversion mode.
+        Only the first video and audio streams are kept; MP4 can't hold most MKV subtitle formats.
+        """
+        return self.build_stream_args(mode) + ["-movflags", "+faststart"]
+
+    def build_stream_args(self, mode: str):
+        # 0:V skips attached pictures: cover art is listed as a video stream and can come first.
+        args = ["-map", "0:V:0", "-map", "0:a:0?", "-sn", "-dn"]
+        if mode == CONVERSION_REMUX:
+            args += ["-c", "copy"]
+        elif mode == CONVERSION_AUDIO_TRANSCODE:
+            args += ["-c:v", "copy"] + self.audio_encode_args()
+        else:
+            args += self.video_encode_args() + self.audio_encode_args()
+        return args
+
+    def build_hls_output_args(self, mode: str, hls_dir: str):
+        """
+        Returns the ffmpeg output options for writing HLS with fMP4 segments. The playlist is an
+        event playlist: segments are appended as they are written and it is closed at the end.
+        """
+        segment_seconds = configuration.get_hls_segment_seconds()
+        args = self.build_stream_args(mode)
+        if mode == CONVERSION_FULL_TRANSCODE:
+            # Put a keyframe at every segment boundary so segments are the requested length.
+            args += ["-force_key_frames", f"expr:gte(t,n_forced*{segment_seconds})"]
+        return args + [
+            "-f", "hls",
+            "-hls_time", str(segment_seconds),
+            "-hls_playlist_type", "event",
+            "-hls_segment_type", "fmp4",
+            "-hls_fmp4_init_filename", "init.mp4",
+            "-hls_segment_filename", os.path.join(hls_dir, "segment_%05d.m4s"),
+            "-hls_flags", "independent_segments+temp_file",
+        ]
+
+    def build_image_output_args(self, probe: VideoProbe, thumbnail_file: str = None, preview_file: str = None):
+        """
+        Returns extra ffmpeg outputs that save the thumbnail (the middle frame) and a preview strip
+        (frames spread over the video, tiled in a row) from the frames decoded for the conversion.
+        Returns nothing if the duration isn't known.
+        """
+        if probe is None or not probe.duration:
+            return []
+        args = []
+        if thumbnail_file:
+            args += [
+                "-map", "0:V:0", "-an", "-sn", "-dn",
+                "-ss", f"{probe.duration / 2:.3f}", "-frames:v", "1", "-q:v", "2", "-update", "1",
+                thumbnail_file,
+            ]
+        if preview_file:
+            args += [
+                "-map", "0:V:0", "-an", "-sn", "-dn",
+                "-vf", f"fps={PREVIEW_STRIP_FRAMES}/{probe.duration:.3f},scale={PREVIEW_STRIP_FRAME_WIDTH}:-2,tile={PREVIEW_STRIP_FRAMES}x1",
+                "-frames:v", "1", "-q:v", "4", "-update", "1",
+                preview_file,
+            ]
+        return args
+
+    def video_encode_args(self):
+        args = [
+            "-c:v", "libx264",
+            "-preset", "medium",
+            "-crf", "23",
+            "-pix_fmt", "yuv420p",
+            "-profile:v", "baseline",  # Change to baseline for broader compatibility
+            "-level", "3.1",          # Lower level for older devices
+        ]
+        if self.threads:
+            args += ["-threads", str(self.threads)]
+        return args
+
+    def audio_encode_args(self):
+        return [
+            "-c:a", "aac",
+            "-b:a", "192k",           # Increase audio bitrate for better compatibility
+            "-ac", "2",
+        ]
+
+    def final_output_path(self, output_file: str) -> str:
+        """
+        Returns the file a finished conversion is played from: output_file, or the HLS playlist.
+        """
+        if self.output_format == OUTPUT_FORMAT_HLS:
+            return self.hls_playlist_path(output_file)
+        return output_file
+
+    def is_output_complete(self, output_file: str) -> bool:
+        """
+        Returns True if a conversion to output_file has finished writing.
+        """
+        if self.output_format != OUTPUT_FORMAT_HLS:
+            return os.path.exists(output_file)
+        try:
+            with open(self.hls_playlist_path(output_file)) as playlist:
+                return "#EXT-X-ENDLIST" in playlist.read()
+        except FileNotFoundError:
+            return False
+
+    @staticmethod
+    def hls_playlist_path(output_file: str) -> str:
+        return os.path.join(f"{os.path.splitext(output_file)[0]}.hls", HLS_PLAYLIST_NAME)
+
+    @staticmethod
+    def temp_output_path(output_file: str) -> str:
+        """
+        Returns the path ffmpeg writes to before the finished file is renamed to output_file.
+        """
+        dir_name, base_name = os.path.split(output_file)
+        return os.path.join(dir_name, f"converting_{base_name}")
+
+    async def convert(self, input_file: str, output_file: str, probe: VideoProbe = None, thumbnail_file: str = None, preview_file: str = None, on_playable=None):
+        """
+        Convert a video to a browser-friendly MP4 using the cheapest valid path for the file.
+        :param probe: Result of probe_video for the input, probed here if not given.
+        :param thumbnail_file: Where to save a thumbnail taken during a full transcode.
+        :param preview_file: Where to save a preview strip taken during a full transcode.
+        :param on_playable: Coroutine function called with the HLS playlist path once its first
+            segments are written. Only used with the HLS output format.
+        """
+        if self.output_format == OUTPUT_FORMAT_HLS:
+            return await self.convert_hls(input_file, output_file, probe, thumbnail_file, preview_file, on_playable)
+
+        temp_output_file = self.temp_output_path(output_file)
         try:
             # Check if the input file has "converting_" prefix
             if "converting_" in input_file:
@@ -30,35 +182,45 @@ class VideoConverter:
                 await asyncio.to_thread(os.remove, input_file)
                 return
 
-            dir_name, base_name = os.path.split(output_file)
-            temp_output_file = os.path.join(dir_name, f"converting_{base_name}")
-
-            command = [
-                "ffmpeg",
-                "-y",
-                "-i", input_file,
-                "-c:v", "libx264",
-                "-preset", "medium",
-                "-crf", "23",
-                "-pix_fmt", "yuv420p",
-                "-profile:v", "baseline",  # Change to baseline for broader compatibility
-                "-level", "3.1",          # Lower level for older devices
-                "-c:a", "aac",
-                "-b:a", "192k",           # Increase audio bitrate for better compatibility
-                "-ac", "2",
-                "-movflags", "+faststart",
-                temp_output_file
-            ]
+            if probe is None:
+                try:
+                    probe = await probe_video(input_file)
+                except Exception as e:
+                    log.warning(f"Could not probe '{input_file}', falling back to a full transcode: {e}")
+            mode = probe.conversion_mode() if probe else CONVERSION_FULL_TRANSCODE
+            metric_emitter.conversion_modes.labels(mode=mode).inc()
+
+            # Thumbnails only come from transcodes, where every frame is decoded anyway. Taking one
+            # during a stream copy would mean decoding the video just for the image.
+            image_output_args = []
+            if mode == CONVERSION_FULL_TRANSCODE:
+                image_output_args = self.build_image_output_args(probe, thumbnail_file, preview_file)
+            for image_file in (thumbnail_file, preview_file):
+                if image_output_args and image_file:
+                    await asyncio.to_thread(os.makedirs, os.path.dirname(image_file), exist_ok=True)
+
+            command = ["ffmpeg", "-y", "-i", input_file] + image_output_args + self.build_output_args(mode) + [temp_output_file]
             if not configuration.is_remote_agent:
                 command = ['nice', '-n', '15', 'ionice', '-c', '3'] + command
-            log.info(f"Conversion started: {' '.join(command)}")
+            duration = probe.duration if probe else None
+            stall_timeout = configuration.get_conversion_stall_timeout_seconds()
+            time_budget = configuration.get_conversion_time_budget(duration)
             with metric_emitter.file_conversion_duration.time():
-                # Offload the blocking subprocess call to a separate thread
-                await asyncio.to_thread(
-                    subprocess.run,
-                    command,
-                    check=True
-                )
+                if mode == CONVERSION_FULL_TRANSCODE and self.segmented_transcoder.should_segment(probe):
+                    log.info(f"Segmented conversion started: '{input_file}' -> '{temp_output_file}'")
+                    await self.segmented_transcoder.transcode(
+                        input_file,
+                        temp_output_file,
+                        probe,
+                        self.video_encode_args(),
+                        self.audio_encode_args(),
+                        image_output_args=image_output_args,
+                        stall_timeout=stall_timeout,
+                        time_budget=time_budget,
+                    )
+                else:
+                    log.info(f"Conversion started: {' '.join(command)}")
+                    await run_ffmpeg(command, duration=duration, stall_timeout=stall_timeout, time_budget=time_budget)
             metric_emitter.files_converted.inc()
 
             # Rename the temporary output file to the final output file
@@ -67,6 +229,17 @@ class VideoConverter:
             # Offload the file removal to a separate thread
             await asyncio.to_thread(os.remove, input_file)
             log.info(f"Conversion completed for file '{input_file}'")
+        except asyncio.CancelledError:
+            log.warning(f"Conversion of '{input_file}' was cancelled.")
+            if os.path.exists(temp_output_file):
+                os.remove(temp_output_file)
+            raise
+        except FFmpegTimeoutError as e:
+            # Retrying a conversion that hung or ran out of time would only tie the worker up again.
+            log.error(f"Failed to convert video '{input_file}' to '{output_file}': {e}")
+            if os.path.exists(temp_output_file):
+                await asyncio.to_thread(os.remove, temp_output_file)
+            raise
         except Exception as e:
             log.error(f"Failed to convert video '{input_file}' to '{output_file}': {e}", exc_info=True)
             try:
@@ -86,15 +259,81 @@ class VideoConverter:
                 if not configuration.is_remote_agent:
                     remux_command = ['nice', '-n', '15', 'ionice', '-c', '3'] + remux_command
                 log.info(f"Attempting remux operation: {' '.join(remux_command)}")
-                await asyncio.to_thread(
-                    subprocess.run,
-                    remux_command,
-                    check=True
-                )
+                await run_ffmpeg(remux_command, stall_timeout=configuration.get_conversion_stall_timeout_seconds())
                 log.info(f"Remux operation completed for file '{input_file}'")
             except Exception as remux_error:
                 log.error(f"Failed to perform remux operation on '{input_file}': {remux_error}", exc_info=True)
                 # Delete the temporary output file if it exists
                 if os.path.exists(temp_output_file):
                     await asyncio.to_thread(os.remove, temp_output_file)
-                raise e
\ No newline at end of file
+                raise e
+
+    async def convert_hls(self, input_file: str, output_file: str, probe: VideoProbe = None, thumbnail_file: str = None, preview_file: str = None, on_playable=None):
+        """
+        Convert a video to HLS next to output_file. Segmented transcoding isn't used, as the
+        playlist has to grow from the start of the video.
+        """
+        playlist_file = self.hls_playlist_path(output_file)
+        hls_dir = os.path.dirname(playlist_file)
+        # Segments left by an interrupted run can't be continued, so start again.
+        await asyncio.to_thread(shutil.rmtree, hls_dir, True)
+        await asyncio.to_thread(os.makedirs, hls_dir)
+        try:
+            if probe is None:
+                try:
+                    probe = await probe_video(input_file)
+                except Exception as e:
+                    log.warning(f"Could not probe '{input_file}', falling back to a full transcode: {e}")
+            mode = probe.conversion_mode() if probe else CONVERSION_FULL_TRANSCODE
+            metric_emitter.conversion_modes.labels(mode=mode).inc()
+
+            # There is no MP4 for the thumbnail pass to open, so the images are always taken here.
+            image_output_args = self.build_image_output_args(probe, thumbnail_file, preview_file)
+            for image_file in (thumbnail_file, preview_file):
+                if image_output_args and image_file:
+                    await asyncio.to_thread(os.makedirs, os.path.dirname(image_file), exist_ok=True)
+
+            command = ["ffmpeg", "-y", "-i", input_file] + image_output_args + self.build_hls_output_args(mode, hls_dir) + [playlist_file]
+            duration = probe.duration if probe else None
+            log.info(f"HLS conversion started: {' '.join(command)}")
+            first_segments = asyncio.create_task(self._wait_for_first_segments(playlist_file, on_playable))
+            try:
+                with metric_emitter.file_conversion_duration.time():
+                    await run_ffmpeg(
+                        command,
+                        duration=duration,
+                        stall_timeout=configuration.get_conversion_stall_timeout_seconds(),
+                        time_budget=configuration.get_conversion_time_budget(duration),
+                    )
+            finally:
+                if not first_segments.done():
+                    first_segments.cancel()
+                    await asyncio.gather(first_segments, return_exceptions=True)
+                    first_segments = None
+            # A short video can finish between two polls.
+            if first_segments is None and on_playable:
+                await on_playable(playlist_file)
+            metric_emitter.files_converted.inc()
+
+            await asyncio.to_thread(os.remove, input_file)
+            log.info(f"HLS conversion completed for file '{input_file}'")
+        except BaseException as e:
+            log.error(f"Failed to convert video '{input_file}' to HLS in '{hls_dir}': {e!r}")
+            # Off the loop, as the segments can be large. The thread finishes the cleanup even
+            # if this task is cancelled again while waiting for it.
+            await asyncio.to_thread(shutil.rmtree, hls_dir, True)
+            raise
+
+    async def _wait_for_first_segments(self, playlist_file: str, on_playable):
+        while True:
+            await asyncio.sleep(HLS_POLL_SECONDS)
+            try:
+                with open(playlist_file) as playlist:
+                    if "#EXTINF" not in playlist.read():
+                        continue
+            except FileNotFoundError:
+                continue
+            log.info(f"First segments of '{playlist_file}' are ready.")
+            if on_playable:
+                await on_playable(playlist_file)
+            return
@@ -0,0 +1,80 @@
+import asyncio
+import json
+from dataclasses import dataclass
+
+from torrent_agent.common import logger
+
+log = logger.get_logger()
+
+# Codecs every mainstream browser can play from an MP4 container.
+BROWSER_FRIENDLY_VIDEO_CODECS = ["h264"]
+BROWSER_FRIENDLY_AUDIO_CODECS = ["aac", "mp3"]
+BROWSER_FRIENDLY_PIXEL_FORMATS = ["yuv420p", "yuvj420p"]
+
+CONVERSION_REMUX = "remux"
+CONVERSION_AUDIO_TRANSCODE = "audio_transcode"
+CONVERSION_FULL_TRANSCODE = "transcode"
+
+@dataclass
+class VideoProbe:
+    video_codec: str = None
+    pix_fmt: str = None
+    audio_codec: str = None
+    width: int = 0
+    height: int = 0
+    duration: float = 0.0
+    video_streams: int = 0
+    audio_streams: int = 0
+
+    def is_video_browser_friendly(self):
+        return self.video_codec in BROWSER_FRIENDLY_VIDEO_CODECS and self.pix_fmt in BROWSER_FRIENDLY_PIXEL_FORMATS
+
+    def is_audio_browser_friendly(self):
+        return self.audio_streams == 0 or self.audio_codec in BROWSER_FRIENDLY_AUDIO_CODECS
+
+    def conversion_mode(self):
+        """
+        Returns the cheapest conversion that makes the file playable in a browser:
+        a stream-copy remux, an audio-only transcode, or a full transcode.
+        """
+        if not self.is_video_browser_friendly():
+            return CONVERSION_FULL_TRANSCODE
+        if not self.is_audio_browser_friendly():
+            return CONVERSION_AUDIO_TRANSCODE
+        return CONVERSION_REMUX
+
+    @classmethod
+    def from_ffprobe(cls, data: dict):
+        streams = data.get("streams", [])
+        video_streams = [stream for stream in streams if stream.get("codec_type") == "video" and not stream.get("disposition", {}).get("attached_pic")]
+        audio_streams = [stream for stream in streams if stream.get("codec_type") == "audio"]
+        video = video_streams[0] if video_streams else {}
+        audio = audio_streams[0] if audio_streams else {}
+        duration = data.get("format", {}).get("duration") or video.get("duration") or 0
+        return cls(
+            video_codec=video.get("codec_name"),
+            pix_fmt=video.get("pix_fmt"),
+            audio_codec=audio.get("codec_name"),
+            width=int(video.get("width") or 0),
+            height=int(video.get("height") or 0),
+            duration=float(duration),
+            video_streams=len(video_streams),
+            audio_streams=len(audio_streams),
+        )
+
+async def probe_video(input_file: str) -> VideoProbe:
+    """
+    Run ffprobe on a file and summarise its first video and audio streams.
+    Raises RuntimeError if ffprobe fails.
+    """
+    process = await asyncio.create_subprocess_exec(
+        "ffprobe", "-v", "error", "-print_format", "json", "-show_streams", "-show_format", input_file,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    stdout, stderr = await process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError(f"ffprobe failed for '{input_file}': {stderr.decode(errors='replace').strip()}")
+    probe = VideoProbe.from_ffprobe(json.loads(stdout.decode(errors="replace") or "{}"))
+    log.debug(f"Probed '{input_file}': {probe}")
+    return probe